@@ -1,12 +1,22 @@
 import logging
+import math
 import os
+import sys
+import threading
+import time
 
+import qt
 import vtk
 
 import slicer
 from slicer.ScriptedLoadableModule import *
 from slicer.util import VTKObservationMixin
 
+# PointSelectorLib is found next to this file, also when it is run as a script before the module path is registered
+if os.path.dirname(os.path.abspath(__file__)) not in sys.path:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from PointSelectorLib import timedMethod
+
 
 #
 # PointSelector
@@ -25,7 +35,7 @@ class PointSelector(ScriptedLoadableModule):
         self.parent.contributors = ["Saima Safdar"]  # TODO: replace with "Firstname Lastname (Organization)"
         # TODO: update with short description of the module and a link to online module documentation
         self.parent.helpText = """
-This module help user select a point on a model and then move to the next model using a shortcut key ctrl+k  <a href="https://github.com/organization/projectname#PointSelector">module documentation</a>.
+This module help user select a point on a model and then move to the next model using a shortcut key ctrl+k (ctrl+j goes back to the previous model)  <a href="https://github.com/organization/projectname#PointSelector">module documentation</a>.
 """
         # TODO: replace with organization, grant and thanks
         self.parent.acknowledgementText = """
@@ -142,6 +152,16 @@ class PointSelectorWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 
         # Buttons
         self.ui.undoButton.connect('clicked(bool)', self.onUndoPress)
+        self.ui.redoButton.connect('clicked(bool)', self.onRedoPress)
+        self.ui.gridButton.connect('toggled(bool)', self.onGridToggled)
+        self.ui.qaButton.connect('clicked(bool)', self.onQAButton)
+        self.logic.switchProgressCallback = self.onSwitchProgress
+        self.ui.timingCheckBox.connect('toggled(bool)', self.onTimingToggled)
+
+        # Timing statistics are refreshed periodically while the module is shown
+        self.timingRefreshTimer = qt.QTimer()
+        self.timingRefreshTimer.setInterval(2000)
+        self.timingRefreshTimer.connect('timeout()', self.updateTimingPanel)
         self.ui.applyButton.connect('clicked(bool)', self.onApplyButton)
         
         #self.ui.P4PushButton.connect('clicked(bool)', lambda: self.onPointPushButton('P4'))
@@ -156,6 +176,9 @@ class PointSelectorWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         Called when the application closes and the module widget is destroyed.
         """
         self.removeObservers()
+        self.timingRefreshTimer.stop()
+        if self.logic:
+            self.logic.endSession()
 
     def enter(self):
         """
@@ -163,11 +186,13 @@ class PointSelectorWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         """
         # Make sure parameter node exists and observed
         self.initializeParameterNode()
+        self.timingRefreshTimer.start()
 
     def exit(self):
         """
         Called each time the user opens a different module.
         """
+        self.timingRefreshTimer.stop()
         # Do not react to parameter node changes (GUI wlil be updated when the user enters into the module)
         self.removeObserver(self._parameterNode, vtk.vtkCommand.ModifiedEvent, self.updateGUIFromParameterNode)
 
@@ -269,24 +294,60 @@ class PointSelectorWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     
         
     def onPointPushButton(self, button):
-        slicer.modules.markups.logic().SetActiveListID(self.markup_node)
-        n_point = self.markup_node.GetNumberOfControlPoints()
-        index = None
-        for i in range(n_point):
-            label = self.markup_node.GetNthControlPointLabel(i)
-            if label == button:
-                index = i
-                print('Index: ', index)
-                break
-        if not index:
+        markupNode = self.logic.fidNode
+        slicer.modules.markups.logic().SetActiveListID(markupNode)
+        index = self.logic.controlPointIndexByLabel(markupNode, button)
+        if index is None:
             raise ValueError('Point {0} not found.'.format(button))
-        self.markup_node.UnsetNthControlPointPosition(index)
-        self.markup_node.SetControlPointPlacementStartIndex(index)
-        self.markup_node.SetNthControlPointLabel(index, button)
+        logging.debug(f'Placing point {button} at index {index}')
+        markupNode.UnsetNthControlPointPosition(index)
+        markupNode.SetControlPointPlacementStartIndex(index)
+        markupNode.SetNthControlPointLabel(index, button)
         slicer.modules.markups.logic().StartPlaceMode(0)
     
+    def onTimingToggled(self, enabled):
+        self.logic.timer.enabled = enabled
+
+    def updateTimingPanel(self):
+        """
+        Show p50/p95 per stage and the throughput of the current session.
+        """
+        if self.ui.timingCollapsibleButton.collapsed:
+            return
+        stats, modelsPerHour = self.logic.timingStats()
+        if not stats:
+            self.ui.timingLabel.text = "No measurements yet"
+            return
+        rows = "".join(f"<tr><td>{name}</td><td align='right'>{stat['count']}</td>"
+                       f"<td align='right'>{stat['p50_ms']:.1f}</td><td align='right'>{stat['p95_ms']:.1f}</td></tr>"
+                       for name, stat in sorted(stats.items()))
+        self.ui.timingLabel.text = (f"<table><tr><th align='left'>Stage</th><th>n</th><th>p50 ms</th><th>p95 ms</th></tr>{rows}</table>"
+                                    f"<p>Throughput: {modelsPerHour:.1f} models/hour</p>")
+
+    def onGridToggled(self, checked):
+        with slicer.util.tryWithErrorDisplay("Failed to switch review grid mode.", waitCursor=True):
+            if checked:
+                self.logic.GRID_SIZE = self.ui.gridSizeSpinBox.value
+                self.logic.showGridPage(self.logic.INDEX_DATA)
+            else:
+                self.logic.exitGrid()
+
+    def onSwitchProgress(self, fileName):
+        self.ui.switchProgressBar.setVisible(fileName is not None)
+        if fileName is not None:
+            self.ui.switchProgressBar.setFormat(f"Loading {fileName}")
+
+    def onQAButton(self):
+        with slicer.util.tryWithErrorDisplay("Failed to check landmarks.", waitCursor=True):
+            report = self.logic.reviewLandmarks()
+            flagged = report[(report.Outliers != "") | (report.Swaps != "")]
+            slicer.util.showStatusMessage(f"{len(flagged)} models with suspicious landmarks moved to the front", 5000)
+
     def onUndoPress(self):
         self.logic.undoCommand()
+
+    def onRedoPress(self):
+        self.logic.redoCommand()
         
     def onApplyButton(self):
         """
@@ -297,7 +358,8 @@ class PointSelectorWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
             # Compute output
             inputDir = self.ui.plyDir.directory
             nodeCounter = self.ui.nodeCounter.value
-            self.logic.process(inputDir, nodeCounter)#, self.ui.inputSelector.currentNode(), self.ui.outputSelector.currentNode())
+            self.logic.SUGGESTIONS = self.ui.suggestionsCheckBox.checked
+            self.logic.process(inputDir, nodeCounter, resume=self.ui.resumeCheckBox.checked)#, self.ui.inputSelector.currentNode(), self.ui.outputSelector.currentNode())
 
             # Compute inverted output (if needed)
             # if self.ui.invertedOutputSelector.currentNode():
@@ -310,6 +372,13 @@ class PointSelectorWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 # PointSelectorLogic
 #
 
+def _sessionAttribute(name, doc=None):
+    """
+    Logic attribute that reads and writes an attribute of the active session (PointSelectorLogic.session).
+    """
+    return property(lambda self: getattr(self.session, name), lambda self, value: setattr(self.session, name, value), doc=doc)
+
+
 class PointSelectorLogic(ScriptedLoadableModuleLogic):
     """This class should implement all the actual
     computation done by your module.  The interface
@@ -320,87 +389,677 @@ class PointSelectorLogic(ScriptedLoadableModuleLogic):
     https://github.com/Slicer/Slicer/blob/main/Base/Python/slicer/ScriptedLoadableModule.py
     
     """
-    import pandas as pd
-    df = pd.DataFrame()
     N_POINT = 3
-    INDEX_DATA = 0
-    modelDir = ''
     csv_input = " "
-    index = 0
-    pointCount = 0
-    nodeCounter = 0
+    # state of the active session, see PointSelectorLib.AnnotationSession
+    models = _sessionAttribute("models", "model file names of the session in annotation order (ModelList)")
+    INDEX_DATA = _sessionAttribute("indexData", "row of the current model in models")
+    modelDir = _sessionAttribute("modelDir")
+    nodeCounter = _sessionAttribute("nodeCounter", "number of landmarks to pick on each model")
+    index = _sessionAttribute("index")
+    pointCount = _sessionAttribute("pointCount")
+    contentHashes = _sessionAttribute("contentHashes")
+    landmarkStore = _sessionAttribute("landmarkStore")
+    journal = _sessionAttribute("journal")
+    workQueue = _sessionAttribute("workQueue")
+    # model files of a session: glob patterns relative to the model directory, and whether subfolders are searched.
+    # The directory is enumerated in the background and the session starts as soon as its first model is listed;
+    # models are added to the session in batches of up to MODEL_ENUMERATION_BATCH files.
+    MODEL_PATTERNS = ("*.ply",)
+    MODEL_RECURSIVE = False
+    MODEL_ENUMERATION_BATCH = 1000
+    # number of models after the current one that are read in the background
+    N_PREFETCH = 2
+    # memory limit of the prefetched models cache
+    PREFETCH_CACHE_MB = 1024
+    # landmarks.csv is written in batches: on this timer, on model switch, or when this many rows are waiting
+    LANDMARKS_FLUSH_INTERVAL_MS = 2000
+    LANDMARKS_MAX_BUFFERED_ROWS = 100
+    # "never", "flush" or "always", see PointSelectorLib.LandmarkStore
+    LANDMARKS_FSYNC_POLICY = "flush"
+    # number of edits that can still be undone after a session is closed and resumed, see PointSelectorLib.LandmarkJournal
+    LANDMARKS_UNDO_HISTORY = 1000
+    # "csv": landmarks.csv and an operation log file are the session store,
+    # "sqlite": models, landmarks and edit history are kept in a database in SESSION_DATABASE_DIR and
+    # landmarks.csv is derived from it, see PointSelectorLib.SessionDatabase
+    LANDMARKS_BACKEND = "csv"
+    SESSION_DATABASE_DIR = ".pointselector"
+    # picked landmarks are snapped to the model: "surface" (closest point on a cell), "vertex" or None to keep raw positions
+    SNAP_MODE = "surface"
+    # level of detail mode: fraction of triangles kept in the displayed proxies, None shows full resolution models.
+    # Landmarks are still snapped to the full resolution model.
+    LOD_RATIO = None
+    # proxies are cached in this subfolder of the model directory
+    PROXY_CACHE_DIR = ".pointselector/proxies"
+    # read models from binary .vtp copies, converted once per model file content (e.g. from slow ASCII PLY),
+    # and stored in this subfolder of the model directory
+    NORMALIZED_MODELS = False
+    NORMALIZED_MODELS_DIR = ".pointselector/models"
+    # threads converting the models of a session that have no binary copy yet in the background
+    NORMALIZED_MODELS_WORKERS = 2
+    # typed columnar copy of landmarks.csv written at the end of a session: "feather", "parquet", "npz" or None
+    LANDMARKS_EXPORT_FORMAT = None
+    # write the landmarks of a session into the .mrk.json files of their models when the session ends, so the markups
+    # files and landmarks.csv agree, see writeBackMarkups. Off by default, the .mrk.json files are often inputs;
+    # the first version of each rewritten file is kept as <name>.mrk.json.bak
+    MARKUPS_WRITE_BACK = False
+    # point the camera of the 3D view at the landmarks of each model when it is shown: those recorded in the session or
+    # in its .mrk.json, else the region where the other models have theirs, looking along its smallest principal axis.
+    # Principal axes frames and landmark regions are computed once per model by the prefetcher or the directory scan
+    # and cached in this file next to models_ids.csv.
+    CAMERA_FRAMING = True
+    VIEW_FRAMES_FILE = "models_views.json"
+    # keep one model node and one markups node and only swap their data when switching models,
+    # instead of clearing the scene and creating new nodes for each model
+    NODE_RECYCLING = True
+    # markups node classes created for parsed .mrk.json types, other types are loaded with the markups reader
+    MARKUPS_CLASS_NAMES = {
+        "Fiducial": "vtkMRMLMarkupsFiducialNode",
+        "Line": "vtkMRMLMarkupsLineNode",
+        "Angle": "vtkMRMLMarkupsAngleNode",
+        "Curve": "vtkMRMLMarkupsCurveNode",
+        "ClosedCurve": "vtkMRMLMarkupsClosedCurveNode",
+    }
+    # review grid: number of models per page, and layout id and view singleton tag prefix of the grid views
+    GRID_SIZE = 8
+    GRID_LAYOUT_ID = 1500
+    GRID_VIEW_TAG = "PointSelectorGrid"
+    # number of threads reading models in the background
+    PREFETCH_WORKERS = 4
+    # ctrl+k/ctrl+j return immediately: the model is read on a prefetch thread and shown once ready, checked at this interval.
+    # Key presses while a model is loading move the target instead of queueing loads.
+    ASYNC_SWITCHING = True
+    SWITCH_POLL_INTERVAL_MS = 20
+    # suggest positions of the landmarks not placed yet from curvature and geodesic distances learned on completed models,
+    # ctrl+l accepts the next suggestion. Mesh features are cached in this subfolder of the model directory.
+    SUGGESTIONS = False
+    SUGGESTION_CACHE_DIR = ".pointselector/features"
+    SUGGESTION_PRIOR_MODELS = 20
+    # shared cohort: name of the annotator of this session, None for a single annotator.
+    # Models are claimed CLAIM_BATCH at a time from a queue in the model directory and leased for CLAIM_LEASE_SECONDS
+    # (renewed while the session runs), landmarks go to landmarks.<annotator>.csv, see mergeLandmarks().
+    ANNOTATOR = None
+    CLAIM_BATCH = 5
+    CLAIM_LEASE_SECONDS = 3600
+    WORK_QUEUE_FILE = ".pointselector/queue.sqlite"
+    # per-stage timing of the annotation loop, written to .pointselector/trace.jsonl in the model directory
+    TIMING_ENABLED = True
+    TRACE_FILE = ".pointselector/trace.jsonl"
+    # landmark QA: a landmark is an outlier when its distance to the Procrustes mean is more than this many times
+    # the median distance of its index, two landmarks are swapped when exchanging them reduces their distance by this ratio
+    QA_OUTLIER_THRESHOLD = 4.0
+    QA_SWAP_RATIO = 0.5
     
     def initialize_points(self):
+        import numpy as np
         slicer.modules.markups.logic().SetActiveListID(self.markup_node)
         self.markup_node.SetControlPointLabelFormat('P%d')
-        for i in range(1, self.N_POINT + 1):
-            self.markup_node.AddControlPoint([0, 0, 0])
-        self.markup_node.UnsetAllControlPoints()
+        #all points are added unplaced in one call
+        self.setControlPointArrays(self.markup_node, np.zeros((self.N_POINT, 3)),
+                                   labels=[f"P{i}" for i in range(1, self.N_POINT + 1)],
+                                   statuses=np.full(self.N_POINT, slicer.vtkMRMLMarkupsNode.PositionUndefined))
         self.markup_node.SetMaximumNumberOfControlPoints(self.N_POINT)
         
         
+    @timedMethod("switchNextModel")
     def switchNextModel(self):
-        print("switching next model")
-        self.pointCount = 0
-        #getting the index of the model and getting the model name on that index
-        self.INDEX_DATA = self.INDEX_DATA+1
-        print("inside")
-        print(self.modelDir)
-        print(self.INDEX_DATA)
-        print(self.df)
-        
-        #add a check if all the model files in the folder are loaded if yes then exit the program and user should not press the shortcut anymore
-        #getting the length of the df
-        lengthDF = len(self.df)
-        print("length")
-        print(lengthDF)
-        if lengthDF == self.INDEX_DATA:
-            exit(0)
+        #in review grid mode the shortcut moves to the next page
+        if self.gridFirstIndex is not None:
+            if self.gridFirstIndex + self.GRID_SIZE < len(self.models):
+                self.flushLandmarks()
+                self.showGridPage(self.gridFirstIndex + self.GRID_SIZE)
+            return
+        #INDEX_DATA stays on the shown model until the next one is loaded, so picks meanwhile go to the right model
+        targetIndex = (self.pendingIndex if self.pendingIndex is not None else self.INDEX_DATA) + 1
+        logging.debug(f'Switching to model {targetIndex} of {len(self.models)}')
         
-        nextModelIndex = self.df.index.get_loc(self.INDEX_DATA) #nodeTotal will be the number of fiducials added from there you get to know how many models done and what is the next index of the model
-        nextModel = self.df.iloc[self.INDEX_DATA].FileNames     # this will give the name of the file to be loaded from the folder 
-        #modelDir = "/media/useradmin/Disk2/Slicer-5.3.0-2023-01-21-linux-amd64/Case1"  #directory remains the same but how to get the directory name here not hard coded
+        #after the last model the session stays on it, landmarks are written when the session is closed
+        if self.pendingIndex is None:
+            self.completeCurrentModel()
+        #the end of the list may not be enumerated yet
+        self.session.waitForModels(targetIndex + 1)
+        if targetIndex == len(self.models) and (self.workQueue is None or not self.claimMoreModels()):
+            self.cancelPendingSwitch()
+            self.flushLandmarks()
+            logging.info('Last model reached, all models of the directory were shown')
+            slicer.util.showStatusMessage("Last model reached: all models of the directory were shown", 5000)
+            return
         
         #switching back the curser to non placement mode to select the location of the new model again
         # placeModePersistence = 0
         # slicer.modules.markups.logic().StartPlaceMode(placeModePersistence) 
-        #before loading the next model clear the scene
-        slicer.mrmlScene.Clear(0)
-      
-        #loading the next model
-        modelNode = slicer.util.loadModel(self.modelDir + "/" + nextModel)
-        size = len(nextModel)
-        nextModel = nextModel[:size - 4]
-        fidNode = slicer.util.loadMarkups(self.modelDir + "/" + nextModel + ".mrk.json")
+        #landmarks of the finished model are written on a worker thread while the next one is loaded
+        with self.timer.stage("switchNextModel.flushLandmarks"):
+            self.flushLandmarksInBackground()
+        if self.pendingIndex is None:
+            self.timer.modelCompleted()
+        #loading the next model, usually already read by the prefetcher
+        self.requestModelAtIndex(targetIndex)
+
+    @timedMethod("switchPreviousModel")
+    def switchPreviousModel(self):
+        """
+        Go back to the previous model in the list. It is normally still in the prefetch cache.
+        """
+        if self.gridFirstIndex is not None:
+            if self.gridFirstIndex > 0:
+                self.flushLandmarks()
+                self.showGridPage(max(self.gridFirstIndex - self.GRID_SIZE, 0))
+            return
+        targetIndex = (self.pendingIndex if self.pendingIndex is not None else self.INDEX_DATA) - 1
+        if targetIndex < 0:
+            logging.info("Already at the first model")
+            return
+        self.flushLandmarksInBackground()
+        self.requestModelAtIndex(targetIndex)
+
+    def requestModelAtIndex(self, indexData):
+        """
+        Switch to the model at row indexData of self.models without blocking the UI (ASYNC_SWITCHING).
+        The model is read with priority by the prefetcher, the scene is updated on the main thread once it is ready
+        (finishPendingSwitch). Until then the current model stays shown and switchProgressCallback is called with
+        the file name being loaded (and with None when done).
+        """
+        if not self.ASYNC_SWITCHING:
+            self.INDEX_DATA = indexData
+            self.loadModelAtIndex(indexData)
+            return
+        if self.prefetcher is None:
+            self.startPrefetcher()
+        self.pendingIndex = indexData
+        fileName = self.models[indexData]
+        self.prefetcher.prefetch([fileName], urgent=True)
+        if self.prefetcher.isReady(fileName):
+            self.finishPendingSwitch()
+            return
+        slicer.util.showStatusMessage(f"Loading {fileName} ...")
+        if self.switchProgressCallback:
+            self.switchProgressCallback(fileName)
+        if self.switchTimer is None:
+            self.switchTimer = qt.QTimer()
+            self.switchTimer.setInterval(self.SWITCH_POLL_INTERVAL_MS)
+            self.switchTimer.connect('timeout()', self.onSwitchTimer)
+        self.switchTimer.start()
+
+    def onSwitchTimer(self):
+        if self.pendingIndex is None:
+            self.switchTimer.stop()
+        elif self.prefetcher is None or self.prefetcher.isReady(self.models[self.pendingIndex]):
+            self.finishPendingSwitch()
+
+    def finishPendingSwitch(self):
+        """
+        Show the model requested by requestModelAtIndex, waiting for it if it is still being read.
+        """
+        if self.switchTimer is not None:
+            self.switchTimer.stop()
+        if self.pendingIndex is None:
+            return
+        indexData = self.pendingIndex
+        self.pendingIndex = None
+        try:
+            self.INDEX_DATA = indexData
+            self.loadModelAtIndex(indexData)
+        except Exception as e:
+            logging.error(f'Loading {self.models[indexData]} failed: {e}')
+            raise
+        finally:
+            slicer.util.showStatusMessage("")
+            if self.switchProgressCallback:
+                self.switchProgressCallback(None)
+
+    def cancelPendingSwitch(self):
+        if self.switchTimer is not None:
+            self.switchTimer.stop()
+        if self.pendingIndex is not None:
+            self.pendingIndex = None
+            if self.switchProgressCallback:
+                self.switchProgressCallback(None)
+
+    def startPrefetcher(self):
+        """
+        Start a background reader for the models of self.modelDir, replacing any previous one.
+        """
+        from PointSelectorLib import ModelPrefetcher, NormalizedModelBuilder, ProxyBuilder
+        self.stopPrefetcher()
+        proxyCache = self.proxyCache()
+        normalizedCache = self.normalizedModelCache()
+        self.viewFrames = self.viewFrameCache()
+        self.prefetcher = ModelPrefetcher(self.modelDir, self.PREFETCH_CACHE_MB * 1024 * 1024,
+                                          buildLocators=bool(self.SNAP_MODE), proxyCache=proxyCache,
+                                          workers=self.PREFETCH_WORKERS, normalizedCache=normalizedCache,
+                                          viewFrames=self.viewFrames)
+        modelPaths = [os.path.join(self.modelDir, fileName) for fileName in self.models]
+        if proxyCache is not None:
+            #proxies of the whole list are built in order, so that first visits are fast too
+            self.proxyBuilder = ProxyBuilder(proxyCache, modelPaths[self.INDEX_DATA:])
+        if normalizedCache is not None:
+            #binary copies of the whole list are converted in order as well
+            self.normalizedModelBuilder = NormalizedModelBuilder(normalizedCache, modelPaths[self.INDEX_DATA:],
+                                                                 workers=self.NORMALIZED_MODELS_WORKERS)
+
+    def stopPrefetcher(self):
+        if self.proxyBuilder is not None:
+            self.proxyBuilder.stop()
+            self.proxyBuilder = None
+        if self.normalizedModelBuilder is not None:
+            self.normalizedModelBuilder.stop()
+            self.normalizedModelBuilder = None
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+            self.prefetcher = None
+        if self.viewFrames is not None:
+            self.viewFrames.save()
+            self.viewFrames = None
+
+    def proxyCache(self, modelDir=None):
+        """
+        Return the ProxyCache of a model directory (self.modelDir by default), or None if level of detail mode is off.
+        """
+        from PointSelectorLib import ProxyCache
+        if not self.LOD_RATIO:
+            return None
+        return ProxyCache(os.path.join(modelDir or self.modelDir, self.PROXY_CACHE_DIR), self.LOD_RATIO,
+                          hashes=self.contentHashes)
+
+    def viewFrameCache(self, modelDir=None):
+        """
+        Return the ViewFrameCache of a model directory (self.modelDir by default), or None if CAMERA_FRAMING is off.
+        """
+        from PointSelectorLib import ViewFrameCache
+        if not self.CAMERA_FRAMING:
+            return None
+        return ViewFrameCache(os.path.join(modelDir or self.modelDir, self.VIEW_FRAMES_FILE), hashes=self.contentHashes)
+
+    def normalizedModelCache(self, modelDir=None):
+        """
+        Return the NormalizedModelCache of a model directory (self.modelDir by default), or None if NORMALIZED_MODELS is off.
+        """
+        from PointSelectorLib import NormalizedModelCache
+        if not self.NORMALIZED_MODELS:
+            return None
+        return NormalizedModelCache(os.path.join(modelDir or self.modelDir, self.NORMALIZED_MODELS_DIR),
+                                    hashes=self.contentHashes)
+
+    def loadModelAtIndex(self, indexData):
+        """
+        Show the model at row indexData of self.models with its markups, either in the recycled model and markups nodes
+        (NODE_RECYCLING) or in new nodes after clearing the scene.
+        The model is taken from the prefetch cache if available, then the neighbouring models are queued for prefetching.
+        """
+        if self.prefetcher is None:
+            self.startPrefetcher()
+        modelFileName = self.models[indexData]
+        #this only waits if the prefetcher has not finished reading the model yet
+        with self.timer.stage("load.read"):
+            entry = self.prefetcher.get(modelFileName)
+
+        if self.NODE_RECYCLING:
+            with self.timer.stage("load.updateNodes"):
+                modelNode, fidNode = self.updateRecycledNodes(entry)
+        else:
+            #before loading the model clear the scene
+            with self.timer.stage("load.clearScene"):
+                slicer.mrmlScene.Clear(0)
+            #in level of detail mode the decimated proxy is displayed, picks are snapped to the full resolution model
+            with self.timer.stage("load.addModel"):
+                modelNode = slicer.modules.models.logic().AddModel(entry.displayPolyData)
+                modelNode.SetName(os.path.splitext(modelFileName)[0])
+            with self.timer.stage("load.addMarkups"):
+                fidNode = self.addMarkupsNode(entry)
+                fidNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointEndInteractionEvent, self.onMarkupEndInteraction)
+        if self.CAMERA_FRAMING:
+            with self.timer.stage("load.camera"):
+                self.frameCamera(entry)
+        if self.timer.enabled:
+            #rendering would otherwise happen later in the event loop and not be measured
+            with self.timer.stage("load.render"):
+                slicer.util.forceRenderAllViews()
+        self.currentEntry = entry
+        self.modelNode = modelNode
+        self.fidNode = fidNode
+        #landmarks already recorded for this model count towards nodeCounter, e.g. when going back
+        self.pointCount = self.landmarkStore.countForModel(modelFileName) if self.landmarkStore else 0
+        if self.suggester is not None:
+            self.requestSuggestions()
+
+        # the next models are read first, the previous one is kept for going back
+        lastIndex = min(indexData + self.N_PREFETCH, len(self.models) - 1)
+        prefetchIndices = list(range(indexData + 1, lastIndex + 1))
+        if indexData > 0:
+            prefetchIndices.append(indexData - 1)
+        self.prefetcher.prefetch([self.models[i] for i in prefetchIndices])
+        return modelNode, fidNode
+
+    def frameCamera(self, entry):
+        """
+        Point the camera of the first 3D view at the landmarks of a prefetched model, see CAMERA_FRAMING.
+        The landmarks recorded in the session are used first, then those of its .mrk.json, then the region where
+        the other models of the directory have theirs; without any the whole model is shown.
+        """
+        from PointSelectorLib import cameraParameters, landmarkRegion
+        layoutManager = slicer.app.layoutManager()
+        if entry.viewFrame is None or layoutManager is None or layoutManager.threeDViewCount == 0:
+            return
+        frame = entry.viewFrame
+        recorded = self.landmarkStore.landmarksForModel(entry.fileName) if self.landmarkStore is not None else {}
+        if recorded:
+            region = landmarkRegion(frame, list(recorded.values()))
+            region = (region["landmarkCenter"], region["landmarkRadius"])
+        elif frame["landmarkCenter"] is not None:
+            region = (frame["landmarkCenter"], frame["landmarkRadius"])
+        else:
+            region = self.viewFrames.expectedLandmarkRegion(frame) if self.viewFrames is not None else None
+        viewNode = layoutManager.threeDWidget(0).mrmlViewNode()
+        cameraNode = slicer.modules.cameras.logic().GetViewActiveCameraNode(viewNode)
+        position, focalPoint, viewUp = cameraParameters(frame, region, cameraNode.GetViewAngle())
+        wasModified = cameraNode.StartModify()
+        cameraNode.SetFocalPoint(*focalPoint)
+        cameraNode.SetPosition(*position)
+        cameraNode.SetViewUp(*viewUp)
+        cameraNode.EndModify(wasModified)
+        cameraNode.ResetClippingRange()
+
+    def addMarkupsNode(self, entry):
+        """
+        Create the markups node of a prefetched model with the control points and properties of its .mrk.json.
+        Markups types that were not parsed in the background, and files with properties that cannot be applied
+        (see applyMarkupsProperties), are loaded from the .mrk.json file with the markups reader instead.
+        """
+        from PointSelectorLib import markupsFilePath
+        markups = entry.markups
+        if markups is not None and markups["type"] in self.MARKUPS_CLASS_NAMES:
+            fidNode = slicer.mrmlScene.AddNewNodeByClass(self.MARKUPS_CLASS_NAMES[markups["type"]], markups["name"])
+            fidNode.CreateDefaultDisplayNodes()
+            if self.applyMarkupsProperties(fidNode, markups):
+                self.setControlPoints(fidNode, markups)
+                return fidNode
+            slicer.mrmlScene.RemoveNode(fidNode)
+        return slicer.util.loadMarkups(markupsFilePath(os.path.join(self.modelDir, entry.fileName)))
+
+    @staticmethod
+    def markupsPropertiesKey(markups):
+        """
+        Return a string identifying the list properties of parsed markups (locked, labelFormat, display),
+        a markups node showing them can be reused for markups with the same key.
+        """
+        import json
+        return json.dumps([markups["locked"], markups["labelFormat"], markups["display"]], sort_keys=True)
+
+    def applyMarkupsProperties(self, fidNode, markups):
+        """
+        Apply the list properties of a parsed .mrk.json file to a new markups node: locked state, label format and
+        the display properties, each set with the display node setter of the same name as in the markups reader
+        (e.g. "glyphScale" with SetGlyphScale, "glyphType" with SetGlyphTypeFromString).
+        Returns False if a property has no setter or the file has measurements, the file is then loaded with
+        the markups reader.
+        """
+        if markups["measurements"]:
+            return False
+        fidNode.SetLocked(markups["locked"])
+        if markups["labelFormat"] is not None:
+            fidNode.SetMarkupLabelFormat(markups["labelFormat"])
+        displayNode = fidNode.GetDisplayNode()
+        for name, value in (markups["display"] or {}).items():
+            name = name[0].upper() + name[1:]
+            try:
+                if isinstance(value, str):
+                    fromString = getattr(displayNode, f"Set{name}FromString", None)
+                    if fromString is not None:
+                        fromString(value)
+                        continue
+                    value = getattr(displayNode, f"Get{name}FromString")(value)
+                getattr(displayNode, f"Set{name}")(value)
+            except (AttributeError, TypeError, ValueError) as e:
+                logging.debug(f'Markups display property {name} of {markups["name"]} not applied: {e}')
+                return False
+        fidNode.SetAttribute("PointSelector.MarkupsProperties", self.markupsPropertiesKey(markups))
+        return True
+
+    def setControlPoints(self, fidNode, markups):
+        """
+        Replace the control points of a markups node with the parsed positions, labels, descriptions and
+        selected, locked and visibility states of a .mrk.json file.
+        """
+        import numpy as np
+        wasModified = fidNode.StartModify()
+        try:
+            self.setControlPointArrays(fidNode, np.array(markups["positions"]).reshape(-1, 3), labels=markups["labels"])
+            for i, (description, selected, locked, visibility) in enumerate(zip(
+                    markups["descriptions"], markups["selected"], markups["pointLocked"], markups["visibilities"])):
+                fidNode.SetNthControlPointDescription(i, description)
+                fidNode.SetNthControlPointSelected(i, selected)
+                fidNode.SetNthControlPointLocked(i, locked)
+                fidNode.SetNthControlPointVisibility(i, visibility)
+        finally:
+            fidNode.EndModify(wasModified)
+
+    def getControlPointArrays(self, markupsNode):
+        """
+        Return all control points of a markups node as arrays: positions (N,3), labels (N,) and
+        position statuses (N,) (vtkMRMLMarkupsNode.PositionUndefined, PositionPreview, PositionDefined or PositionMissing).
+        """
+        import numpy as np
+        import vtk
+        count = markupsNode.GetNumberOfControlPoints()
+        positions = slicer.util.arrayFromMarkupsControlPoints(markupsNode) if count else np.zeros((0, 3))
+        labelArray = vtk.vtkStringArray()
+        markupsNode.GetControlPointLabels(labelArray)
+        labels = np.array([labelArray.GetValue(i) for i in range(labelArray.GetNumberOfValues())], dtype=str)
+        statuses = np.fromiter((markupsNode.GetNthControlPointPositionStatus(i) for i in range(count)), dtype=np.int8, count=count)
+        return positions, labels, statuses
+
+    def setControlPointArrays(self, markupsNode, positions, labels=None, statuses=None):
+        """
+        Replace all control points of a markups node from an (N,3) position array, with optional labels and
+        position statuses (see getControlPointArrays). The node is modified in a single batch.
+        """
+        import numpy as np
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        wasModified = markupsNode.StartModify()
+        try:
+            if len(positions):
+                slicer.util.updateMarkupsControlPointsFromArray(markupsNode, positions)
+            else:
+                markupsNode.RemoveAllControlPoints()
+            if labels is not None:
+                for i, label in enumerate(labels):
+                    markupsNode.SetNthControlPointLabel(i, str(label))
+            if statuses is not None:
+                statuses = np.asarray(statuses)
+                for i in np.flatnonzero(statuses == slicer.vtkMRMLMarkupsNode.PositionUndefined):
+                    markupsNode.UnsetNthControlPointPosition(int(i))
+                for i in np.flatnonzero(statuses == slicer.vtkMRMLMarkupsNode.PositionMissing):
+                    markupsNode.SetNthControlPointPositionMissing(int(i))
+        finally:
+            markupsNode.EndModify(wasModified)
+
+    def controlPointIndexByLabel(self, markupsNode, label):
+        """
+        Return the index of the control point with a label, or None. The label to index dictionary of a node
+        is built once and reused until the node is modified.
+        """
+        key = (markupsNode.GetID(), markupsNode.GetMTime())
+        cached = self._labelIndices.get(markupsNode.GetID())
+        if cached is None or cached[0] != key:
+            _, labels, _ = self.getControlPointArrays(markupsNode)
+            labelIndex = {}
+            for i, pointLabel in enumerate(labels):
+                labelIndex.setdefault(pointLabel, i)
+            cached = (key, labelIndex)
+            self._labelIndices[markupsNode.GetID()] = cached
+        return cached[1].get(label)
+
+    def updateRecycledNodes(self, entry):
+        """
+        Show a prefetched model in the model and markups nodes of the previous model, only swapping their
+        polydata and control points. The nodes and the interaction observer are created once per scene,
+        the markups node is only recreated if the markups type or list properties (see markupsPropertiesKey)
+        change or the file could not be parsed.
+        """
+        def isInScene(node):
+            return node is not None and slicer.mrmlScene.IsNodePresent(node)
+
+        if isInScene(self.modelNode):
+            self.modelNode.SetAndObservePolyData(entry.displayPolyData)
+            modelNode = self.modelNode
+        else:
+            modelNode = slicer.modules.models.logic().AddModel(entry.displayPolyData)
+        modelNode.SetName(os.path.splitext(entry.fileName)[0])
+
+        markups = entry.markups
+        className = self.MARKUPS_CLASS_NAMES.get(markups["type"]) if markups is not None else None
+        fidNode = self.fidNode if isInScene(self.fidNode) else None
+        if (fidNode is not None and className is not None and fidNode.GetClassName() == className
+                and fidNode.GetAttribute("PointSelector.MarkupsProperties") == self.markupsPropertiesKey(markups)):
+            fidNode.SetName(markups["name"])
+            self.setControlPoints(fidNode, markups)
+            return modelNode, fidNode
+        if fidNode is not None:
+            slicer.mrmlScene.RemoveNode(fidNode)
+        fidNode = self.addMarkupsNode(entry)
         fidNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointEndInteractionEvent, self.onMarkupEndInteraction)
-        #saving file name (model file name). 
-        self.csv_input.loc[self.INDEX_DATA,"FileName"]= nextModel+".ply"
-        self.csv_input.to_csv(self.modelDir+"/landmarks.csv", index=False)
-        
+        return modelNode, fidNode
+
+    def removeSingleModelNodes(self):
+        for node in (self.modelNode, self.fidNode):
+            if node is not None and slicer.mrmlScene.IsNodePresent(node):
+                slicer.mrmlScene.RemoveNode(node)
+        self.modelNode = None
+        self.fidNode = None
+
+    def gridLayoutDescription(self, count):
+        """
+        Return a layout description with count 3D views in rows of equal length, e.g. 2 rows of 4 for 8 views.
+        """
+        rows = max(1, int(math.sqrt(count)))
+        columns = int(math.ceil(count / rows))
+        rowItems = []
+        for row in range(rows):
+            views = "".join(
+                f'<item><view class="vtkMRMLViewNode" singletontag="{self.GRID_VIEW_TAG}{i+1}">'
+                f'<property name="viewlabel" action="default">{i+1}</property></view></item>'
+                for i in range(row * columns, min(count, (row + 1) * columns)))
+            rowItems.append(f'<item><layout type="horizontal">{views}</layout></item>')
+        return f'<layout type="vertical">{"".join(rowItems)}</layout>'
+
+    def setGridLayout(self, count):
+        """
+        Switch to a layout of count linked 3D views and return their view nodes.
+        """
+        layoutManager = slicer.app.layoutManager()
+        layoutId = self.GRID_LAYOUT_ID + count
+        layoutNode = layoutManager.layoutLogic().GetLayoutNode()
+        if not layoutNode.IsLayoutDescription(layoutId):
+            layoutNode.AddLayoutDescription(layoutId, self.gridLayoutDescription(count))
+        if self.gridPreviousLayout is None:
+            self.gridPreviousLayout = layoutManager.layout
+        layoutManager.setLayout(layoutId)
+        viewNodes = []
+        for i in range(count):
+            viewNode = slicer.mrmlScene.GetSingletonNode(f"{self.GRID_VIEW_TAG}{i+1}", "vtkMRMLViewNode")
+            #linked 3D views share camera changes
+            viewNode.SetLinkedControl(True)
+            viewNodes.append(viewNode)
+        return viewNodes
+
+    def showGridPage(self, firstIndex, count=None):
+        """
+        Review mode: show count models (GRID_SIZE by default) starting at row firstIndex of self.models, each in its own
+        3D view. The cameras of the views are linked, all markups use the display settings of the first tile and
+        control point interactions are recorded for the model shown in their view.
+        The models of a page are read in parallel by the prefetch workers and the next page is prefetched.
+        """
+        count = count or self.GRID_SIZE
+        self.cancelPendingSwitch()
+        if self.prefetcher is None:
+            self.startPrefetcher()
+        rows = list(range(firstIndex, min(firstIndex + count, len(self.models))))
+        if not rows:
+            return
+        fileNames = [self.models[row] for row in rows]
+        with self.timer.stage("grid.read"):
+            self.prefetcher.prefetch(fileNames)
+            entries = [self.prefetcher.get(fileName) for fileName in fileNames]
+
+        with self.timer.stage("grid.updateNodes"):
+            slicer.mrmlScene.StartState(slicer.mrmlScene.BatchProcessState)
+            try:
+                self.clearGrid()
+                self.removeSingleModelNodes()
+                viewNodes = self.setGridLayout(count)
+                sharedDisplayNode = None
+                for viewNode, row, entry in zip(viewNodes, rows, entries):
+                    modelNode = slicer.modules.models.logic().AddModel(entry.displayPolyData)
+                    modelNode.SetName(os.path.splitext(entry.fileName)[0])
+                    modelNode.GetDisplayNode().SetViewNodeIDs([viewNode.GetID()])
+                    fidNode = self.addMarkupsNode(entry)
+                    fidNode.CreateDefaultDisplayNodes()
+                    displayNode = fidNode.GetDisplayNode()
+                    if sharedDisplayNode is None:
+                        sharedDisplayNode = displayNode
+                    else:
+                        displayNode.CopyContent(sharedDisplayNode)
+                    displayNode.SetViewNodeIDs([viewNode.GetID()])
+                    observer = fidNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointEndInteractionEvent,
+                                                   lambda caller, event, row=row, entry=entry: self.onGridMarkupEndInteraction(caller, row, entry))
+                    self.gridTiles.append((row, modelNode, fidNode, observer))
+            finally:
+                slicer.mrmlScene.EndState(slicer.mrmlScene.BatchProcessState)
+        self.gridFirstIndex = firstIndex
+
+        nextRows = range(firstIndex + count, min(firstIndex + 2 * count, len(self.models)))
+        self.prefetcher.prefetch([self.models[row] for row in nextRows])
+
+    @timedMethod("onGridMarkupEndInteraction")
+    def onGridMarkupEndInteraction(self, markupsNode, row, entry):
+        markupsNodeindex = int(markupsNode.GetAttribute('Markups.MovingMarkupIndex'))
+        pos = [0, 0, 0]
+        markupsNode.GetNthControlPointPosition(markupsNodeindex, pos)
+        self.recordLandmark(self.models[row], markupsNode, markupsNodeindex, pos, entry)
+
+    def clearGrid(self):
+        for row, modelNode, fidNode, observer in self.gridTiles:
+            fidNode.RemoveObserver(observer)
+            slicer.mrmlScene.RemoveNode(fidNode)
+            slicer.mrmlScene.RemoveNode(modelNode)
+        self.gridTiles = []
+
+    def exitGrid(self):
+        """
+        Leave review mode and show the current model in the previous layout again.
+        """
+        if self.gridFirstIndex is None:
+            return
+        self.clearGrid()
+        self.gridFirstIndex = None
+        if self.gridPreviousLayout is not None:
+            slicer.app.layoutManager().setLayout(self.gridPreviousLayout)
+            self.gridPreviousLayout = None
+        self.loadModelAtIndex(self.INDEX_DATA)
         
     def addNewNode(self):
+        import numpy as np
         slicer.modules.markups.logic().SetActiveListID(self.markup_node)
-        n_point = self.markup_node.GetNumberOfControlPoints()
         placeModePersistence = 1
         slicer.modules.markups.logic().StartPlaceMode(placeModePersistence)  
         
-        for i in range(n_point):
-            self.markup_node.UnsetNthControlPointPosition(i)
-            self.markup_node.SetControlPointPlacementStartIndex(i)
-            self.markup_node.SetNthControlPointLabel(index, "p"+i)
+        #unsetting and relabelling all points in one call, placement starts again at the first point
+        positions, labels, statuses = self.getControlPointArrays(self.markup_node)
+        self.setControlPointArrays(self.markup_node, positions, labels=[f"p{i}" for i in range(len(positions))],
+                                   statuses=np.full(len(positions), slicer.vtkMRMLMarkupsNode.PositionUndefined))
+        self.markup_node.SetControlPointPlacementStartIndex(0)
             
         slicer.modules.markups.logic().StartPlaceMode(0)
         
     def onMarkupsAdded(self, caller, event):
         index=0
-        print(index)
         index+=1
         modelFileExt = "ply"
         
-        print(index)
         modelDir = "/media/useradmin/Disk2/Slicer-5.3.0-2023-01-21-linux-amd64/Case1"
         modelFiles = list(f for f in os.listdir(modelDir) if f.endswith("."+modelFileExt))
-        print(modelFiles)
+        logging.debug(modelFiles)
         placeModePersistence = 0
         slicer.modules.markups.logic().StartPlaceMode(placeModePersistence) 
         modelNode = slicer.util.loadModel(modelDir + "/" + modelFiles[index])
@@ -410,6 +1069,520 @@ class PointSelectorLogic(ScriptedLoadableModuleLogic):
         Called when the logic class is instantiated. Can be used for initializing member variables.
         """
         ScriptedLoadableModuleLogic.__init__(self)
+        from PointSelectorLib import AnnotationSession, StageTimer
+        # the session shown in the scene, and all open sessions by absolute model directory
+        self.session = AnnotationSession()
+        self.sessions = {}
+        self.timer = StageTimer(self.TIMING_ENABLED)
+        self.prefetcher = None
+        self.proxyBuilder = None
+        self.normalizedModelBuilder = None
+        self.viewFrames = None
+        self.flushTimer = None
+        self.flushFuture = None
+        self.flushExecutor = None
+        self._flushLock = threading.Lock()
+        self.pendingIndex = None
+        self.switchTimer = None
+        self.switchProgressCallback = None
+        self.suggester = None
+        self.suggestionNode = None
+        self.suggestionFuture = None
+        self.suggestionTimer = None
+        self.suggestions = {}
+        self.currentEntry = None
+        self.modelNode = None
+        self.fidNode = None
+        self._labelIndices = {}
+        self.gridFirstIndex = None
+        self.gridTiles = []
+        self.gridPreviousLayout = None
+
+    @property
+    def df(self):
+        """
+        Models of the active session as a dataframe with a FileNames column indexed by model id, for scripts.
+        """
+        import pandas as pd
+        return pd.DataFrame({'FileNames': list(self.models)}, index=[modelId for modelId, _ in self.models.items()])
+
+    def landmarksPath(self, session=None):
+        """
+        Return the landmarks file of a session (the active one by default): landmarks.csv,
+        or landmarks.<annotator>.csv in a shared session.
+        """
+        from PointSelectorLib import landmarkShardPath
+        session = session or self.session
+        if session.annotator:
+            return landmarkShardPath(session.modelDir, session.annotator)
+        return os.path.join(session.modelDir, "landmarks.csv")
+
+    def sessionDatabasePath(self, modelDir=None):
+        """
+        Return the session database of the sqlite backend: landmarks.sqlite, or landmarks.<annotator>.sqlite,
+        in SESSION_DATABASE_DIR of the model directory.
+        """
+        from PointSelectorLib import annotatorFileName
+        fileName = f"landmarks.{annotatorFileName(self.ANNOTATOR)}.sqlite" if self.ANNOTATOR else "landmarks.sqlite"
+        return os.path.join(modelDir or self.modelDir, self.SESSION_DATABASE_DIR, fileName)
+
+    def startLandmarkStore(self, truncate=True, session=None):
+        """
+        Open the landmarks file (see landmarksPath) and its operation log (landmarks.oplog.jsonl, or
+        landmarks.<annotator>.oplog.jsonl) of a session (the active one by default), or its session database
+        (LANDMARKS_BACKEND). The landmarks of all open sessions are flushed periodically.
+        If truncate is False the landmarks and undo history of the previous session are kept.
+        """
+        session = session or self.session
+        self.stopLandmarkStore(session)
+        session.landmarkStore, session.journal = self.openLandmarkJournal(session.modelDir, self.landmarksPath(session), truncate)
+        if self.flushTimer is None:
+            self.flushTimer = qt.QTimer()
+            self.flushTimer.setInterval(self.LANDMARKS_FLUSH_INTERVAL_MS)
+            self.flushTimer.connect('timeout()', self.flushLandmarks)
+            self.flushTimer.start()
+
+    def openLandmarkJournal(self, modelDir, landmarksPath, truncate=True):
+        """
+        Open a landmarks file of a model directory for editing, with the operation log next to it
+        (landmarks.oplog.jsonl) or as its session database in SESSION_DATABASE_DIR (LANDMARKS_BACKEND).
+        If truncate is False the landmarks and undo history already written are kept.
+        :return: (store, journal), close the journal before the store
+        """
+        from PointSelectorLib import LandmarkJournal, LandmarkStore, SessionDatabase, SessionJournal
+        if self.LANDMARKS_BACKEND == "sqlite":
+            databasePath = os.path.join(modelDir, self.SESSION_DATABASE_DIR,
+                                        os.path.basename(landmarksPath)[:-len(".csv")] + ".sqlite")
+            os.makedirs(os.path.dirname(databasePath), exist_ok=True)
+            store = SessionDatabase(databasePath,
+                                    fsyncPolicy=self.LANDMARKS_FSYNC_POLICY,
+                                    maximumBufferedRows=self.LANDMARKS_MAX_BUFFERED_ROWS,
+                                    truncate=truncate, csvPath=landmarksPath)
+            journal = SessionJournal(store, truncate=truncate, maximumHistory=self.LANDMARKS_UNDO_HISTORY)
+        else:
+            store = LandmarkStore(landmarksPath,
+                                  fsyncPolicy=self.LANDMARKS_FSYNC_POLICY,
+                                  maximumBufferedRows=self.LANDMARKS_MAX_BUFFERED_ROWS, truncate=truncate)
+            journal = LandmarkJournal(landmarksPath[:-len(".csv")] + ".oplog.jsonl", store,
+                                      truncate=truncate, maximumHistory=self.LANDMARKS_UNDO_HISTORY)
+        return store, journal
+
+    def firstIncompleteModelIndex(self):
+        """
+        Return the row of self.models of the first model with less than nodeCounter landmarks,
+        or the last row if all models are complete. Models still being enumerated are only waited for
+        until an incomplete one is listed.
+        """
+        checked = 0
+        while True:
+            self.session.waitForModels(checked + 1)
+            count = len(self.models)
+            if count == checked:
+                break
+            incomplete = self.landmarkStore.incompleteModels([self.models[row] for row in range(checked, count)], self.nodeCounter)
+            if incomplete:
+                return self.models.row(incomplete[0])
+            checked = count
+        logging.info('All models have their landmarks')
+        return max(len(self.models) - 1, 0)
+
+    def flushLandmarks(self):
+        """
+        Write pending landmarks and operations of all open sessions. Removed landmarks are compacted out of
+        landmarks.csv on a worker thread.
+        """
+        with self._flushLock:
+            for session in list(self.sessions.values()):
+                if session.landmarkStore is None:
+                    continue
+                session.flush()
+                if session.landmarkStore.stale:
+                    session.landmarkStore.compactInBackground()
+                #claimed models stay leased while the session runs
+                if session.workQueue is not None and time.time() - session.leaseRenewedTime > self.CLAIM_LEASE_SECONDS / 4:
+                    session.workQueue.renew()
+                    session.leaseRenewedTime = time.time()
+            self.timer.flush()
+
+    def startWorkQueue(self, session):
+        """
+        Shared session: add the models of a session to the queue of its model directory and claim the first
+        CLAIM_BATCH of them. The models of the session are then only the claimed ones, with their model ids.
+        """
+        from PointSelectorLib import ModelList, WorkQueue
+        os.makedirs(os.path.dirname(os.path.join(session.modelDir, self.WORK_QUEUE_FILE)), exist_ok=True)
+        session.workQueue = WorkQueue(os.path.join(session.modelDir, self.WORK_QUEUE_FILE), session.annotator, self.CLAIM_LEASE_SECONDS)
+        session.workQueue.addModels(session.models)
+        session.leaseRenewedTime = time.time()
+        session.queuedModels = session.models
+        session.models = ModelList()
+        if not self.claimMoreModels(session):
+            raise ValueError(f'All models of {session.modelDir} are done or claimed by other annotators')
+
+    def claimMoreModels(self, session=None):
+        """
+        Claim the next CLAIM_BATCH models of a shared session (the active one by default) and append them to
+        its models. Returns the number of new models.
+        """
+        session = session or self.session
+        claimed = []
+        for fileName in session.workQueue.claim(self.CLAIM_BATCH):
+            row = session.queuedModels.row(fileName)
+            if row is not None and fileName not in session.models:
+                claimed.append((session.queuedModels.modelId(row), fileName))
+        if claimed:
+            session.models.append([fileName for _, fileName in claimed], [modelId for modelId, _ in claimed])
+            logging.info(f'{session.annotator} claimed {len(claimed)} models: {session.workQueue.status()}')
+        return len(claimed)
+
+    def completeCurrentModel(self, session=None):
+        """
+        Shared session: mark the current model as done in the queue once it has all its landmarks.
+        """
+        session = session or self.session
+        if session.workQueue is None or session.landmarkStore is None or not len(session.models):
+            return
+        fileName = session.currentFileName
+        if session.landmarkStore.countForModel(fileName) >= session.nodeCounter:
+            session.workQueue.complete(fileName)
+
+    def stopWorkQueue(self, session=None):
+        """
+        Complete the current model if it has all its landmarks and give the other claimed models back.
+        """
+        session = session or self.session
+        if session.workQueue is None:
+            return
+        self.completeCurrentModel(session)
+        session.workQueue.release()
+        session.workQueue = None
+
+    def mergeLandmarks(self, inputDir=None, outputPath=None):
+        """
+        Merge the landmarks files of all annotators of a shared cohort (landmarks.<annotator>.csv) into one file.
+        The landmarks of a model come from the annotator who completed it in the queue.
+        Can be used without GUI widget, see main().
+        :param inputDir: model directory, the current session by default
+        :param outputPath: merged file, landmarks.csv in the model directory by default
+        :return: summary dictionary, see PointSelectorLib.mergeLandmarkShards
+        """
+        from PointSelectorLib import WorkQueue, landmarkShardPaths, mergeLandmarkShards
+        inputDir = inputDir or self.modelDir
+        if os.path.abspath(inputDir) in self.sessions:
+            self.flushLandmarks()
+        queuePath = os.path.join(inputDir, self.WORK_QUEUE_FILE)
+        owners = WorkQueue(queuePath, None).owners() if os.path.exists(queuePath) else {}
+        summary = mergeLandmarkShards(landmarkShardPaths(inputDir), outputPath or os.path.join(inputDir, "landmarks.csv"), owners)
+        logging.info(f'Merged {summary["landmarks"]} landmarks of {summary["models"]} models, '
+                     f'{len(summary["conflicts"])} models annotated more than once')
+        return summary
+
+    def flushLandmarksInBackground(self):
+        """
+        Run flushLandmarks on a worker thread, so the file writes and fsync do not block a model switch.
+        A flush that is still running covers the request.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        if self.flushFuture is not None and not self.flushFuture.done():
+            return
+        if self.flushExecutor is None:
+            self.flushExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="PointSelectorFlush")
+        self.flushFuture = self.flushExecutor.submit(self.flushLandmarks)
+
+    def stopLandmarkStore(self, session=None):
+        """
+        Close the landmark writer of a session (the active one by default).
+        """
+        session = session or self.session
+        if self.flushFuture is not None:
+            self.flushFuture.result()
+            self.flushFuture = None
+        if session.journal is not None:
+            session.journal.close()
+            session.journal = None
+        if session.landmarkStore is not None:
+            session.landmarkStore.close()
+            session.landmarkStore = None
+        if self.flushTimer is not None and all(other.landmarkStore is None for other in self.sessions.values()):
+            self.flushTimer.stop()
+            self.flushTimer = None
+
+    def openSession(self, inputDir, nodeCounter, resume=True):
+        """
+        Open a session on a model directory without showing its models: open the landmark writer of the session
+        and start listing its models (MODEL_PATTERNS) while models_ids.csv is updated in the background, see
+        PointSelectorLib.ModelEnumerator. In a shared cohort (see ANNOTATOR) the whole directory is enumerated
+        first and only the claimed models are listed.
+        A session already open on the directory is closed first; sessions on other directories stay open,
+        so e.g. a batch job can record landmarks next to the interactive session (see process).
+        Can be used without GUI widget.
+        :param resume: keep the landmarks of a previous session, see process
+        :return: AnnotationSession, kept in self.sessions until closeSession
+        """
+        from PointSelectorLib import AnnotationSession, ContentHashes, ModelEnumerator
+        previous = self.sessions.get(os.path.abspath(inputDir))
+        if previous is not None:
+            self.closeSession(previous)
+        session = AnnotationSession(inputDir, nodeCounter, self.ANNOTATOR)
+        with self.timer.stage("process.landmarkStore"):
+            self.startLandmarkStore(truncate=not resume, session=session)
+        self.sessions[os.path.abspath(inputDir)] = session
+        #the proxy and normalized model caches are keyed by the hashes of models_ids.csv
+        session.contentHashes = ContentHashes()
+
+        def onModels(manifest, batch):
+            manifest.contentHashes(inputDir, [fileName for _, fileName in batch], session.contentHashes)
+
+        def onDone(manifest, changes):
+            added, changed, removed = changes
+            logging.info(f'{len(manifest)} models: {len(added)} new, {len(changed)} modified, {len(removed)} removed')
+            if self.LANDMARKS_BACKEND == "sqlite":
+                session.landmarkStore.setModels(manifest.items())
+            for fileName in changed:
+                if session.landmarkStore.countForModel(fileName):
+                    logging.warning(f'{fileName} was modified after its landmarks were picked')
+
+        #models_ids.csv keeps size, modification time and hash of each model, only new or modified files are hashed
+        session.enumerator = ModelEnumerator(os.path.join(inputDir, "models_ids.csv"), inputDir, session.models,
+                                             self.MODEL_PATTERNS, self.MODEL_RECURSIVE, batchSize=self.MODEL_ENUMERATION_BATCH,
+                                             onModels=onModels, onDone=onDone)
+        #in a shared session only the models claimed by this annotator are listed
+        if session.annotator:
+            try:
+                with self.timer.stage("process.enumerate"):
+                    session.waitForModels()
+                self.startWorkQueue(session)
+            except Exception:
+                self.closeSession(session)
+                raise
+        return session
+
+    def closeSession(self, session):
+        """
+        Complete or give back the claimed models of a session, write its landmarks into the .mrk.json files
+        (MARKUPS_WRITE_BACK) and close its landmark writer.
+        Closing the active session leaves the logic without a session until the next process().
+        """
+        from PointSelectorLib import AnnotationSession
+        if session.enumerator is not None:
+            session.enumerator.stop()
+            session.enumerator = None
+        if self.MARKUPS_WRITE_BACK and session.landmarkStore is not None:
+            self.writeBackMarkups(session=session)
+        self.stopWorkQueue(session)
+        self.stopLandmarkStore(session)
+        if self.sessions.get(os.path.abspath(session.modelDir)) is session:
+            del self.sessions[os.path.abspath(session.modelDir)]
+        if session is self.session:
+            self.session = AnnotationSession()
+
+    def sessionFor(self, inputDir=None):
+        """
+        Return the open session of a model directory (the active session by default), or None.
+        """
+        if inputDir is None:
+            return self.session if self.session.landmarkStore is not None else None
+        return self.sessions.get(os.path.abspath(inputDir))
+
+    def endSession(self):
+        """
+        Write all pending landmarks and stop background work. Called when the module widget is destroyed.
+        """
+        if self.landmarkStore is not None and self.LANDMARKS_EXPORT_FORMAT:
+            self.exportLandmarks(format=self.LANDMARKS_EXPORT_FORMAT)
+        self.cancelPendingSwitch()
+        self.stopSuggester()
+        for session in list(self.sessions.values()):
+            self.closeSession(session)
+        self.closeSession(self.session)
+        self.stopPrefetcher()
+        if self.flushExecutor is not None:
+            self.flushExecutor.shutdown()
+            self.flushExecutor = None
+        self.timer.close()
+
+    def timingStats(self):
+        """
+        Return per-stage timing statistics (see PointSelectorLib.StageTimer.stats) and the annotation throughput.
+        """
+        return self.timer.stats(), self.timer.modelsPerHour()
+
+    def openLandmarks(self, inputDir):
+        """
+        Open the landmarks of another model directory for reading: its session database with the sqlite backend
+        (read while that session runs), otherwise landmarks.csv. Close the returned store after use.
+        """
+        from PointSelectorLib import LandmarkStore, SessionDatabase
+        databasePath = self.sessionDatabasePath(inputDir)
+        if self.LANDMARKS_BACKEND == "sqlite" and os.path.exists(databasePath):
+            return SessionDatabase(databasePath, truncate=False)
+        return LandmarkStore(os.path.join(inputDir, "landmarks.csv"), truncate=False)
+
+    def exportLandmarks(self, outputPath=None, format="feather", inputDir=None):
+        """
+        Write landmarks as typed columns (model_id, file_name, index, x, y, z, vertex_id, distance, timestamp),
+        so they can be loaded without parsing position strings.
+        Can be used without GUI widget, see main().
+        :param outputPath: output file, landmarks.<format> in the model directory by default
+        :param format: "feather" (memory-mappable), "parquet" or "npz", see PointSelectorLib.writeLandmarkColumns
+        :param inputDir: model directory with landmarks.csv and models_ids.csv, the current session by default
+        :return: path of the written file
+        """
+        import pandas as pd
+        from PointSelectorLib import EXPORT_FORMATS, landmarkColumns, writeLandmarkColumns
+
+        session = self.sessionFor(inputDir)
+        if session is not None:
+            session.waitForModels()
+            inputDir = session.modelDir
+            items = session.landmarkStore.items()
+            #rows may have been reordered by reviewLandmarks, the model ids are kept
+            modelIds = {fileName: modelId for modelId, fileName in session.models.items()}
+        elif inputDir is None:
+            raise ValueError('No session is open, give the model directory to export')
+        else:
+            store = self.openLandmarks(inputDir)
+            items = store.items()
+            store.close()
+            modelIds = pd.read_csv(os.path.join(inputDir, "models_ids.csv"), index_col=0).FileNames
+            modelIds = {fileName: i for i, fileName in modelIds.items()}
+        if outputPath is None:
+            outputPath = os.path.join(inputDir, "landmarks" + EXPORT_FORMATS.get(format, ""))
+        writeLandmarkColumns(landmarkColumns(items, modelIds), outputPath, format)
+        logging.info(f'Exported {len(items)} landmarks to {outputPath}')
+        return outputPath
+
+    def validateMarkups(self, inputDir=None, landmarkCount=None, workers=None):
+        """
+        Parse and check the .mrk.json files of all models of a directory in parallel: schema errors, missing files
+        and point counts different from landmarkCount are reported, see PointSelectorLib.validateMarkupsFiles.
+        Can be used without GUI widget, see main().
+        :param inputDir: model directory, the current session by default
+        :param landmarkCount: expected number of control points per model, nodeCounter of the session by default
+        :param workers: number of reader threads
+        :return: the report dictionary, also written to markups_report.json in the model directory
+        """
+        import json
+        from PointSelectorLib import iterModelFiles, validateMarkupsFiles
+
+        session = self.sessionFor(inputDir)
+        if session is not None:
+            session.waitForModels()
+            inputDir = session.modelDir
+            fileNames = list(session.queuedModels if session.queuedModels is not None else session.models)
+            landmarkCount = landmarkCount or session.nodeCounter or None
+        elif inputDir is None:
+            raise ValueError('No session is open, give the model directory to validate')
+        else:
+            fileNames = [fileName for fileName, _ in iterModelFiles(inputDir, self.MODEL_PATTERNS, self.MODEL_RECURSIVE)]
+        with self.timer.stage("markups.validate"):
+            report = validateMarkupsFiles(inputDir, fileNames, landmarkCount, workers)
+        with open(os.path.join(inputDir, "markups_report.json"), "w") as file:
+            json.dump(report, file, indent=1)
+        for record in report["models"]:
+            if record["status"] != "ok":
+                logging.warning(f'{record["fileName"]}: {"; ".join(record["errors"])}')
+        logging.info(f'Checked {report["numberOfModels"]} markups files: {len(report["missing"])} missing, '
+                     f'{len(report["invalid"])} invalid, {len(report["count"])} with another number of points')
+        return report
+
+    def writeBackMarkups(self, inputDir=None, session=None):
+        """
+        Write the latest landmarks into the .mrk.json files of their models in one parallel pass, keeping the rest of
+        each file and a .bak copy of its original. Files whose positions did not change are not rewritten,
+        see PointSelectorLib.writeBackLandmarks.
+        Called when a session ends (MARKUPS_WRITE_BACK). Can be used without GUI widget, see main().
+        :param inputDir: model directory with landmarks.csv, the current session by default
+        :param session: open session to write back, instead of inputDir
+        :return: summary dictionary with the written, unchanged and failed models
+        """
+        from PointSelectorLib import writeBackLandmarks
+
+        session = session or self.sessionFor(inputDir)
+        if session is not None:
+            inputDir = session.modelDir
+            items = session.landmarkStore.items()
+        elif inputDir is None:
+            raise ValueError('No session is open, give the model directory to write back')
+        else:
+            store = self.openLandmarks(inputDir)
+            items = store.items()
+            store.close()
+        landmarks = {}
+        for fileName, index, (position, _, _), _ in items:
+            landmarks.setdefault(fileName, {})[index] = position
+        with self.timer.stage("markups.writeBack"):
+            summary = writeBackLandmarks(inputDir, landmarks)
+        for fileName, error in summary["failed"]:
+            logging.warning(f'Writing the landmarks of {fileName} to its .mrk.json failed: {error}')
+        logging.info(f'Wrote landmarks to {len(summary["written"])} markups files, {len(summary["unchanged"])} unchanged')
+        return summary
+
+    def reviewLandmarks(self, reorder=True, inputDir=None, landmarkCount=None):
+        """
+        Check the consistency of the landmarks of all models: the landmark sets are aligned by generalized
+        Procrustes analysis, then landmarks far from the mean (QA_OUTLIER_THRESHOLD) and pairs of landmarks that
+        look swapped (QA_SWAP_RATIO) are flagged, see PointSelectorLib.landmarkOutliers.
+        Can be used without GUI widget, see main().
+        :param reorder: move the flagged models to the front of the current session so they are revisited first,
+          and show the first of them
+        :param inputDir: model directory with landmarks.csv and models_ids.csv, the current session by default
+        :param landmarkCount: number of landmarks per model, nodeCounter or the highest picked index by default
+        :return: dataframe with one row per model in review order: FileNames, Score (highest landmark score),
+          Outliers and Swaps (space separated landmark indices)
+        """
+        import numpy as np
+        import pandas as pd
+        from PointSelectorLib import generalizedProcrustes, landmarkArray, landmarkColumns, landmarkOutliers, reviewOrder
+
+        session = self.sessionFor(inputDir)
+        if session is not None:
+            session.waitForModels()
+            items = session.landmarkStore.items()
+            fileNames = list(session.models)
+            modelIds = [modelId for modelId, _ in session.models.items()]
+            landmarkCount = landmarkCount or session.nodeCounter or None
+        elif inputDir is None:
+            raise ValueError('No session is open, give the model directory to review')
+        else:
+            store = self.openLandmarks(inputDir)
+            items = store.items()
+            store.close()
+            manifestFileNames = pd.read_csv(os.path.join(inputDir, "models_ids.csv"), index_col=0).FileNames
+            fileNames, modelIds = list(manifestFileNames), list(manifestFileNames.index)
+        #rows of the landmark array are positions in fileNames, not model ids
+        columns = landmarkColumns(items, {fileName: row for row, fileName in enumerate(fileNames)})
+        if landmarkCount is None:
+            landmarkCount = int(columns["index"].max()) + 1 if len(columns["index"]) else 0
+
+        with self.timer.stage("qa.procrustes"):
+            shapes = landmarkArray(columns, len(fileNames), landmarkCount)
+            aligned, mean = generalizedProcrustes(shapes)
+        with self.timer.stage("qa.outliers"):
+            qa = landmarkOutliers(aligned, mean, threshold=self.QA_OUTLIER_THRESHOLD, swapRatio=self.QA_SWAP_RATIO)
+            order = reviewOrder(qa)
+
+        def indexLists(mask):
+            return [" ".join(str(i) for i in np.flatnonzero(row)) for row in mask]
+        report = pd.DataFrame({
+            "FileNames": np.asarray(fileNames),
+            "Score": np.nan_to_num(qa["scores"], nan=0.0).max(axis=1, initial=0.0),
+            "Outliers": indexLists(qa["outliers"]),
+            "Swaps": indexLists(qa["swaps"] >= 0),
+        }, index=modelIds).iloc[order]
+        flaggedCount = int(((report.Outliers != "") | (report.Swaps != "")).sum())
+        logging.info(f'Landmark QA: {flaggedCount} of {len(report)} models flagged')
+
+        if reorder and session is self.session:
+            self.flushLandmarks()
+            self.models = self.models.reordered(order)
+            if flaggedCount:
+                if self.gridFirstIndex is not None:
+                    self.showGridPage(0)
+                else:
+                    self.INDEX_DATA = 0
+                    self.loadModelAtIndex(self.INDEX_DATA)
+        return report
 
     def setDefaultParameters(self, parameterNode):
         """
@@ -421,132 +1594,256 @@ class PointSelectorLogic(ScriptedLoadableModuleLogic):
             parameterNode.SetParameter("Invert", "false")
 
 
+    def startSuggester(self):
+        """
+        Start the landmark suggestion engine of the session (SUGGESTIONS). Its prior is seeded in the background
+        with the latest SUGGESTION_PRIOR_MODELS models listed so far that already have all their landmarks.
+        """
+        from PointSelectorLib import LandmarkSuggester, readModelFile
+        self.stopSuggester()
+        if not self.SUGGESTIONS:
+            return
+        normalizedCache = self.normalizedModelCache()
+        self.suggester = LandmarkSuggester(os.path.join(self.modelDir, self.SUGGESTION_CACHE_DIR), self.nodeCounter,
+                                           hashes=self.contentHashes, maximumPriorModels=self.SUGGESTION_PRIOR_MODELS,
+                                           readModel=normalizedCache.readModel if normalizedCache else readModelFile)
+        incomplete = set(self.landmarkStore.incompleteModels(self.models, self.nodeCounter))
+        completed = [fileName for fileName in self.models if fileName not in incomplete]
+        for fileName in completed[-self.SUGGESTION_PRIOR_MODELS:]:
+            self.suggester.addCompletedModel(os.path.join(self.modelDir, fileName), self.landmarkStore.landmarksForModel(fileName))
+
+    def stopSuggester(self):
+        if self.suggestionTimer is not None:
+            self.suggestionTimer.stop()
+        if self.suggester is not None:
+            self.suggester.stop()
+            self.suggester = None
+        self.suggestionFuture = None
+        self.suggestions = {}
+
+    def requestSuggestions(self):
+        """
+        Compute suggestions for the landmarks of the current model on the suggestion worker, they are shown when ready.
+        A completed model is added to the prior of the following models instead.
+        """
+        if self.suggester is None or self.gridFirstIndex is not None or self.currentEntry is None:
+            return
+        fileName = self.models[self.INDEX_DATA]
+        modelPath = os.path.join(self.modelDir, fileName)
+        positions = self.landmarkStore.landmarksForModel(fileName)
+        if len(positions) >= self.nodeCounter:
+            self.suggester.addCompletedModel(modelPath, positions, self.currentEntry.polyData)
+            self.suggestionFuture = None
+            self.showSuggestions(fileName, {})
+            return
+        self.suggestionFuture = (fileName, self.suggester.suggest(modelPath, positions, self.currentEntry.polyData))
+        if self.suggestionTimer is None:
+            self.suggestionTimer = qt.QTimer()
+            self.suggestionTimer.setInterval(self.SWITCH_POLL_INTERVAL_MS)
+            self.suggestionTimer.connect('timeout()', self.onSuggestionTimer)
+        self.suggestionTimer.start()
+
+    def onSuggestionTimer(self):
+        if self.suggestionFuture is None:
+            self.suggestionTimer.stop()
+            return
+        fileName, future = self.suggestionFuture
+        if not future.done():
+            return
+        self.suggestionTimer.stop()
+        self.suggestionFuture = None
+        try:
+            suggestions = future.result()
+        except Exception as e:
+            logging.warning(f'Suggesting landmarks for {fileName} failed: {e}')
+            suggestions = {}
+        self.showSuggestions(fileName, suggestions)
+
+    def showSuggestions(self, fileName, suggestions):
+        """
+        Show suggested landmark positions ({landmarkIndex: position}) of a model in a locked markups node.
+        Suggestions of a model that is not shown anymore are dropped.
+        """
+        import numpy as np
+        if self.gridFirstIndex is not None or fileName != self.models[self.INDEX_DATA]:
+            return
+        self.suggestions = dict(suggestions)
+        if self.suggestionNode is None or slicer.mrmlScene.GetNodeByID(self.suggestionNode.GetID()) is None:
+            self.suggestionNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode", "Suggestions")
+            self.suggestionNode.CreateDefaultDisplayNodes()
+            self.suggestionNode.SetLocked(True)
+            self.suggestionNode.GetDisplayNode().SetSelectedColor(1.0, 0.8, 0.0)
+            self.suggestionNode.GetDisplayNode().SetOpacity(0.6)
+        indices = sorted(self.suggestions)
+        self.setControlPointArrays(self.suggestionNode, np.array([self.suggestions[index] for index in indices]).reshape(-1, 3),
+                                   labels=[f"P{index + 1}?" for index in indices])
+
+    def acceptSuggestion(self):
+        """
+        Place the suggested landmark with the lowest index on the current model, as if the user had picked it.
+        """
+        if not self.suggestions or self.fidNode is None:
+            return
+        index = min(self.suggestions)
+        position = self.suggestions.pop(index)
+        while self.fidNode.GetNumberOfControlPoints() <= index:
+            self.fidNode.AddControlPoint(position)
+        self.fidNode.SetNthControlPointPosition(index, *position)
+        modelFileName = self.models[self.INDEX_DATA]
+        if self.recordLandmark(modelFileName, self.fidNode, index, list(position), self.currentEntry):
+            self.pointCount = self.landmarkStore.countForModel(modelFileName)
+        self.requestSuggestions()
+
+    @timedMethod("onMarkupEndInteraction")
     def onMarkupEndInteraction(self, caller, event):
-        import csv
         markupsNode = caller
         markupsNodeindex = int(caller.GetAttribute('Markups.MovingMarkupIndex'))
         pos = [0,0,0]
         markupsNode.GetNthControlPointPosition(markupsNodeindex, pos)
         #sliceView = markupsNode.GetAttribute("Markups.MovingInSliceView")
         #movingMarkupIndex = markupsNode.GetDisplayNode().GetActiveControlPoint()
-        print(markupsNodeindex)
-        print(pos)
         #saving file name (model file name). index which is selected by the user and the position x,y,z coordinates
-        import pandas as pd
         #df=pd.DataFrame({})
         #.loc[row, column] = some thing
         self.index = self.index+1
         
-        modelFileName =  self.df.iloc[self.INDEX_DATA].FileNames
+        modelFileName =  self.models[self.INDEX_DATA]
         # self.csv_input.loc[self.index,"FileName"]= modelFileName
         # self.csv_input.loc[self.index,"Index_no"]= markupsNodeindex
         # self.csv_input.loc[self.index, "Position/location-x,y,z"] = str(pos)
         position = str(pos)
-        print(modelFileName+","+str(markupsNodeindex)+","+ str(pos))
+        logging.debug(f'{modelFileName},{markupsNodeindex},{pos}')
         #new_data= {'FileName':modelFileName, 'Index_no':str(markupsNodeindex), 'Position/location-x,y,z':position}
         #df=pd.DataFrame([new_data])
         #self.csv_input.to_csv(self.modelDir+"/landmarks.csv", index=False)
         #df.to_csv(self.modelDir+"/landmarks.csv", index=False, mode='a')
         #print(movingMarkupIndex)
         #logging.info("End interaction: point ID = {0}, slice view = {1}".format(movingMarkupIndex, sliceView))
-        self.pointCount = self.pointCount+1
-        if self.pointCount<=self.nodeCounter:
-            with open(self.modelDir+"/landmarks.csv", 'a', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow([modelFileName, markupsNodeindex, position])
-        else:
-            print("no adding of points allowed")
-       
+        if self.recordLandmark(modelFileName, markupsNode, markupsNodeindex, pos, self.currentEntry):
+            self.pointCount = self.landmarkStore.countForModel(modelFileName)
+            self.requestSuggestions()
+
+    def recordLandmark(self, modelFileName, markupsNode, markupsNodeindex, pos, entry):
+        """
+        Snap a picked control point to the surface of its model and record it in the landmark journal.
+        Moving an already recorded landmark is always allowed, new landmarks only up to nodeCounter per model.
+        Returns True if the landmark was recorded.
+        """
+        if self.landmarkStore.get(modelFileName, markupsNodeindex) is None and self.landmarkStore.countForModel(modelFileName) >= self.nodeCounter:
+            logging.debug("No more landmarks can be added to this model")
+            return False
+        vertexId, distance = None, None
+        locator = entry.locator if entry else None
+        if self.SNAP_MODE and locator is not None:
+            #snapping the picked position to the model surface, the vertex id and distance are saved as well
+            with self.timer.stage("pick.snap"):
+                pos, vertexId, distance = locator.snap(pos, self.SNAP_MODE)
+                markupsNode.SetNthControlPointPosition(markupsNodeindex, *pos)
+        with self.timer.stage("pick.record"):
+            self.journal.record(modelFileName, markupsNodeindex, pos, vertexId, distance)
+        return True
+
+    def deleteLandmark(self, markupsNodeindex):
+        """
+        Remove a recorded landmark of the current model. The deletion can be undone.
+        """
+        modelFileName = self.models[self.INDEX_DATA]
+        operation = self.journal.record(modelFileName, markupsNodeindex, None)
+        if operation is not None:
+            self.pointCount = self.landmarkStore.countForModel(modelFileName)
+            self.restoreControlPoint(operation.index, operation.position)
+        return operation
+
+    @timedMethod("undoCommand")
     def undoCommand(self):
-        import csv
         #run when undo button pressed
-        if self.pointCount > self.nodeCounter:
-            self.pointCount = self.pointCount-2
-            f = open(self.modelDir+"/landmarks.csv", "r+")
-            lines = f.readlines()
-            lines.pop()
-            f = open(self.modelDir+"/landmarks.csv", "w+")
-            f.writelines(lines)
-        elif self.pointCount <= self.nodeCounter:
-            self.pointCount = self.pointCount-1
-            f = open(self.modelDir+"/landmarks.csv", "r+")
-            lines = f.readlines()
-            lines.pop()
-            f = open(self.modelDir+"/landmarks.csv", "w+")
-            f.writelines(lines)
-        elif self.pointCount == 0:
-            print("dont do any more subtraction")
-        print(self.pointCount)
+        operation = self.journal.undo()
+        if operation is None:
+            logging.debug("Nothing to undo")
+            return
+        self.pointCount = self.landmarkStore.countForModel(self.models[self.INDEX_DATA])
+        if operation.fileName == self.models[self.INDEX_DATA]:
+            self.restoreControlPoint(operation.index, operation.previousPosition)
+            self.requestSuggestions()
+
+    @timedMethod("redoCommand")
+    def redoCommand(self):
+        #run when redo button pressed
+        operation = self.journal.redo()
+        if operation is None:
+            logging.debug("Nothing to redo")
+            return
+        self.pointCount = self.landmarkStore.countForModel(self.models[self.INDEX_DATA])
+        if operation.fileName == self.models[self.INDEX_DATA]:
+            self.restoreControlPoint(operation.index, operation.position)
+            self.requestSuggestions()
+
+    def restoreControlPoint(self, markupsNodeindex, position):
+        """
+        Move a control point of the current markups node to position. If position is None the point goes back to
+        where the .mrk.json file placed it.
+        """
+        if self.fidNode is None or markupsNodeindex >= self.fidNode.GetNumberOfControlPoints():
+            return
+        if position is None:
+            markups = self.currentEntry.markups if self.currentEntry else None
+            if markups is None or markupsNodeindex >= len(markups["positions"]):
+                return
+            position = markups["positions"][markupsNodeindex]
+        self.fidNode.SetNthControlPointPosition(markupsNodeindex, *position)
         
         
         
-    def process(self, inputDir, nodeCounter):#, inputVolume, outputVolume):
+    @timedMethod("process")
+    def process(self, inputDir, nodeCounter, resume=True):#, inputVolume, outputVolume):
         """
         Run the processing algorithm.
         Can be used without GUI widget.
-        :param inputVolume: volume to be thresholded
-        :param outputVolume: thresholding result
-        :param imageThreshold: values above/below this threshold will be set to 0
-        :param invert: if True then values above the threshold will be set to 0, otherwise values below are set to 0
-        :param showResult: show output volume in slice viewers
+        :param inputDir: directory containing the .ply files and their .mrk.json markups
+        :param nodeCounter: number of landmarks to pick on each model
+        :param resume: keep landmarks.csv of a previous session and start at the first model with less than
+          nodeCounter landmarks, otherwise landmarks.csv is cleared and the session starts at the first model
         """
         global index
-        print(inputDir)
         #if not inputVolume or not outputVolume:
         #    raise ValueError("Input or output volume is invalid")
 
-        import time
         startTime = time.time()
         logging.info('Processing started')
         logging.info('Search for .ply files')
-        self.modelDir = inputDir
-        modelFileExt = "ply"
+        self.cancelPendingSwitch()
+        self.timer.reset()
+        self.timer.setTracePath(os.path.join(inputDir, self.TRACE_FILE))
         
-        import math
-        import os
-        
-        modelFiles = list(f for f in os.listdir(self.modelDir) if f.endswith("."+modelFileExt))
-        print(modelFiles)
-        
-        import pandas as pd
-        
-        #dataframe to store all the ply files name along with index
-        self.df = pd.DataFrame(list(zip(modelFiles)), columns =['FileNames'])
-        
-        filepath = inputDir+"/models_ids.csv"
-        self.df.to_csv(filepath, index=True)
+        #the session shown so far is replaced, sessions opened on other directories stay open
+        self.closeSession(self.session)
+        self.session = self.openSession(inputDir, nodeCounter, resume)
         
         #creating another dataframe empty initially to store the filename, index of the point selected by the user and the position x y z coordinates saving the file csv
         # filePath2 = inputDir+"/landmarks.csv"
         # df = pd.DataFrame(list(zip(" ", " ", " ")), columns =['FileName', 'Index_no', 'Position/location-x,y,z'])
         # df.to_csv(filePath2, index=True)
-        #setting the node counter for all the models
-        self.nodeCounter = nodeCounter
-        import csv
-        with open(self.modelDir+"/landmarks.csv", 'w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(['FileName', 'Index_no', 'Position/Location-x,y,z'])
+        #only the models up to the first one to annotate have to be listed, the rest is enumerated in the background
+        with self.timer.stage("process.firstModel"):
+            self.session.waitForModels(1)
+            if not len(self.models):
+                self.closeSession(self.session)
+                raise ValueError(f"No model files matching {', '.join(self.MODEL_PATTERNS)} found in {inputDir}")
+            self.INDEX_DATA = self.firstIncompleteModelIndex() if resume else 0
+        self.startSuggester()
         
         #load models and show in 3D view
-        print(self.INDEX_DATA)
-        modelFileName =  self.df.iloc[self.INDEX_DATA].FileNames
+        logging.info(f'Starting at model {self.INDEX_DATA} of {len(self.models)}')
         
         #saving the filename in the landmarks csv file the first column
         #self.csv_input = pd.read_csv(inputDir+"/landmarks.csv")
         #self.csv_input.loc[self.INDEX_DATA,"FileName"]= modelFileName
         #self.csv_input.to_csv(inputDir+"/landmarks.csv", index=False)
       
-        #loading the first model in the list
-        modelNode = slicer.util.loadModel(self.modelDir + "/" + modelFileName)
-        
-        
-        size = len(modelFileName)
-        modelFileName = modelFileName[:size - 4]
-        #loading the fiducials (control ppoint) relevant to the model
-        fidNode = slicer.util.loadMarkups(self.modelDir+"/"+modelFileName+".mrk.json")
-        
-        
-        fidNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointEndInteractionEvent, self.onMarkupEndInteraction)
+        #loading the first model in the list and the fiducials (control ppoint) relevant to the model,
+        #the following models are read in the background meanwhile
+        self.startPrefetcher()
+        self.loadModelAtIndex(self.INDEX_DATA)
         #now turning on the node placement mode and then placcing the fiducial at the specified point on the model
         # node_id = slicer.modules.markups.logic().AddNewFiducialNode('modelFileName') #modelFileName frm the list dataframe
         # self.markup_node = slicer.mrmlScene.GetNodeByID(node_id)
@@ -556,7 +1853,6 @@ class PointSelectorLogic(ScriptedLoadableModuleLogic):
         #slicer.modules.markups.logic().StartPlaceMode(placeModePersistence) 
         #markup_node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode")
         
-        import qt
         # shortcut1 = qt.QShortcut(qt.QKeySequence('p'), slicer.util.mainWindow())
         # shortcut1.connect('activated()', self.addNewNode)
         
@@ -566,9 +1862,18 @@ class PointSelectorLogic(ScriptedLoadableModuleLogic):
         
         #markup_node.AddObserver(slicer.vtkMRMLMarkupsNode.PointAddedEvent, self.onMarkupsAdded)
         
-        shortcut = qt.QShortcut(slicer.util.mainWindow())
-        shortcut.setKey(qt.QKeySequence('ctrl+k'))
-        shortcut.connect( 'activated()', self.switchNextModel)
+        #there is no main window for the shortcuts when running headless, e.g. in runBenchmark
+        if slicer.util.mainWindow():
+            shortcut = qt.QShortcut(slicer.util.mainWindow())
+            shortcut.setKey(qt.QKeySequence('ctrl+k'))
+            shortcut.connect( 'activated()', self.switchNextModel)
+            previousShortcut = qt.QShortcut(slicer.util.mainWindow())
+            previousShortcut.setKey(qt.QKeySequence('ctrl+j'))
+            previousShortcut.connect('activated()', self.switchPreviousModel)
+            if self.suggester is not None:
+                acceptShortcut = qt.QShortcut(slicer.util.mainWindow())
+                acceptShortcut.setKey(qt.QKeySequence('ctrl+l'))
+                acceptShortcut.connect('activated()', self.acceptSuggestion)
 
         
         #placeModePersistence = 0
@@ -592,6 +1897,304 @@ class PointSelectorLogic(ScriptedLoadableModuleLogic):
         stopTime = time.time()
         logging.info(f'Processing completed in {stopTime-startTime:.2f} seconds')
 
+    def measureStartup(self, repeat=5):
+        """
+        Measure what Slicer pays when it discovers the module: importing PointSelectorLib and executing this file,
+        and, for comparison, the imports deferred to the first session. Imports are timed in fresh PythonSlicer
+        interpreters, see PointSelectorLib.importTimes.
+        Can be used without GUI widget, see main().
+        :return: {"imports": [importTimes results], "module_ms": time to execute this file with slicer already loaded}
+        """
+        import importlib.util
+        import shutil
+        from PointSelectorLib import importTimes
+        moduleDir = os.path.dirname(os.path.abspath(__file__))
+        # sys.executable is the Slicer application, PythonSlicer is its plain interpreter
+        executable = shutil.which("PythonSlicer")
+        statements = ["import PointSelectorLib",
+                      "from PointSelectorLib import timedMethod",
+                      "from PointSelectorLib import LandmarkJournal, LandmarkStore, ModelManifest, ModelPrefetcher",
+                      "import pandas"]
+        imports = [importTimes(statement, [moduleDir], repeat, executable) for statement in statements]
+        # executed again under another name, as at module discovery
+        spec = importlib.util.spec_from_file_location("PointSelectorStartupCheck", os.path.join(moduleDir, "PointSelector.py"))
+        startTime = time.perf_counter()
+        spec.loader.exec_module(importlib.util.module_from_spec(spec))
+        return {"imports": imports, "module_ms": (time.perf_counter() - startTime) * 1000.0}
+
+    def runBenchmark(self, cohortDir, modelCount=20, triangleCount=20000, landmarkCount=3, seed=0, annotator=None):
+        """
+        Annotate a synthetic cohort headlessly and measure the per-model and per-click paths:
+        process (session start), onMarkupEndInteraction (one landmark move), undoCommand and switchNextModel.
+        The cohort is generated in cohortDir (see PointSelectorLib.writeSyntheticCohort) unless it already holds it,
+        landmarks.csv and the undo log of the run are written there.
+        With an annotator the run is a shared session (see ANNOTATOR): several benchmark processes with different
+        annotators can annotate the same cohort concurrently, each run annotates the models it claims.
+        Can be used without GUI widget, see main().
+        :return: results dictionary, see PointSelectorLib.benchmarkResults
+        """
+        import numpy as np
+        from PointSelectorLib import StageTimer, benchmarkResults, listModelFiles, writeSyntheticCohort
+
+        parameters = {"models": modelCount, "triangles": triangleCount, "landmarks": landmarkCount, "seed": seed,
+                      "lodRatio": self.LOD_RATIO, "snapMode": self.SNAP_MODE, "nodeRecycling": self.NODE_RECYCLING}
+        cohortFiles = listModelFiles(cohortDir) if os.path.isdir(cohortDir) else []
+        if len(cohortFiles) != modelCount:
+            writeSyntheticCohort(cohortDir, modelCount, triangleCount, landmarkCount, seed)
+
+        rng = np.random.default_rng(seed)
+        benchmarkTimer = StageTimer(windowSize=max(modelCount * (2 * landmarkCount + 2), 1000))
+        self.ANNOTATOR = annotator
+        startTime = time.perf_counter()
+        with benchmarkTimer.stage("process"):
+            self.process(cohortDir, landmarkCount, resume=False)
+        annotatedCount = 0
+        while True:
+            for landmarkIndex in range(landmarkCount):
+                #moving a control point a little, as if the user dragged it on the surface
+                position = np.array(self.fidNode.GetNthControlPointPosition(landmarkIndex)) + rng.normal(scale=0.5, size=3)
+                self.fidNode.SetNthControlPointPosition(landmarkIndex, *position)
+                self.fidNode.SetAttribute('Markups.MovingMarkupIndex', str(landmarkIndex))
+                with benchmarkTimer.stage("onMarkupEndInteraction"):
+                    self.onMarkupEndInteraction(self.fidNode, slicer.vtkMRMLMarkupsNode.PointEndInteractionEvent)
+            #the last landmark is undone and placed again
+            with benchmarkTimer.stage("undoCommand"):
+                self.undoCommand()
+            with benchmarkTimer.stage("onMarkupEndInteraction"):
+                self.onMarkupEndInteraction(self.fidNode, slicer.vtkMRMLMarkupsNode.PointEndInteractionEvent)
+            annotatedCount += 1
+            #switchNextModel stays on the last model, the benchmark ends there
+            self.session.waitForModels(self.INDEX_DATA + 2)
+            if self.INDEX_DATA + 1 >= len(self.models) and (self.workQueue is None or not self.claimMoreModels()):
+                break
+            with benchmarkTimer.stage("switchNextModel"):
+                self.switchNextModel()
+                self.finishPendingSwitch()
+        self.flushLandmarks()
+        wallSeconds = time.perf_counter() - startTime
+        recorded = len(self.landmarkStore)
+        if recorded != annotatedCount * landmarkCount:
+            logging.warning(f'Benchmark recorded {recorded} landmarks, expected {annotatedCount * landmarkCount}')
+        results = benchmarkResults(parameters, benchmarkTimer.stats(), wallSeconds, self.timer.stats())
+        results["models_per_hour"] = annotatedCount / wallSeconds * 3600.0 if wallSeconds > 0 else None
+        results["annotator"] = annotator
+        results["annotated_models"] = annotatedCount
+        self.closeSession(self.session)
+        self.stopPrefetcher()
+        return results
+
+    def scanModelDirectory(self, inputDir, workers=None, processes=False):
+        """
+        Read and validate every model of a directory (MODEL_PATTERNS, MODEL_RECURSIVE) with a pool of worker threads.
+        Point and face counts, bounds, surface area, centroid and the .mrk.json sibling of each model are checked,
+        models_ids.csv is updated as in process() and per-file timings and failures go to scan_manifest.json.
+        In level of detail mode (LOD_RATIO) the decimated proxies are built by the workers too,
+        with NORMALIZED_MODELS the binary copies of the models are written, and with CAMERA_FRAMING the view frames
+        of the models are computed into VIEW_FRAMES_FILE.
+        Can be used without GUI widget, see main().
+        :param inputDir: directory of the .ply files
+        :param workers: number of workers, all CPU cores by default
+        :param processes: use spawned worker processes instead of threads, see PointSelectorLib.scanDirectory
+        :return: the manifest dictionary
+        """
+        from PointSelectorLib import ModelManifest, ViewFrameCache, scanDirectory
+
+        logging.info('Directory scan started')
+        proxyCacheDir = os.path.join(inputDir, self.PROXY_CACHE_DIR) if self.LOD_RATIO else None
+        normalizedCacheDir = os.path.join(inputDir, self.NORMALIZED_MODELS_DIR) if self.NORMALIZED_MODELS else None
+        manifest = scanDirectory(inputDir, workers=workers, manifestPath=os.path.join(inputDir, "scan_manifest.json"),
+                                 proxyCacheDir=proxyCacheDir, proxyRatio=self.LOD_RATIO,
+                                 normalizedCacheDir=normalizedCacheDir, viewFrames=self.CAMERA_FRAMING, processes=processes,
+                                 patterns=self.MODEL_PATTERNS, recursive=self.MODEL_RECURSIVE)
+        if self.CAMERA_FRAMING:
+            viewFrames = ViewFrameCache(os.path.join(inputDir, self.VIEW_FRAMES_FILE))
+            for record in manifest["models"]:
+                if record["viewFrame"] is not None:
+                    viewFrames.put(inputDir, record["fileName"], record["viewFrame"], record["hash"])
+            viewFrames.save()
+        knownHashes = {record["fileName"]: (record["fileSize"], record["mtimeNs"], record["hash"])
+                       for record in manifest["models"] if record["hash"]}
+        ModelManifest(os.path.join(inputDir, "models_ids.csv")).update(inputDir, knownHashes=knownHashes,
+                                                                      patterns=self.MODEL_PATTERNS,
+                                                                      recursive=self.MODEL_RECURSIVE)
+        for record in manifest["models"]:
+            if not record["ok"]:
+                logging.warning(f'{record["fileName"]}: {record["error"]}')
+        logging.info(f'Scanned {manifest["numberOfModels"]} models ({len(manifest["failed"])} failed) '
+                     f'with {manifest["workers"]} workers in {manifest["totalSeconds"]:.2f} seconds')
+        return manifest
+
+    def batchTransferLandmarks(self, templateModelPath, templateLandmarksPath, inputDir, method="closestPoint", align=True,
+                               overwrite=False):
+        """
+        Project the landmarks picked on a template model onto every .ply model of a directory, without user interaction.
+        models_ids.csv and landmarks.csv are written in the same format as in an interactive session,
+        so that annotators only have to correct the transferred landmarks.
+        Models that already have landmarks (e.g. corrected by an annotator) are skipped unless overwrite is True.
+        The transferred landmarks are journaled like edits, the landmarks and undo history of earlier sessions are kept.
+        Can be used without GUI widget, see main().
+        :param templateModelPath: model file the landmarks were picked on
+        :param templateLandmarksPath: .mrk.json file of the template, or a landmarks.csv containing rows for the template
+        :param inputDir: directory of the .ply files to annotate
+        :param method: "closestPoint" or "correspondence", see PointSelectorLib.transferLandmarks
+        :param align: rigidly align the template to each model before closest point projection
+        :param overwrite: replace the landmarks of models that already have some
+        :return: list of model file names that could not be processed
+        """
+        from PointSelectorLib import ModelManifest, readModelFile, readTemplateLandmarks, transferLandmarks
+
+        startTime = time.time()
+        logging.info('Landmark transfer started')
+        templatePolyData = readModelFile(templateModelPath)
+        indices, templatePositions = readTemplateLandmarks(templateLandmarksPath, os.path.basename(templateModelPath))
+
+        manifest = ModelManifest(os.path.join(inputDir, "models_ids.csv"))
+        manifest.update(inputDir, patterns=self.MODEL_PATTERNS, recursive=self.MODEL_RECURSIVE)
+        modelFiles = manifest.fileNames
+
+        failed = []
+        skipped = 0
+        store, journal = self.openLandmarkJournal(inputDir, os.path.join(inputDir, "landmarks.csv"), truncate=False)
+        try:
+            for modelFileName in modelFiles:
+                if not overwrite and store.countForModel(modelFileName) > 0:
+                    skipped += 1
+                    continue
+                try:
+                    targetPolyData = readModelFile(os.path.join(inputDir, modelFileName))
+                    positions = transferLandmarks(templatePolyData, templatePositions, targetPolyData, method, align)
+                except Exception as e:
+                    logging.error(f'Landmark transfer to {modelFileName} failed: {e}')
+                    failed.append(modelFileName)
+                    continue
+                for index, position in zip(indices, positions):
+                    journal.record(modelFileName, index, position)
+        finally:
+            journal.close()
+            store.close()
+
+        stopTime = time.time()
+        logging.info(f'Landmark transfer of {len(modelFiles)-len(failed)-skipped}/{len(modelFiles)} models '
+                     f'({skipped} already annotated) completed in {stopTime-startTime:.2f} seconds')
+        return failed
+
+
+#
+# Command line interface
+#
+
+def main(argv):
+    """
+    Run batch operations without the GUI, for example:
+      Slicer --no-main-window --python-script PointSelector.py transfer --template T.ply --template-landmarks T.mrk.json --input-dir DIR
+    Returns the process exit code.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog="PointSelector", description="PointSelector batch operations")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    transferParser = subparsers.add_parser("transfer", help="project template landmarks onto all models of a directory")
+    transferParser.add_argument("--template", required=True, help="template model file")
+    transferParser.add_argument("--template-landmarks", required=True, help="template .mrk.json or landmarks.csv")
+    transferParser.add_argument("--input-dir", required=True, help="directory of the .ply models")
+    transferParser.add_argument("--method", default="closestPoint", choices=["closestPoint", "correspondence"])
+    transferParser.add_argument("--no-align", action="store_true", help="do not rigidly align the template to each model")
+    transferParser.add_argument("--overwrite", action="store_true",
+                                help="replace the landmarks of models that already have some instead of skipping them")
+
+    scanParser = subparsers.add_parser("scan", help="validate all models of a directory and write scan_manifest.json")
+    scanParser.add_argument("--input-dir", required=True, help="directory of the .ply models")
+    scanParser.add_argument("--workers", type=int, default=None, help="number of worker threads (default: all cores)")
+    scanParser.add_argument("--lod-ratio", type=float, default=None, help="also build decimated proxies keeping this fraction of triangles")
+    scanParser.add_argument("--normalize", action="store_true", help="also write binary .vtp copies of the models for faster loading")
+
+    qaParser = subparsers.add_parser("qa", help="flag outlier and swapped landmarks and write landmarks_qa.csv in review order")
+    qaParser.add_argument("--input-dir", required=True, help="directory with landmarks.csv and models_ids.csv")
+    qaParser.add_argument("--landmarks", type=int, default=None, help="number of landmarks per model (default: highest picked index)")
+
+    startupParser = subparsers.add_parser("startup", help="measure the import cost of the module at Slicer startup")
+    startupParser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per measured import")
+    startupParser.add_argument("--output", default=None, help="results JSON file")
+
+    benchmarkParser = subparsers.add_parser("benchmark", help="annotate a synthetic cohort headlessly and write timing results as JSON")
+    benchmarkParser.add_argument("--cohort-dir", required=True, help="directory of the synthetic cohort, generated if needed")
+    benchmarkParser.add_argument("--models", type=int, default=20)
+    benchmarkParser.add_argument("--triangles", type=int, default=20000, help="approximate number of triangles per model")
+    benchmarkParser.add_argument("--landmarks", type=int, default=3, help="landmarks per model")
+    benchmarkParser.add_argument("--seed", type=int, default=0)
+    benchmarkParser.add_argument("--output", default=None, help="results file (default: benchmark.json in the cohort directory)")
+    benchmarkParser.add_argument("--baseline", default=None, help="earlier results file, slower operations make the command fail")
+    benchmarkParser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline (fraction of p50)")
+    benchmarkParser.add_argument("--annotator", default=None, help="run as this annotator of a shared session, to test concurrent sessions")
+
+    mergeParser = subparsers.add_parser("merge", help="merge the landmarks files of all annotators of a shared cohort into landmarks.csv")
+    mergeParser.add_argument("--input-dir", required=True, help="model directory with landmarks.<annotator>.csv files")
+    mergeParser.add_argument("--output", default=None, help="merged file (default: landmarks.csv in the input directory)")
+
+    markupsParser = subparsers.add_parser("markups", help="check the .mrk.json files of a directory and write markups_report.json")
+    markupsParser.add_argument("--input-dir", required=True, help="directory of the .ply models")
+    markupsParser.add_argument("--landmarks", type=int, default=None, help="expected number of control points per model")
+    markupsParser.add_argument("--workers", type=int, default=None, help="number of reader threads")
+    markupsParser.add_argument("--write-back", action="store_true", help="first write the landmarks of landmarks.csv into the .mrk.json files")
+
+    exportParser = subparsers.add_parser("export", help="convert landmarks.csv of a directory to a typed columnar file")
+    exportParser.add_argument("--input-dir", required=True, help="directory with landmarks.csv and models_ids.csv")
+    exportParser.add_argument("--format", default="feather", choices=["feather", "parquet", "npz"])
+    exportParser.add_argument("--output", default=None, help="output file (default: landmarks.<format> in the input directory)")
+
+    args = parser.parse_args(argv)
+    logic = PointSelectorLogic()
+    if args.command == "startup":
+        from PointSelectorLib import writeBenchmarkResults
+        results = logic.measureStartup(args.repeat)
+        for imported in results["imports"]:
+            loaded = f' (loads {", ".join(imported["loaded"])})' if imported["loaded"] else ''
+            print(f'{imported["statement"]}: {imported["median_ms"]:.1f} ms{loaded}')
+        print(f'PointSelector.py: {results["module_ms"]:.1f} ms')
+        if args.output:
+            writeBenchmarkResults(results, args.output)
+        return 0
+    if args.command == "benchmark":
+        from PointSelectorLib import compareBenchmarkResults, readBenchmarkResults, writeBenchmarkResults
+        results = logic.runBenchmark(args.cohort_dir, args.models, args.triangles, args.landmarks, args.seed, annotator=args.annotator)
+        defaultOutput = f"benchmark.{args.annotator}.json" if args.annotator else "benchmark.json"
+        writeBenchmarkResults(results, args.output or os.path.join(args.cohort_dir, defaultOutput))
+        for name, stats in sorted(results["operations"].items()):
+            print(f'{name}: p50 {stats["p50_ms"]:.1f} ms, p95 {stats["p95_ms"]:.1f} ms, max {stats["max_ms"]:.1f} ms')
+        print(f'{results["models_per_hour"]:.0f} models/hour, peak RSS {(results["peak_rss_bytes"] or 0) / 2**20:.0f} MB')
+        if args.baseline:
+            regressions = compareBenchmarkResults(readBenchmarkResults(args.baseline), results, args.tolerance)
+            for name, baselineValue, value in regressions:
+                print(f'Regression: {name} p50 {baselineValue:.1f} ms -> {value:.1f} ms')
+            return 1 if regressions else 0
+        return 0
+    if args.command == "merge":
+        summary = logic.mergeLandmarks(args.input_dir, args.output)
+        return 1 if summary["conflicts"] else 0
+    if args.command == "qa":
+        report = logic.reviewLandmarks(reorder=False, inputDir=args.input_dir, landmarkCount=args.landmarks)
+        report.to_csv(os.path.join(args.input_dir, "landmarks_qa.csv"), index=False)
+        return 0
+    if args.command == "markups":
+        if args.write_back:
+            logic.writeBackMarkups(args.input_dir)
+        report = logic.validateMarkups(args.input_dir, args.landmarks, args.workers)
+        return 1 if report["missing"] or report["invalid"] or report["count"] else 0
+    if args.command == "export":
+        logic.exportLandmarks(args.output, format=args.format, inputDir=args.input_dir)
+        return 0
+    if args.command == "scan":
+        logic.LOD_RATIO = args.lod_ratio
+        logic.NORMALIZED_MODELS = args.normalize
+        manifest = logic.scanModelDirectory(args.input_dir, workers=args.workers)
+        return 1 if manifest["failed"] else 0
+    if args.command == "transfer":
+        failed = logic.batchTransferLandmarks(args.template, args.template_landmarks, args.input_dir,
+                                              method=args.method, align=not args.no_align,
+                                              overwrite=args.overwrite)
+        return 1 if failed else 0
+    return 0
+
 
 #
 # PointSelectorTest
@@ -614,49 +2217,488 @@ class PointSelectorTest(ScriptedLoadableModuleTest):
         """
         self.setUp()
         self.test_PointSelector1()
+        self.setUp()
+        self.test_PointSelectorBenchmark()
+        self.setUp()
+        self.test_PointSelectorSharedSession()
+        self.setUp()
+        self.test_PointSelectorSessionDatabase()
+        self.setUp()
+        self.test_PointSelectorSessions()
+        self.setUp()
+        self.test_PointSelectorModelEnumeration()
+        self.setUp()
+        self.test_PointSelectorViewFrames()
+        self.setUp()
+        self.test_PointSelectorMarkupsFiles()
+        self.setUp()
+        self.test_PointSelectorCoordinateSystems()
+        self.setUp()
+        self.test_PointSelectorJournalResume()
+        self.setUp()
+        self.test_PointSelectorTransferAgain()
 
     def test_PointSelector1(self):
-        """ Ideally you should have several levels of tests.  At the lowest level
-        tests should exercise the functionality of the logic with different inputs
-        (both valid and invalid).  At higher levels your tests should emulate the
-        way the user would interact with your code and confirm that it still works
-        the way you intended.
-        One of the most important features of the tests is that it should alert other
-        developers when their changes will have an impact on the behavior of your
-        module.  For example, if a developer removes a feature that you depend on,
-        your test should break so they know that the feature is needed.
+        """ Annotate a small synthetic cohort: landmarks are recorded, undone and kept per model
+        when switching to the next model.
         """
 
         self.delayDisplay("Starting the test")
 
-        # Get/create input data
+        import json
+        import tempfile
+        from PointSelectorLib import LandmarkStore, markupsFilePath, writeSyntheticCohort
+
+        cohortDir = tempfile.mkdtemp()
+        fileNames = writeSyntheticCohort(cohortDir, modelCount=3, triangleCount=2000, landmarkCount=3)
+        # properties of the .mrk.json files other than positions and labels are kept on the markups node
+        for fileName in fileNames:
+            markupsPath = markupsFilePath(os.path.join(cohortDir, fileName))
+            with open(markupsPath, "r") as file:
+                content = json.load(file)
+            content["markups"][0]["display"] = {"color": [1.0, 0.0, 0.0], "glyphType": "Diamond3D"}
+            content["markups"][0]["controlPoints"][2]["description"] = "tip"
+            with open(markupsPath, "w") as file:
+                json.dump(content, file)
+        self.delayDisplay('Created synthetic cohort')
+
+        logic = PointSelectorLogic()
+        logic.process(cohortDir, 3, resume=False)
+        logic.session.waitForModels()
+        self.assertEqual(sorted(logic.models), fileNames)
+        self.assertEqual(logic.fidNode.GetNumberOfControlPoints(), 3)
+        self.assertEqual(logic.fidNode.GetNthControlPointDescription(2), "tip")
+        self.assertEqual(logic.fidNode.GetDisplayNode().GetColor(), (1.0, 0.0, 0.0))
+        self.assertEqual(logic.fidNode.GetDisplayNode().GetGlyphTypeAsString(), "Diamond3D")
+
+        # Moving a control point records a landmark snapped to the surface
+        fileName = logic.models[0]
+        logic.fidNode.SetAttribute('Markups.MovingMarkupIndex', '1')
+        logic.onMarkupEndInteraction(logic.fidNode, slicer.vtkMRMLMarkupsNode.PointEndInteractionEvent)
+        self.assertEqual(logic.landmarkStore.countForModel(fileName), 1)
+        position, vertexId, distance = logic.landmarkStore.getLandmark(fileName, 1)
+        self.assertLess(distance, 0.1)
+
+        # Undo removes it, redo brings it back
+        logic.undoCommand()
+        self.assertEqual(logic.landmarkStore.countForModel(fileName), 0)
+        logic.redoCommand()
+        self.assertEqual(logic.landmarkStore.countForModel(fileName), 1)
+
+        # Landmarks are written when switching to the next model
+        logic.switchNextModel()
+        logic.finishPendingSwitch()
+        self.assertEqual(logic.INDEX_DATA, 1)
+        self.assertEqual(logic.pointCount, 0)
+        logic.endSession()
+        store = LandmarkStore(os.path.join(cohortDir, "landmarks.csv"), truncate=False)
+        self.assertIsNotNone(store.get(fileName, 1))
+        store.close()
+
+        self.delayDisplay('Test passed')
+
+    def test_PointSelectorBenchmark(self):
+        """ Run the benchmark on a tiny cohort and check that every measured operation is reported.
+        """
+
+        self.delayDisplay("Starting the benchmark test")
+
+        import tempfile
+        logic = PointSelectorLogic()
+        results = logic.runBenchmark(tempfile.mkdtemp(), modelCount=2, triangleCount=2000, landmarkCount=2)
+        for name in ("process", "onMarkupEndInteraction", "undoCommand", "switchNextModel"):
+            self.assertIn(name, results["operations"])
+        self.assertEqual(results["operations"]["onMarkupEndInteraction"]["count"], 6)
+        self.assertGreater(results["models_per_hour"], 0)
+
+        self.delayDisplay('Test passed')
+
+    def test_PointSelectorSharedSession(self):
+        """ Two annotators share a cohort: each annotates only the models it claimed and the merge covers all models.
+        """
+
+        self.delayDisplay("Starting the shared session test")
+
+        import tempfile
+        from PointSelectorLib import WorkQueue, landmarkShardPaths, writeSyntheticCohort
+
+        cohortDir = tempfile.mkdtemp()
+        fileNames = writeSyntheticCohort(cohortDir, modelCount=3, triangleCount=2000, landmarkCount=2)
+        logic = PointSelectorLogic()
+        os.makedirs(os.path.dirname(os.path.join(cohortDir, logic.WORK_QUEUE_FILE)))
+        # annotator b holds the first model while a works
+        queue = WorkQueue(os.path.join(cohortDir, logic.WORK_QUEUE_FILE), "b")
+        queue.addModels(fileNames)
+        self.assertEqual(queue.claim(1), fileNames[:1])
+
+        results = logic.runBenchmark(cohortDir, modelCount=3, triangleCount=2000, landmarkCount=2, annotator="a")
+        self.assertEqual(results["annotated_models"], 2)
+        results = PointSelectorLogic().runBenchmark(cohortDir, modelCount=3, triangleCount=2000, landmarkCount=2, annotator="b")
+        self.assertEqual(results["annotated_models"], 1)
+        self.assertEqual(queue.status(), {"done": 3, "claimed": 0, "waiting": 0})
+        self.assertEqual(sorted(landmarkShardPaths(cohortDir)), ["a", "b"])
+
+        summary = logic.mergeLandmarks(cohortDir)
+        self.assertEqual(summary, {"models": 3, "landmarks": 6, "conflicts": []})
+
+        self.delayDisplay('Test passed')
+
+    def test_PointSelectorSessionDatabase(self):
+        """ With the sqlite backend, landmarks and undo history survive the session and landmarks.csv is derived.
+        """
+
+        self.delayDisplay("Starting the session database test")
+
+        import tempfile
+        from PointSelectorLib import LandmarkStore, writeSyntheticCohort
+
+        cohortDir = tempfile.mkdtemp()
+        fileNames = writeSyntheticCohort(cohortDir, modelCount=2, triangleCount=2000, landmarkCount=2)
+        logic = PointSelectorLogic()
+        logic.LANDMARKS_BACKEND = "sqlite"
+        logic.process(cohortDir, 2, resume=False)
+        for index in range(2):
+            logic.fidNode.SetAttribute('Markups.MovingMarkupIndex', str(index))
+            logic.onMarkupEndInteraction(logic.fidNode, slicer.vtkMRMLMarkupsNode.PointEndInteractionEvent)
+        logic.undoCommand()
+        self.assertEqual(logic.landmarkStore.incompleteModels(fileNames, 2), fileNames)
+        logic.endSession()
+        store = LandmarkStore(os.path.join(cohortDir, "landmarks.csv"), truncate=False)
+        self.assertEqual(len(store), 1)
+        store.close()
+
+        # Resuming restores the redo stack from the edit history
+        logic = PointSelectorLogic()
+        logic.LANDMARKS_BACKEND = "sqlite"
+        logic.process(cohortDir, 2, resume=True)
+        self.assertEqual(logic.INDEX_DATA, 0)
+        fileName = logic.models[0]
+        logic.redoCommand()
+        self.assertEqual(logic.landmarkStore.incompleteModels(fileNames, 2), [f for f in fileNames if f != fileName])
+        self.assertEqual(list(logic.landmarkStore.positionsOfLandmark(1)), [fileName])
+        logic.endSession()
+
+        self.delayDisplay('Test passed')
+
+    def test_PointSelectorSessions(self):
+        """ A batch session on another directory records landmarks while the interactive session stays open.
+        """
+
+        self.delayDisplay("Starting the sessions test")
 
-        import SampleData
-        registerSampleData()
-        inputVolume = SampleData.downloadSample('PointSelector1')
-        self.delayDisplay('Loaded test data set')
+        import tempfile
+        from PointSelectorLib import LandmarkStore, writeSyntheticCohort
 
-        inputScalarRange = inputVolume.GetImageData().GetScalarRange()
-        self.assertEqual(inputScalarRange[0], 0)
-        self.assertEqual(inputScalarRange[1], 695)
+        interactiveDir, batchDir = tempfile.mkdtemp(), tempfile.mkdtemp()
+        writeSyntheticCohort(interactiveDir, modelCount=2, triangleCount=2000, landmarkCount=2)
+        batchFileNames = writeSyntheticCohort(batchDir, modelCount=3, triangleCount=2000, landmarkCount=2, seed=1)
+        logic = PointSelectorLogic()
+        logic.process(interactiveDir, 2, resume=False)
+        batch = logic.openSession(batchDir, 2, resume=False)
+        batch.waitForModels()
+        self.assertIs(logic.sessionFor(batchDir), batch)
+        self.assertEqual(sorted(batch.models), batchFileNames)
+        self.assertEqual([batch.models.row(fileName) for fileName in batch.models], [0, 1, 2])
+        self.assertNotIn(batchFileNames[0][:-len(".ply")], batch.models)
+        for fileName in batch.models:
+            for index in range(2):
+                batch.journal.record(fileName, index, (0.0, 0.0, float(index)))
+        self.assertEqual(batch.landmarkStore.incompleteModels(batch.models, 2), [])
+        self.assertEqual(logic.modelDir, interactiveDir)
+        self.assertEqual(len(logic.landmarkStore), 0)
+
+        logic.closeSession(batch)
+        self.assertEqual(list(logic.sessions), [os.path.abspath(interactiveDir)])
+        store = LandmarkStore(os.path.join(batchDir, "landmarks.csv"), truncate=False)
+        self.assertEqual(len(store), 6)
+        store.close()
+        logic.endSession()
+        self.assertEqual(logic.sessions, {})
+
+        self.delayDisplay('Test passed')
+
+    def test_PointSelectorModelEnumeration(self):
+        """ Models of subfolders are listed while the directory is enumerated, models_ids.csv keeps the model ids
+        of the remaining models when a model is removed.
+        """
 
-        outputVolume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode")
-        threshold = 100
+        self.delayDisplay("Starting the model enumeration test")
 
-        # Test the module logic
+        import tempfile
+        from PointSelectorLib import ModelManifest, iterModelFiles, writeSyntheticCohort
 
+        cohortDir = tempfile.mkdtemp()
+        writeSyntheticCohort(cohortDir, modelCount=2, triangleCount=2000, landmarkCount=2)
+        writeSyntheticCohort(os.path.join(cohortDir, "case1"), modelCount=2, triangleCount=2000, landmarkCount=2, seed=1)
+        self.assertEqual(sorted(fileName for fileName, _ in iterModelFiles(cohortDir)), ["model_00000.ply", "model_00001.ply"])
+
+        logic = PointSelectorLogic()
+        logic.MODEL_RECURSIVE = True
+        logic.MODEL_ENUMERATION_BATCH = 1
+        logic.process(cohortDir, 2, resume=False)
+        logic.session.waitForModels()
+        self.assertEqual(len(logic.models), 4)
+        self.assertIn("case1/model_00001.ply", logic.models)
+        modelIds = {fileName: modelId for modelId, fileName in logic.models.items()}
+        logic.endSession()
+
+        os.remove(os.path.join(cohortDir, "model_00000.ply"))
+        manifest = ModelManifest(os.path.join(cohortDir, "models_ids.csv"))
+        self.assertEqual(manifest.update(cohortDir, recursive=True), ([], [], ["model_00000.ply"]))
+        manifest = ModelManifest(os.path.join(cohortDir, "models_ids.csv"))
+        self.assertEqual({fileName: modelId for modelId, fileName, _, _, _ in manifest.items()},
+                         {fileName: modelId for fileName, modelId in modelIds.items() if fileName != "model_00000.ply"})
+
+        # the scan lists the same models under the same names, models with the same base name do not collide
         logic = PointSelectorLogic()
+        logic.MODEL_RECURSIVE = True
+        logic.LOD_RATIO = 0.5
+        scanManifest = logic.scanModelDirectory(cohortDir, workers=2)
+        self.assertEqual([record["fileName"] for record in scanManifest["models"]], manifest.fileNames)
+        self.assertEqual(scanManifest["failed"], [])
+        self.assertEqual(len(os.listdir(os.path.join(cohortDir, logic.PROXY_CACHE_DIR))), 3)
+
+        # a directory without models is reported instead of failing in the model loading
+        with self.assertRaisesRegex(ValueError, r"No model files matching \*\.ply"):
+            PointSelectorLogic().process(tempfile.mkdtemp(), 2, resume=False)
+
+        self.delayDisplay('Test passed')
+
+    def test_PointSelectorViewFrames(self):
+        """ View frames are cached per model content and the camera is pointed at the landmarks of the model.
+        """
+
+        self.delayDisplay("Starting the view frames test")
+
+        import tempfile
+        import numpy as np
+        from PointSelectorLib import (ViewFrameCache, cameraParameters, markupsFilePath, readMarkupsFile, readModelFile,
+                                      writeSyntheticCohort)
+
+        cohortDir = tempfile.mkdtemp()
+        fileNames = writeSyntheticCohort(cohortDir, modelCount=2, triangleCount=2000, landmarkCount=3)
+        modelPath = os.path.join(cohortDir, fileNames[0])
+        positions = readMarkupsFile(markupsFilePath(modelPath))["positions"]
+        cache = ViewFrameCache(os.path.join(cohortDir, PointSelectorLogic.VIEW_FRAMES_FILE))
+        frame = cache.getOrCompute(cohortDir, fileNames[0], readModelFile(modelPath), positions)
+        np.testing.assert_allclose(frame["landmarkCenter"], np.mean(positions, axis=0))
+        np.testing.assert_allclose(np.array(frame["axes"]) @ np.array(frame["axes"]).T, np.eye(3), atol=1e-9)
+        cache.save()
+
+        cache = ViewFrameCache(os.path.join(cohortDir, PointSelectorLogic.VIEW_FRAMES_FILE))
+        self.assertEqual(cache.get(cohortDir, fileNames[0]), frame)
+        self.assertIsNone(cache.get(cohortDir, fileNames[1]))
+        position, focalPoint, viewUp = cameraParameters(frame, (frame["landmarkCenter"], frame["landmarkRadius"]))
+        np.testing.assert_allclose(focalPoint, frame["landmarkCenter"])
+        self.assertGreater(np.linalg.norm(np.subtract(position, focalPoint)), frame["landmarkRadius"])
+        self.assertAlmostEqual(float(np.dot(viewUp, np.subtract(position, focalPoint))), 0.0, places=6)
+
+        # an edited model gets a new frame
+        with open(modelPath, "ab") as file:
+            file.write(b"\n")
+        self.assertIsNone(cache.get(cohortDir, fileNames[0]))
+
+        self.delayDisplay('Test passed')
+
+    def test_PointSelectorMarkupsFiles(self):
+        """ The .mrk.json files of a directory are validated in bulk and landmarks are written back into them.
+        """
+
+        self.delayDisplay("Starting the markups files test")
+
+        import json
+        import tempfile
+        import numpy as np
+        from PointSelectorLib import (markupsFilePath, readMarkupsFile, validateMarkupsFiles, writeBackLandmarks,
+                                      writeSyntheticCohort)
+
+        cohortDir = tempfile.mkdtemp()
+        fileNames = writeSyntheticCohort(cohortDir, modelCount=4, triangleCount=500, landmarkCount=3)
+        report = validateMarkupsFiles(cohortDir, fileNames, 3)
+        self.assertEqual([record["status"] for record in report["models"]], ["ok"] * 4)
+        self.assertEqual(validateMarkupsFiles(cohortDir, fileNames, 4)["count"], fileNames)
+
+        os.remove(markupsFilePath(os.path.join(cohortDir, fileNames[1])))
+        with open(markupsFilePath(os.path.join(cohortDir, fileNames[2])), "w") as file:
+            file.write('{"markups": []}')
+        report = validateMarkupsFiles(cohortDir, fileNames, 3)
+        self.assertEqual(report["missing"], [fileNames[1]])
+        self.assertEqual(report["invalid"], [fileNames[2]])
+
+        # only the changed file is rewritten, a missing file is created
+        markupsPath = markupsFilePath(os.path.join(cohortDir, fileNames[0]))
+        positions = readMarkupsFile(markupsPath)["positions"]
+        summary = writeBackLandmarks(cohortDir, {fileNames[0]: {1: [1.0, 2.0, 3.0]}, fileNames[1]: {0: [4.0, 5.0, 6.0]},
+                                                 fileNames[3]: {}})
+        self.assertEqual(sorted(summary["written"]), fileNames[:2])
+        self.assertEqual(summary["unchanged"], [fileNames[3]])
+        written = readMarkupsFile(markupsPath)["positions"]
+        np.testing.assert_allclose(written[1], [1.0, 2.0, 3.0])
+        np.testing.assert_allclose(written[0], positions[0])
+        # the original is kept next to the rewritten file
+        with open(markupsPath + ".bak", "r") as file:
+            self.assertEqual(len(json.load(file)["markups"][0]["controlPoints"]), 3)
+        self.assertFalse(os.path.exists(markupsFilePath(os.path.join(cohortDir, fileNames[1])) + ".bak"))
+        self.assertEqual(validateMarkupsFiles(cohortDir, fileNames[:2])["models"][1]["status"], "ok")
 
-        # Test algorithm with non-inverted threshold
-        logic.process(inputVolume, outputVolume, threshold, True)
-        outputScalarRange = outputVolume.GetImageData().GetScalarRange()
-        self.assertEqual(outputScalarRange[0], inputScalarRange[0])
-        self.assertEqual(outputScalarRange[1], threshold)
+        self.delayDisplay('Test passed')
+
+    def test_PointSelectorCoordinateSystems(self):
+        """ Models are read in RAS like their .mrk.json points: LPS files are converted unless their header says RAS.
+        """
+
+        self.delayDisplay("Starting the coordinate systems test")
+
+        import json
+        import tempfile
+        import numpy as np
+        import vtk
+        from vtk.util.numpy_support import vtk_to_numpy
+        from PointSelectorLib import (markupsFilePath, readMarkupsFile, readModelFile, writeRawPolyData,
+                                      writeSyntheticCohort)
+
+        modelDir = tempfile.mkdtemp()
+        sphere = vtk.vtkSphereSource()
+        sphere.SetCenter(10.0, 20.0, 30.0)
+        sphere.SetRadius(5.0)
+        sphere.Update()
+        filePoints = vtk_to_numpy(sphere.GetOutput().GetPoints().GetData())
+        for fileName, comment in (("lps.ply", None), ("ras.ply", "SPACE=RAS")):
+            writer = vtk.vtkPLYWriter()
+            writer.SetFileName(os.path.join(modelDir, fileName))
+            writer.SetInputData(sphere.GetOutput())
+            if comment:
+                writer.AddComment(comment)
+            writer.Write()
+        # the first vertex of the model, saved by Slicer in LPS
+        markups = {"markups": [{"type": "Fiducial", "coordinateSystem": "LPS",
+                                "controlPoints": [{"label": "P1", "position": filePoints[0].tolist()}]}]}
+        with open(markupsFilePath(os.path.join(modelDir, "lps.ply")), "w") as file:
+            json.dump(markups, file)
+
+        polyData = readModelFile(os.path.join(modelDir, "lps.ply"))
+        position = readMarkupsFile(markupsFilePath(os.path.join(modelDir, "lps.ply")))["positions"][0]
+        np.testing.assert_allclose(polyData.GetPoint(0), position, atol=1e-5)
+        np.testing.assert_allclose(polyData.GetPoint(0), filePoints[0] * [-1, -1, 1], atol=1e-5)
+        np.testing.assert_allclose(readModelFile(os.path.join(modelDir, "ras.ply")).GetPoint(0), filePoints[0], atol=1e-5)
+        # cached copies are marked as RAS and read back unchanged
+        cachedPath = writeRawPolyData(polyData, os.path.join(modelDir, "cached.vtp"))
+        np.testing.assert_allclose(readModelFile(cachedPath).GetPoint(0), polyData.GetPoint(0))
+
+        # landmarks of the synthetic cohort lie on their models
+        fileNames = writeSyntheticCohort(modelDir, modelCount=1, triangleCount=2000, landmarkCount=3)
+        modelPath = os.path.join(modelDir, fileNames[0])
+        points = vtk_to_numpy(readModelFile(modelPath).GetPoints().GetData())
+        for position in readMarkupsFile(markupsFilePath(modelPath))["positions"]:
+            self.assertLess(np.linalg.norm(points - position, axis=1).min(), 5.0)
+
+        self.delayDisplay('Test passed')
+
+    def test_PointSelectorJournalResume(self):
+        """ Resuming a session rebuilds the undo history without rewriting landmarks and keeps the log bounded.
+        """
+
+        self.delayDisplay("Starting the journal resume test")
+
+        import tempfile
+        from PointSelectorLib import LandmarkJournal, LandmarkStore, SessionDatabase, SessionJournal
+
+        def openCsv(truncate):
+            store = LandmarkStore(os.path.join(sessionDir, "landmarks.csv"), truncate=truncate)
+            return store, LandmarkJournal(os.path.join(sessionDir, "landmarks.oplog.jsonl"), store, truncate=truncate,
+                                          maximumHistory=10)
+
+        def openDatabase(truncate):
+            store = SessionDatabase(os.path.join(sessionDir, "landmarks.sqlite"), truncate=truncate,
+                                    csvPath=os.path.join(sessionDir, "landmarks.csv"))
+            return store, SessionJournal(store, truncate=truncate, maximumHistory=10)
+
+        def countLines(path):
+            with open(path, "r") as file:
+                return sum(1 for _ in file)
+
+        for openJournal in (openCsv, openDatabase):
+            sessionDir = tempfile.mkdtemp()
+            store, journal = openJournal(True)
+            for i in range(50):
+                journal.record("a.ply", 0, (float(i), 0.0, 0.0))
+            journal.record("a.ply", 1, (1.0, 1.0, 1.0))
+            journal.undo()
+            journal.close()
+            store.close()
+            lineCount = countLines(os.path.join(sessionDir, "landmarks.csv"))
+            for _ in range(3):
+                store, journal = openJournal(False)
+                self.assertEqual(store.get("a.ply", 0), [49.0, 0.0, 0.0])
+                self.assertIsNone(store.get("a.ply", 1))
+                # 10 kept edits, the undone edit and its undo
+                if openJournal is openCsv:
+                    self.assertEqual(countLines(os.path.join(sessionDir, "landmarks.oplog.jsonl")), 12)
+                else:
+                    self.assertEqual(len(store.edits()), 12)
+                journal.close()
+                store.close()
+                self.assertEqual(countLines(os.path.join(sessionDir, "landmarks.csv")), lineCount)
+
+            # the kept history can still be undone and redone
+            store, journal = openJournal(False)
+            self.assertEqual(journal.redo().index, 1)
+            self.assertEqual(store.get("a.ply", 1), [1.0, 1.0, 1.0])
+            for _ in range(11):
+                self.assertIsNotNone(journal.undo())
+            self.assertIsNone(journal.undo())
+            self.assertEqual(store.get("a.ply", 0), [39.0, 0.0, 0.0])
+            journal.close()
+            store.close()
+
+        # positions that are not numbers are written and read back
+        store = LandmarkStore(os.path.join(sessionDir, "landmarks.csv"))
+        store.set("a.ply", 0, (float("nan"), 1.0, float("inf")))
+        store.close()
+        store = LandmarkStore(os.path.join(sessionDir, "landmarks.csv"), truncate=False)
+        position = store.get("a.ply", 0)
+        store.close()
+        self.assertTrue(math.isnan(position[0]))
+        self.assertEqual(position[1:], [1.0, float("inf")])
+        self.assertEqual(LandmarkStore.parsePosition("[nan, 2.0, -inf]")[1:], [2.0, float("-inf")])
 
-        # Test algorithm with inverted threshold
-        logic.process(inputVolume, outputVolume, threshold, False)
-        outputScalarRange = outputVolume.GetImageData().GetScalarRange()
-        self.assertEqual(outputScalarRange[0], inputScalarRange[0])
-        self.assertEqual(outputScalarRange[1], inputScalarRange[1])
+        self.delayDisplay('Test passed')
+
+    def test_PointSelectorTransferAgain(self):
+        """ Transferring landmarks again keeps the landmarks corrected by annotators unless overwrite is requested.
+        """
+
+        self.delayDisplay("Starting the transfer again test")
+
+        import tempfile
+        from PointSelectorLib import markupsFilePath, writeSyntheticCohort
+
+        templateDir = tempfile.mkdtemp()
+        templateFileName = writeSyntheticCohort(templateDir, modelCount=1, triangleCount=2000, landmarkCount=3)[0]
+        templatePath = os.path.join(templateDir, templateFileName)
+        modelDir = tempfile.mkdtemp()
+        fileNames = writeSyntheticCohort(modelDir, modelCount=2, triangleCount=2000, landmarkCount=3, seed=1)
+
+        logic = PointSelectorLogic()
+        self.assertEqual(logic.batchTransferLandmarks(templatePath, markupsFilePath(templatePath), modelDir), [])
+        store, journal = logic.openLandmarkJournal(modelDir, os.path.join(modelDir, "landmarks.csv"), truncate=False)
+        transferred = store.get(fileNames[1], 0)
+        journal.record(fileNames[0], 0, (1.0, 2.0, 3.0))
+        journal.close()
+        store.close()
+
+        for overwrite in (False, True):
+            self.assertEqual(logic.batchTransferLandmarks(templatePath, markupsFilePath(templatePath), modelDir,
+                                                          overwrite=overwrite), [])
+            store, journal = logic.openLandmarkJournal(modelDir, os.path.join(modelDir, "landmarks.csv"), truncate=False)
+            self.assertEqual(store.get(fileNames[0], 0) == [1.0, 2.0, 3.0], not overwrite)
+            self.assertEqual(store.get(fileNames[1], 0), transferred)
+            # the correction can still be undone
+            self.assertTrue(journal.canUndo())
+            journal.close()
+            store.close()
 
         self.delayDisplay('Test passed')
+
+if __name__ == "__main__":
+    slicer.util.exit(main(sys.argv[1:]))
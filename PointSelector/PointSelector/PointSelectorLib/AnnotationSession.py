@@ -0,0 +1,189 @@
+from array import array
+
+
+#
+# ModelList
+#
+
+class ModelList:
+    """
+    Model file names of a session with their model ids (row in models_ids.csv).
+    The names are stored back to back in a single UTF-8 table with an array of offsets into it, so a list of
+    100k models costs a few MB instead of one Python object (or DataFrame cell) per name and row.
+    Rows are the order in which the models are annotated, which can differ from the model ids.
+    Rows are found by name (row(), in) through an open addressing hash table of rows, at most 24 bytes per model
+    with the name hashes.
+    One thread may append while others read: a row is visible once its model id is.
+    """
+
+    __slots__ = ("_table", "_offsets", "_modelIds", "_hashes", "_index")
+
+    def __init__(self, fileNames=(), modelIds=None):
+        self._table = bytearray()
+        self._offsets = array("q", [0])
+        self._modelIds = array("l")
+        self._hashes = array("q")
+        # rows by hash of their name, -1 for empty slots; the size is a power of two at most half full
+        self._index = array("q", [-1]) * 8
+        self.append(fileNames, modelIds)
+
+    def __len__(self):
+        return len(self._modelIds)
+
+    def __getitem__(self, row):
+        count = len(self._modelIds)
+        if row < 0:
+            row += count
+        if not 0 <= row < count:
+            raise IndexError(f"Model row {row} out of range")
+        return self._table[self._offsets[row]:self._offsets[row + 1]].decode()
+
+    def __iter__(self):
+        table, offsets = self._table, self._offsets
+        for row in range(len(self._modelIds)):
+            yield table[offsets[row]:offsets[row + 1]].decode()
+
+    def __contains__(self, fileName):
+        return self.row(fileName) is not None
+
+    def row(self, fileName):
+        """
+        Return the row of fileName, or None if it is not in the list.
+        """
+        row = self._find(self._index, fileName.encode())
+        # rows being appended are not visible before their model id
+        return row if row is not None and row < len(self._modelIds) else None
+
+    def modelId(self, row):
+        return self._modelIds[row]
+
+    def items(self):
+        """
+        Iterate over (modelId, fileName) in row order.
+        """
+        return zip(self._modelIds, self)
+
+    def append(self, fileNames, modelIds=None):
+        """
+        Add models at the end. Model ids continue from the current length by default.
+        """
+        names = [fileName.encode() for fileName in fileNames]
+        if modelIds is None:
+            modelIds = range(len(self._modelIds), len(self._modelIds) + len(names))
+        modelIds = array("l", modelIds)
+        if len(modelIds) != len(names):
+            raise ValueError(f"{len(names)} file names but {len(modelIds)} model ids")
+        offsets = array("q")
+        end = self._offsets[-1]
+        for name in names:
+            end += len(name)
+            offsets.append(end)
+        # the table grows in place; names, offsets and index are added before the model ids that make the rows visible
+        firstRow = len(self._modelIds)
+        self._table += b"".join(names)
+        self._offsets.extend(offsets)
+        self._hashes.extend(hash(name) for name in names)
+        index = self._index
+        count = len(self._hashes)
+        if 2 * count > len(index):
+            # readers keep using the previous index until the new one is complete
+            size = len(index)
+            while 2 * count > size:
+                size *= 2
+            index = array("q", [-1]) * size
+            self._insert(index, range(firstRow))
+        self._insert(index, range(firstRow, count))
+        self._index = index
+        self._modelIds.extend(modelIds)
+
+    def _name(self, row):
+        return self._table[self._offsets[row]:self._offsets[row + 1]]
+
+    def _find(self, index, name):
+        nameHash = hash(name)
+        mask = len(index) - 1
+        slot = nameHash & mask
+        while True:
+            row = index[slot]
+            if row < 0:
+                return None
+            if self._hashes[row] == nameHash and self._name(row) == name:
+                return row
+            slot = (slot + 1) & mask
+
+    def _insert(self, index, rows):
+        hashes = self._hashes
+        mask = len(index) - 1
+        for row in rows:
+            nameHash = hashes[row]
+            slot = nameHash & mask
+            while True:
+                other = index[slot]
+                if other < 0:
+                    index[slot] = row
+                    break
+                # a name listed twice keeps its first row
+                if hashes[other] == nameHash and self._name(other) == self._name(row):
+                    break
+                slot = (slot + 1) & mask
+
+    def reordered(self, rows):
+        """
+        Return a new list with the models of rows, in that order.
+        """
+        rows = list(rows)
+        return ModelList([self[row] for row in rows], [self._modelIds[row] for row in rows])
+
+
+#
+# AnnotationSession
+#
+
+class AnnotationSession:
+    """
+    State of the annotation of one model directory: its models, position in the model list and its own
+    landmark writer (store, journal and, in a shared cohort, work queue).
+    The logic keeps one session per open directory, so batch jobs and interactive annotation can run side by side.
+    """
+
+    __slots__ = ("modelDir", "models", "nodeCounter", "annotator", "indexData", "index", "pointCount",
+                 "contentHashes", "enumerator", "landmarkStore", "journal", "workQueue", "queuedModels", "leaseRenewedTime")
+
+    def __init__(self, modelDir="", nodeCounter=0, annotator=None):
+        self.modelDir = modelDir
+        self.models = ModelList()
+        self.nodeCounter = nodeCounter
+        self.annotator = annotator
+        # row of the current model in models
+        self.indexData = 0
+        self.index = 0
+        self.pointCount = 0
+        self.contentHashes = None
+        # ModelEnumerator still listing the models of the directory, see waitForModels
+        self.enumerator = None
+        self.landmarkStore = None
+        self.journal = None
+        self.workQueue = None
+        # shared cohort: all models of the directory, models only lists the claimed ones
+        self.queuedModels = None
+        self.leaseRenewedTime = 0
+
+    def __repr__(self):
+        return f"AnnotationSession({self.modelDir!r}, {len(self.models)} models, row {self.indexData})"
+
+    @property
+    def currentFileName(self):
+        return self.models[self.indexData] if len(self.models) else None
+
+    def waitForModels(self, count=None):
+        """
+        Wait until the models of the directory are listed, or at least count of them.
+        """
+        if self.enumerator is not None:
+            self.enumerator.wait(count)
+
+    def flush(self):
+        if self.journal is not None:
+            self.journal.flush()
+        if self.landmarkStore is not None:
+            self.landmarkStore.flush()
@@ -0,0 +1,200 @@
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+
+#
+# Synthetic cohort and benchmark results
+#
+
+BENCHMARK_FORMAT_VERSION = 1
+
+
+def writeSyntheticCohort(outputDir, modelCount, triangleCount=20000, landmarkCount=3, seed=0):
+    """
+    Write modelCount binary .ply models of about triangleCount triangles, each with a .mrk.json of landmarkCount
+    control points on its surface, named model_00000.ply, model_00001.ply, ...
+    Every model is a randomly scaled, rotated and translated ellipsoid; the same seed gives the same cohort.
+    Returns the list of written model file names.
+    """
+    import numpy as np
+    import vtk
+
+    os.makedirs(outputDir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    # a sphere of resolution r has about 2 * r * (r - 2) triangles
+    resolution = max(int(round(1 + math.sqrt(1 + triangleCount / 2.0))), 4)
+    sphere = vtk.vtkSphereSource()
+    sphere.SetRadius(1.0)
+    sphere.SetThetaResolution(resolution)
+    sphere.SetPhiResolution(resolution)
+    sphere.Update()
+    # landmarks are at the same directions on every model, so they correspond across the cohort
+    directions = rng.normal(size=(landmarkCount, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    digits = max(5, len(str(modelCount - 1)))
+    # files are written in a hidden folder and renamed into place, so concurrent benchmark sessions never read
+    # a partially written cohort (vtkPLYWriter only writes to .ply names)
+    temporaryDir = os.path.join(outputDir, f".cohort-{os.getpid()}")
+    os.makedirs(temporaryDir, exist_ok=True)
+
+    fileNames = []
+    for i in range(modelCount):
+        scale = rng.uniform(20.0, 40.0, 3)
+        angles = rng.uniform(0.0, 360.0, 3)
+        offset = rng.uniform(-50.0, 50.0, 3)
+        transform = vtk.vtkTransform()
+        transform.Translate(*offset)
+        transform.RotateZ(angles[2])
+        transform.RotateY(angles[1])
+        transform.RotateX(angles[0])
+        transform.Scale(*scale)
+        transformFilter = vtk.vtkTransformPolyDataFilter()
+        transformFilter.SetInputData(sphere.GetOutput())
+        transformFilter.SetTransform(transform)
+        transformFilter.Update()
+
+        fileName = f"model_{i:0{digits}d}.ply"
+        temporaryPath = os.path.join(temporaryDir, fileName)
+        writer = vtk.vtkPLYWriter()
+        writer.SetFileName(temporaryPath)
+        writer.SetFileTypeToBinary()
+        writer.AddComment("SPACE=LPS")
+        writer.SetInputData(transformFilter.GetOutput())
+        writer.Write()
+
+        controlPoints = []
+        for j, direction in enumerate(directions):
+            # the model file is written in LPS like the markups, so its points are used as they are
+            controlPoints.append({"id": str(j + 1), "label": f"P{j + 1}", "position": list(transform.TransformPoint(*direction))})
+        markups = {
+            "@schema": "https://raw.githubusercontent.com/slicer/slicer/master/Modules/Loadable/Markups/Resources/Schema/markups-schema-v1.0.3.json#",
+            "markups": [{"type": "Fiducial", "coordinateSystem": "LPS", "controlPoints": controlPoints}],
+        }
+        markupsFileName = fileName[:-len(".ply")] + ".mrk.json"
+        with open(os.path.join(temporaryDir, markupsFileName), "w") as file:
+            json.dump(markups, file)
+        os.replace(os.path.join(temporaryDir, markupsFileName), os.path.join(outputDir, markupsFileName))
+        os.replace(temporaryPath, os.path.join(outputDir, fileName))
+        fileNames.append(fileName)
+    os.rmdir(temporaryDir)
+    return fileNames
+
+
+def peakMemoryBytes():
+    """
+    Return the peak resident set size of this process in bytes, or None if it cannot be measured on this platform.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def importTimes(statement, pythonPath=(), repeat=5, executable=None):
+    """
+    Measure the import cost of statement (e.g. "import PointSelectorLib") in fresh interpreters with python -X importtime.
+    Modules the interpreter imports at startup are not counted.
+    Returns {"statement", "median_ms", "runs_ms", "modules": {top level module: cumulative ms} of the median run,
+    "loaded": the heavy modules (numpy, pandas, scipy, vtk) the statement loaded}.
+    """
+    import statistics
+    import subprocess
+
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join([*pythonPath, environment.get("PYTHONPATH", "")]).rstrip(os.pathsep)
+
+    def run(code):
+        completed = subprocess.run([executable or sys.executable, "-X", "importtime", "-c", code],
+                                   env=environment, capture_output=True, text=True, check=True)
+        modules = []
+        for line in completed.stderr.splitlines():
+            fields = line[len("import time:"):].split("|") if line.startswith("import time:") else []
+            if len(fields) == 3 and fields[1].strip().isdigit():
+                # nested imports are indented below the module that imported them
+                modules.append((fields[2].strip(), int(fields[1]) / 1000.0, len(fields[2]) - len(fields[2].lstrip()) == 1))
+        return modules
+
+    startupModules = {name for name, _, _ in run("pass")}
+    runs = []
+    for _ in range(repeat):
+        modules = run(statement)
+        topLevel = {name: milliseconds for name, milliseconds, top in modules if top and name not in startupModules}
+        loaded = sorted({name for name, _, _ in modules if name in ("numpy", "pandas", "scipy", "vtk")} - startupModules)
+        runs.append((sum(topLevel.values()), topLevel, loaded))
+    runs.sort(key=lambda result: result[0])
+    total, topLevel, loaded = runs[len(runs) // 2]
+    return {
+        "statement": statement,
+        "median_ms": total,
+        "runs_ms": [result[0] for result in runs],
+        "modules": dict(sorted(topLevel.items(), key=lambda item: -item[1])),
+        "loaded": loaded,
+    }
+
+
+def benchmarkResults(parameters, stats, wallSeconds, stageStats=None):
+    """
+    Collect the results of a benchmark run in a JSON serializable dictionary.
+    :param parameters: cohort and run settings, only results with equal parameters are comparable
+    :param stats: {operation: {"count", "p50_ms", "p95_ms", "max_ms"}} as returned by StageTimer.stats
+    :param wallSeconds: duration of the whole run
+    :param stageStats: optional per-stage breakdown, also in StageTimer.stats format
+    """
+    import numpy as np
+    import vtk
+    operations = {}
+    for name, values in stats.items():
+        operations[name] = dict(values)
+        operations[name]["per_second"] = 1000.0 / values["p50_ms"] if values["p50_ms"] > 0 else None
+    return {
+        "format": BENCHMARK_FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "vtk": vtk.vtkVersion.GetVTKVersion(),
+            "numpy": np.__version__,
+            "cpus": os.cpu_count(),
+        },
+        "parameters": dict(parameters),
+        "wall_seconds": wallSeconds,
+        "peak_rss_bytes": peakMemoryBytes(),
+        "operations": operations,
+        "stages": stageStats or {},
+    }
+
+
+def writeBenchmarkResults(results, path):
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+    return path
+
+
+def readBenchmarkResults(path):
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def compareBenchmarkResults(baseline, current, tolerance=0.25, metric="p50_ms"):
+    """
+    Return the operations that got slower than baseline by more than tolerance (a fraction) on metric,
+    as a list of (operation, baselineValue, currentValue). Operations missing from either result are ignored.
+    Raises ValueError if the results were produced with different parameters.
+    """
+    if baseline.get("parameters") != current.get("parameters"):
+        raise ValueError(f"Benchmark parameters differ: {baseline.get('parameters')} != {current.get('parameters')}")
+    regressions = []
+    for name, values in current.get("operations", {}).items():
+        baselineValues = baseline.get("operations", {}).get(name)
+        if baselineValues is None:
+            continue
+        if values[metric] > baselineValues[metric] * (1.0 + tolerance):
+            regressions.append((name, baselineValues[metric], values[metric]))
+    return regressions
@@ -0,0 +1,158 @@
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+import vtk
+
+from .LandmarkTransfer import listModelFiles
+from .ModelPrefetcher import markupsFilePath, readMarkupsFile, readModelFile
+from .ModelProxies import ContentHashes, ProxyCache, fileContentHash
+from .NormalizedModels import NormalizedModelCache
+from .ViewFrames import computeViewFrame
+
+
+#
+# Parallel scan and validation of a model directory
+#
+
+def scanModelFile(modelPath, proxyCacheDir=None, proxyRatio=None, normalizedCacheDir=None, viewFrames=False,
+                  fileName=None):
+    """
+    Read one model file and its .mrk.json sibling and return a dictionary describing them:
+    point and cell counts, bounds, surface area, centroid, markups status, size, modification time,
+    content hash, timing and error if any.
+    If proxyCacheDir and proxyRatio are given the decimated proxy of the model is built as well.
+    If normalizedCacheDir is given the model is converted to a binary .vtp copy there (see NormalizedModelCache),
+    or read from that copy if it already exists.
+    If viewFrames is True the view frame of the model (see computeViewFrame) is computed into record["viewFrame"].
+    fileName is the name of the model in its directory (relative path in recursive mode), its base name by default.
+    Runs in a worker thread or process, so it must not use the MRML scene.
+    """
+    startTime = time.time()
+    record = {
+        "fileName": fileName or os.path.basename(modelPath),
+        "ok": False,
+        "error": None,
+        "fileSize": None,
+        "mtimeNs": None,
+        "hash": None,
+        "numberOfPoints": 0,
+        "numberOfCells": 0,
+        "bounds": None,
+        "surfaceArea": None,
+        "centroid": None,
+        "hasMarkups": False,
+        "numberOfControlPoints": 0,
+        "viewFrame": None,
+    }
+    try:
+        stat = os.stat(modelPath)
+        record["fileSize"] = stat.st_size
+        record["mtimeNs"] = stat.st_mtime_ns
+        record["hash"] = fileContentHash(modelPath)
+        if normalizedCacheDir:
+            normalizedCache = NormalizedModelCache(normalizedCacheDir)
+            cachedPath = normalizedCache.cachedPath(modelPath, record["hash"])
+            if os.path.exists(cachedPath):
+                polyData = readModelFile(cachedPath)
+            else:
+                polyData = readModelFile(modelPath)
+                normalizedCache.writeModel(modelPath, polyData, record["hash"])
+        else:
+            polyData = readModelFile(modelPath)
+        record["numberOfPoints"] = polyData.GetNumberOfPoints()
+        record["numberOfCells"] = polyData.GetNumberOfCells()
+        if record["numberOfCells"] == 0:
+            raise ValueError("model has no faces")
+        record["bounds"] = list(polyData.GetBounds())
+        triangles = vtk.vtkTriangleFilter()
+        triangles.SetInputData(polyData)
+        massProperties = vtk.vtkMassProperties()
+        massProperties.SetInputConnection(triangles.GetOutputPort())
+        massProperties.Update()
+        record["surfaceArea"] = massProperties.GetSurfaceArea()
+        centerOfMass = vtk.vtkCenterOfMass()
+        centerOfMass.SetInputData(polyData)
+        centerOfMass.SetUseScalarsAsWeights(False)
+        centerOfMass.Update()
+        record["centroid"] = list(centerOfMass.GetCenter())
+        if proxyCacheDir and proxyRatio:
+            hashes = ContentHashes()
+            hashes.add(modelPath, stat.st_size, stat.st_mtime_ns, record["hash"])
+            ProxyCache(proxyCacheDir, proxyRatio, hashes).getProxy(modelPath, polyData)
+        markups = readMarkupsFile(markupsFilePath(modelPath))
+        if viewFrames:
+            record["viewFrame"] = computeViewFrame(polyData, markups["positions"] if markups is not None else None)
+        if markups is not None:
+            record["hasMarkups"] = True
+            record["numberOfControlPoints"] = len(markups["positions"])
+        else:
+            raise ValueError("missing or invalid .mrk.json file")
+        record["ok"] = True
+    except Exception as e:
+        record["error"] = str(e)
+    record["seconds"] = time.time() - startTime
+    return record
+
+
+def _scanNamedModelFile(scan, modelPath, fileName):
+    return scan(modelPath, fileName=fileName)
+
+
+def _processPoolContext():
+    # Workers are spawned, never forked: Slicer runs Qt, ITK and VTK threads even headless, and a lock held by one of
+    # them would stay locked in a forked child. In Slicer sys.executable is the application, so the plain
+    # interpreter PythonSlicer is spawned instead.
+    import shutil
+    context = multiprocessing.get_context("spawn")
+    executable = shutil.which("PythonSlicer")
+    if executable:
+        context.set_executable(executable)
+    return context
+
+
+def scanDirectory(modelDir, modelFileExt="ply", workers=None, manifestPath=None, proxyCacheDir=None, proxyRatio=None,
+                  normalizedCacheDir=None, viewFrames=False, processes=False, patterns=None, recursive=False):
+    """
+    Scan all model files of a directory with a pool of worker threads, or of spawned worker processes if processes
+    is True. VTK readers release the GIL, so threads are usually enough and avoid starting an interpreter per worker.
+    If manifestPath is given the per-file records, timings and failures are written there as JSON.
+    If proxyCacheDir and proxyRatio are given the level of detail proxies are built during the scan.
+    If normalizedCacheDir is given the binary copies of the models are written during the scan.
+    If viewFrames is True the view frames of the models are computed into their records.
+    patterns and recursive select the model files as in listModelFiles; records are named like the models of
+    models_ids.csv (paths relative to modelDir) and are in the order of listModelFiles().
+    Returns the manifest dictionary.
+    """
+    startTime = time.time()
+    modelFiles = listModelFiles(modelDir, modelFileExt, patterns, recursive)
+    workers = workers or os.cpu_count() or 1
+    modelPaths = [os.path.join(modelDir, fileName) for fileName in modelFiles]
+    scan = partial(scanModelFile, proxyCacheDir=proxyCacheDir, proxyRatio=proxyRatio, normalizedCacheDir=normalizedCacheDir,
+                   viewFrames=viewFrames)
+    if workers == 1 or len(modelPaths) < 2:
+        records = [scan(modelPath, fileName=fileName) for modelPath, fileName in zip(modelPaths, modelFiles)]
+    else:
+        chunkSize = max(1, len(modelPaths) // (workers * 8))
+        if processes:
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=_processPoolContext())
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="PointSelectorScan")
+        with executor:
+            records = list(executor.map(partial(_scanNamedModelFile, scan), modelPaths, modelFiles, chunksize=chunkSize))
+    manifest = {
+        "directory": os.path.abspath(modelDir),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "workers": workers,
+        "numberOfModels": len(records),
+        "totalSeconds": time.time() - startTime,
+        "failed": [record["fileName"] for record in records if not record["ok"]],
+        "models": records,
+    }
+    if manifestPath:
+        with open(manifestPath, "w") as file:
+            json.dump(manifest, file, indent=1)
+    return manifest
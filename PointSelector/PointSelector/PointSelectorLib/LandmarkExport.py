@@ -0,0 +1,69 @@
+import os
+from itertools import chain, repeat
+from operator import itemgetter
+
+import numpy as np
+
+
+#
+# Typed columnar export of landmarks
+#
+
+EXPORT_FORMATS = {"feather": ".feather", "parquet": ".parquet", "npz": ".npz"}
+
+
+def landmarkColumns(items, modelIds):
+    """
+    Convert LandmarkStore.items() into a dictionary of typed NumPy columns:
+    model_id, file_name, index, x, y, z, vertex_id (-1 if not snapped), distance (NaN if not snapped)
+    and timestamp (seconds since epoch, NaN if unknown). Rows are sorted by model_id and index.
+    modelIds maps model file names to their id in models_ids.csv; unknown files get -1.
+    """
+    # columns are gathered with C-level iterators (map, itemgetter, np.fromiter), not with a loop over the rows
+    count = len(items)
+    fileNames = np.fromiter(map(itemgetter(0), items), dtype=object, count=count)
+    landmarks = list(map(itemgetter(2), items))
+    positions = np.fromiter(chain.from_iterable(map(itemgetter(0), landmarks)), dtype=np.float64, count=3 * count)
+    # None (not snapped, unknown time) becomes NaN in float arrays
+    vertexIds = np.array(list(map(itemgetter(1), landmarks)), dtype=np.float64)
+    columns = {
+        "model_id": np.fromiter(map(modelIds.get, fileNames, repeat(-1, count)), dtype=np.int32, count=count),
+        "file_name": fileNames,
+        "index": np.fromiter(map(itemgetter(1), items), dtype=np.int32, count=count),
+        "x": positions[0::3],
+        "y": positions[1::3],
+        "z": positions[2::3],
+        "vertex_id": np.where(np.isnan(vertexIds), -1, vertexIds).astype(np.int64),
+        "distance": np.array(list(map(itemgetter(2), landmarks)), dtype=np.float64),
+        "timestamp": np.array(list(map(itemgetter(3), items)), dtype=np.float64),
+    }
+    order = np.lexsort((columns["index"], columns["model_id"]))
+    return {name: column[order] for name, column in columns.items()}
+
+
+def writeLandmarkColumns(columns, path, format="feather"):
+    """
+    Write landmark columns to path.
+    feather: uncompressed Arrow IPC file, can be memory-mapped (pyarrow.feather.read_table(path, memory_map=True))
+    parquet: compressed Parquet file, for archiving
+    npz: one NumPy array per column, file_name stored as a fixed width unicode array (numpy only)
+    feather and parquet require pyarrow.
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid export format {format}, expected one of {tuple(EXPORT_FORMATS)}")
+    temporaryPath = path + ".tmp" + EXPORT_FORMATS[format]
+    if format == "npz":
+        arrays = dict(columns)
+        arrays["file_name"] = arrays["file_name"].astype(str)
+        np.savez(temporaryPath, **arrays)
+    else:
+        import pandas as pd
+        df = pd.DataFrame(columns)
+        df["file_name"] = df["file_name"].astype("category")
+        df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s")
+        if format == "feather":
+            df.to_feather(temporaryPath, compression="uncompressed")
+        else:
+            df.to_parquet(temporaryPath, index=False)
+    os.replace(temporaryPath, path)
+    return path
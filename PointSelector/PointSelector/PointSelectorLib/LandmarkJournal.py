@@ -0,0 +1,223 @@
+import json
+import os
+
+
+#
+# LandmarkOperation
+#
+
+class LandmarkOperation:
+    """
+    A single landmark edit. Landmarks are (position, vertexId, distance) tuples as in LandmarkStore.
+    landmark is None for a delete and previousLandmark is None for an add.
+    """
+
+    ADD = "add"
+    MOVE = "move"
+    DELETE = "delete"
+
+    def __init__(self, kind, fileName, index, landmark, previousLandmark):
+        self.kind = kind
+        self.fileName = fileName
+        self.index = int(index)
+        self.landmark = landmark
+        self.previousLandmark = previousLandmark
+
+    @property
+    def position(self):
+        return None if self.landmark is None else self.landmark[0]
+
+    @property
+    def previousPosition(self):
+        return None if self.previousLandmark is None else self.previousLandmark[0]
+
+    def toDict(self):
+        return {"op": self.kind, "file": self.fileName, "index": self.index,
+                "landmark": self.landmark, "previous": self.previousLandmark}
+
+    @classmethod
+    def fromDict(cls, entry):
+        def landmarkFromJson(value):
+            if value is None:
+                return None
+            if "landmark" not in entry:
+                # logs written before snapping was added only store positions
+                return (value, None, None)
+            return tuple(value)
+        landmark = entry["landmark"] if "landmark" in entry else entry["position"]
+        return cls(entry["op"], entry["file"], entry["index"], landmarkFromJson(landmark), landmarkFromJson(entry["previous"]))
+
+
+#
+# LandmarkJournal
+#
+
+class LandmarkJournal:
+    """
+    Undo/redo stacks of landmark edits applied to a LandmarkStore.
+
+    Every edit, undo and redo is appended as one JSON line to an operation log, so undo and redo cost O(1)
+    regardless of the session length and the stacks and landmark positions can be rebuilt after a crash with replay().
+    Undoing only updates the store index, the store is compacted into landmarks.csv separately.
+    When the journal is closed or resumed the log is rewritten with only the last maximumHistory edits and the
+    undone ones (see checkpoint), so resuming costs time in the size of the kept history, not of the whole session.
+    """
+
+    UNDO = "undo"
+    REDO = "redo"
+
+    def __init__(self, logPath, store, truncate=True, maximumHistory=1000):
+        self.logPath = logPath
+        self.store = store
+        self.maximumHistory = maximumHistory
+        self._undoStack = []
+        self._redoStack = []
+        self._file = None
+        if not truncate and os.path.exists(logPath):
+            if self.replay() > len(self._undoStack) + 2 * len(self._redoStack):
+                self.checkpoint()
+        if self._file is None:
+            self._file = open(logPath, 'w' if truncate else 'a')
+
+    def canUndo(self):
+        return bool(self._undoStack)
+
+    def canRedo(self):
+        return bool(self._redoStack)
+
+    def record(self, fileName, index, position, vertexId=None, distance=None):
+        """
+        Set a landmark position (or delete it if position is None) and journal the edit.
+        Returns the journaled LandmarkOperation.
+        """
+        previousLandmark = self.store.getLandmark(fileName, index)
+        if position is None:
+            if previousLandmark is None:
+                return None
+            kind = LandmarkOperation.DELETE
+            landmark = None
+        else:
+            landmark = ([float(p) for p in position],
+                        None if vertexId is None else int(vertexId),
+                        None if distance is None else float(distance))
+            kind = LandmarkOperation.ADD if previousLandmark is None else LandmarkOperation.MOVE
+        operation = LandmarkOperation(kind, fileName, index, landmark, previousLandmark)
+        self._apply(operation.fileName, operation.index, operation.landmark)
+        self._undoStack.append(operation)
+        self._redoStack.clear()
+        self._write(operation.toDict())
+        return operation
+
+    def undo(self):
+        """
+        Revert the last edit. Returns the reverted LandmarkOperation or None if there is nothing to undo.
+        """
+        if not self._undoStack:
+            return None
+        operation = self._undoStack.pop()
+        self._apply(operation.fileName, operation.index, operation.previousLandmark)
+        self._redoStack.append(operation)
+        self._write({"op": self.UNDO})
+        return operation
+
+    def redo(self):
+        """
+        Apply the last undone edit again. Returns the LandmarkOperation or None if there is nothing to redo.
+        """
+        if not self._redoStack:
+            return None
+        operation = self._redoStack.pop()
+        self._apply(operation.fileName, operation.index, operation.landmark)
+        self._undoStack.append(operation)
+        self._write({"op": self.REDO})
+        return operation
+
+    def replay(self):
+        """
+        Rebuild the undo/redo stacks from the operation log and bring the store to the logged state.
+        Only landmarks whose final logged state differs from the store (e.g. rows lost in a crash) are written to it.
+        Returns the number of log entries read.
+        """
+        self._undoStack = []
+        self._redoStack = []
+        # final logged state of every landmark touched by the log
+        landmarks = {}
+        count = 0
+        for entry in self._entries():
+            count += 1
+            if entry["op"] == self.UNDO:
+                operation = self._undoStack.pop()
+                self._redoStack.append(operation)
+                landmark = operation.previousLandmark
+            elif entry["op"] == self.REDO:
+                operation = self._redoStack.pop()
+                self._undoStack.append(operation)
+                landmark = operation.landmark
+            else:
+                operation = LandmarkOperation.fromDict(entry)
+                self._undoStack.append(operation)
+                self._redoStack.clear()
+                landmark = operation.landmark
+            landmarks[(operation.fileName, operation.index)] = landmark
+        for (fileName, index), landmark in landmarks.items():
+            if self.store.getLandmark(fileName, index) != landmark:
+                self._apply(fileName, index, landmark)
+        return count
+
+    def checkpoint(self):
+        """
+        Rewrite the operation log with only the last maximumHistory edits of the undo stack and the redo stack,
+        so that replay() rebuilds the same stacks. Older edits can no longer be undone.
+        """
+        del self._undoStack[:max(len(self._undoStack) - self.maximumHistory, 0)]
+        # the undone edits are logged as edits in reverse order, then undone again
+        entries = [operation.toDict() for operation in self._undoStack + self._redoStack[::-1]]
+        entries += [{"op": self.UNDO}] * len(self._redoStack)
+        self._rewrite(entries)
+
+    def flush(self):
+        """
+        Write logged operations to the file, applying the fsync policy of the store.
+        """
+        if self._file is None:
+            return
+        self._file.flush()
+        if self.store.fsyncPolicy != "never":
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self.checkpoint()
+            self._file.close()
+            self._file = None
+
+    def _apply(self, fileName, index, landmark):
+        if landmark is None:
+            self.store.remove(fileName, index)
+        else:
+            self.store.set(fileName, index, *landmark)
+
+    def _entries(self):
+        with open(self.logPath, 'r') as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # last line may be incomplete after a crash
+                    return
+
+    def _rewrite(self, entries):
+        if self._file is not None:
+            self._file.close()
+        temporaryPath = self.logPath + ".tmp"
+        with open(temporaryPath, 'w') as file:
+            file.writelines(json.dumps(entry) + "\n" for entry in entries)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporaryPath, self.logPath)
+        self._file = open(self.logPath, 'a')
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry) + "\n")
+        if self.store.fsyncPolicy == "always":
+            self.flush()
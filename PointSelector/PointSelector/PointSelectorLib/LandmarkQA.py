@@ -0,0 +1,127 @@
+import numpy as np
+
+
+#
+# Landmark consistency checks across the cohort
+#
+
+def landmarkArray(columns, modelCount, landmarkCount):
+    """
+    Scatter landmark columns (see landmarkColumns) into a (modelCount, landmarkCount, 3) array.
+    Landmarks that were not picked, or whose model_id or index is out of range, are NaN.
+    """
+    shapes = np.full((modelCount, landmarkCount, 3), np.nan)
+    modelIds = np.asarray(columns["model_id"])
+    indices = np.asarray(columns["index"])
+    valid = (modelIds >= 0) & (modelIds < modelCount) & (indices >= 0) & (indices < landmarkCount)
+    shapes[modelIds[valid], indices[valid]] = np.column_stack(
+        (columns["x"][valid], columns["y"][valid], columns["z"][valid]))
+    return shapes
+
+
+def _alignTo(shapes, weights, reference):
+    """
+    Rotate, scale and translate every shape onto reference (weighted Kabsch, batched over the shapes).
+    shapes is (M, K, 3) with missing landmarks set to 0 and a weight of 0 in the (M, K) weights array.
+    """
+    counts = np.maximum(weights.sum(axis=1), 1)[:, None]
+    centroids = (weights[:, None, :] @ shapes)[:, 0] / counts
+    centered = (shapes - centroids[:, None, :]) * weights[:, :, None]
+    # the reference is centered on the landmarks present in each shape
+    referenceCentroids = weights @ reference / counts
+    centeredReference = (reference[None, :, :] - referenceCentroids[:, None, :]) * weights[:, :, None]
+    covariances = centered.transpose(0, 2, 1) @ centeredReference
+    u, s, vt = np.linalg.svd(covariances)
+    # reflections are not allowed: flip the axis of the smallest singular value
+    signs = np.sign(np.linalg.det(u @ vt))
+    signs[signs == 0] = 1
+    u[:, :, 2] *= signs[:, None]
+    s[:, 2] *= signs
+    rotations = u @ vt
+    norms = np.einsum('mkd,mkd->m', centered, centered)
+    scales = s.sum(axis=1) / np.where(norms > 0, norms, 1)
+    aligned = (centered @ rotations) * scales[:, None, None]
+    return aligned + referenceCentroids[:, None, :]
+
+
+def generalizedProcrustes(shapes, maximumIterations=20, tolerance=1e-8):
+    """
+    Generalized Procrustes analysis of a (M, K, 3) landmark array with NaN for missing landmarks.
+    Every shape is aligned to the mean shape by a similarity transform, then the mean is recomputed,
+    until the mean changes less than tolerance. Missing landmarks do not contribute to the alignment or the mean.
+    Shapes with less than 3 landmarks cannot be aligned and are returned as NaN.
+    Returns the aligned shapes (NaN where missing) and the (K, 3) mean shape of unit centroid size.
+    """
+    present = ~np.isnan(shapes).any(axis=2)
+    present[present.sum(axis=1) < 3] = False
+    weights = present.astype(float)
+    filled = np.where(present[:, :, None], shapes, 0.0)
+    # the most complete shape is the initial reference
+    reference = filled[np.argmax(weights.sum(axis=1))]
+    aligned = filled
+    for _ in range(maximumIterations):
+        aligned = _alignTo(filled, weights, reference)
+        landmarkCounts = weights.sum(axis=0)[:, None]
+        mean = np.einsum('mk,mkd->kd', weights, aligned) / np.maximum(landmarkCounts, 1)
+        mean = np.where(landmarkCounts > 0, mean, reference)
+        mean -= mean.mean(axis=0)
+        size = np.sqrt((mean ** 2).sum())
+        if size > 0:
+            mean /= size
+        change = np.abs(mean - reference).max()
+        reference = mean
+        if change < tolerance:
+            break
+    aligned = _alignTo(filled, weights, reference)
+    aligned[~present] = np.nan
+    return aligned, reference
+
+
+def landmarkOutliers(aligned, mean, threshold=4.0, swapRatio=0.5, chunkSize=2048):
+    """
+    Find misplaced landmarks in Procrustes aligned shapes (see generalizedProcrustes).
+    distances: (M, K) distance of every landmark to the mean landmark
+    scores: (M, K) distances divided by the median distance of their landmark index across the cohort
+    outliers: (M, K) landmarks with a score above threshold
+    swaps: (M, K) index of the landmark this one looks swapped with, -1 if none. A pair i, j is swapped
+      when exchanging the two indices makes their summed distance to the mean less than swapRatio of the current one.
+    """
+    distances = np.linalg.norm(aligned - mean[None, :, :], axis=2)
+    # distances to the mean are positive and skewed, the median is a robust scale of each landmark index
+    median = np.nanmedian(distances, axis=0)
+    scores = distances / np.where(median > 0, median, np.finfo(float).eps)
+    outliers = np.nan_to_num(scores, nan=0.0) > threshold
+
+    modelCount, landmarkCount = distances.shape
+    swaps = np.full((modelCount, landmarkCount), -1, dtype=np.int32)
+    if landmarkCount > 1:
+        offDiagonal = ~np.eye(landmarkCount, dtype=bool)
+        meanSquares = (mean ** 2).sum(axis=1)
+        for start in range(0, modelCount, chunkSize):
+            chunk = aligned[start:start + chunkSize]
+            # crossDistances[m, i, j]: distance of landmark i of shape m to mean landmark j
+            squares = (chunk ** 2).sum(axis=2)
+            crossDistances = np.sqrt(np.maximum(
+                squares[:, :, None] + meanSquares[None, None, :] - 2 * chunk @ mean.T, 0))
+            own = np.diagonal(crossDistances, axis1=1, axis2=2)
+            currentCost = own[:, :, None] + own[:, None, :]
+            swappedCost = crossDistances + crossDistances.transpose(0, 2, 1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                ratios = swappedCost / currentCost
+            ratios = np.where(offDiagonal & np.isfinite(ratios), ratios, np.inf)
+            partners = ratios.argmin(axis=2)
+            best = np.take_along_axis(ratios, partners[:, :, None], axis=2)[:, :, 0]
+            swaps[start:start + chunkSize] = np.where(best < swapRatio, partners, -1)
+    return {"distances": distances, "scores": scores, "outliers": outliers, "swaps": swaps}
+
+
+def reviewOrder(qa):
+    """
+    Return the order in which models should be reviewed: models with outliers or swapped landmarks first,
+    highest score first, then the other models in their original order.
+    """
+    flagged = qa["outliers"].any(axis=1) | (qa["swaps"] >= 0).any(axis=1)
+    modelScores = np.nan_to_num(qa["scores"], nan=-np.inf).max(axis=1, initial=-np.inf)
+    flaggedRows = np.flatnonzero(flagged)
+    flaggedRows = flaggedRows[np.argsort(-modelScores[flaggedRows], kind="stable")]
+    return np.concatenate((flaggedRows, np.flatnonzero(~flagged)))
@@ -0,0 +1,237 @@
+import csv
+import json
+import os
+import threading
+import time
+
+
+#
+# LandmarkStore
+#
+
+class LandmarkStore:
+    """
+    Append-only writer of landmarks.csv that keeps one file handle open and writes rows in batches.
+    The latest position of every landmark is indexed in memory by (FileName, Index_no) so lookups never read the file.
+    A landmark snapped to the model surface also stores the closest vertex id and the snapping distance.
+
+    Every set() appends a row, so a landmark that was moved appears several times and the last row wins.
+    Removing a landmark only updates the index and marks the file as stale; compact() (or compactInBackground())
+    then rewrites landmarks.csv from the index with one row per landmark.
+
+    fsyncPolicy controls durability of the written rows:
+      - "never": rows are handed to the operating system on flush, it decides when they reach the disk
+      - "flush": every flush is followed by os.fsync (default)
+      - "always": every added row is flushed and synced immediately
+    """
+
+    HEADER = ['FileName', 'Index_no', 'Position/Location-x,y,z', 'Vertex_id', 'Distance']
+    FSYNC_POLICIES = ("never", "flush", "always")
+
+    def __init__(self, csvPath, fsyncPolicy="flush", maximumBufferedRows=100, truncate=True):
+        if fsyncPolicy not in self.FSYNC_POLICIES:
+            raise ValueError(f"Invalid fsync policy {fsyncPolicy}, expected one of {self.FSYNC_POLICIES}")
+        self.csvPath = csvPath
+        self.fsyncPolicy = fsyncPolicy
+        self.maximumBufferedRows = maximumBufferedRows
+        # latest landmarks: {FileName: {Index_no: ([x, y, z], vertexId, distance)}}
+        self._landmarks = {}
+        # time each landmark was last set in this session, not stored in landmarks.csv
+        self._timestamps = {}
+        self._buffer = []
+        self._stale = False
+        self._lock = threading.RLock()
+        self._compactThread = None
+        if truncate or not os.path.exists(csvPath):
+            with open(csvPath, 'w', newline='') as file:
+                csv.writer(file).writerow(self.HEADER)
+        else:
+            self._readRows()
+        self._openForAppend()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(landmarks) for landmarks in self._landmarks.values())
+
+    def set(self, fileName, index, position, vertexId=None, distance=None):
+        """
+        Record the position of landmark index on model fileName. The row is written at the next flush.
+        """
+        landmark = ([float(p) for p in position],
+                    None if vertexId is None else int(vertexId),
+                    None if distance is None else float(distance))
+        row = (fileName, int(index), landmark)
+        with self._lock:
+            self._landmarks.setdefault(fileName, {})[row[1]] = row[2]
+            self._timestamps[(fileName, row[1])] = time.time()
+            self._buffer.append(row)
+            if self.fsyncPolicy == "always" or len(self._buffer) >= self.maximumBufferedRows:
+                self.flush()
+
+    def remove(self, fileName, index):
+        """
+        Remove a landmark. landmarks.csv still contains it until the next compaction.
+        """
+        with self._lock:
+            landmarks = self._landmarks.get(fileName, {})
+            if landmarks.pop(int(index), None) is None:
+                return
+            self._timestamps.pop((fileName, int(index)), None)
+            if not landmarks:
+                del self._landmarks[fileName]
+            self._stale = True
+
+    def get(self, fileName, index):
+        """
+        Return the latest position of a landmark, or None if it was not recorded.
+        """
+        landmark = self.getLandmark(fileName, index)
+        return None if landmark is None else landmark[0]
+
+    def getLandmark(self, fileName, index):
+        """
+        Return the latest (position, vertexId, distance) of a landmark, or None if it was not recorded.
+        """
+        with self._lock:
+            return self._landmarks.get(fileName, {}).get(int(index))
+
+    def landmarksForModel(self, fileName):
+        """
+        Return a dictionary mapping landmark index to the latest position for a model.
+        """
+        with self._lock:
+            return {index: landmark[0] for index, landmark in self._landmarks.get(fileName, {}).items()}
+
+    def items(self):
+        """
+        Return a list of (FileName, Index_no, (position, vertexId, distance), timestamp) for all landmarks.
+        timestamp is None for landmarks read from an existing file and not changed since.
+        """
+        with self._lock:
+            return [(fileName, index, landmark, self._timestamps.get((fileName, index)))
+                    for fileName, landmarks in self._landmarks.items()
+                    for index, landmark in landmarks.items()]
+
+    def countForModel(self, fileName):
+        with self._lock:
+            return len(self._landmarks.get(fileName, {}))
+
+    def incompleteModels(self, fileNames, landmarkCount):
+        """
+        Return the models of fileNames, in the same order, that have less than landmarkCount landmarks.
+        """
+        with self._lock:
+            return [fileName for fileName in fileNames if len(self._landmarks.get(fileName, {})) < landmarkCount]
+
+    def positionsOfLandmark(self, index):
+        """
+        Return {FileName: [x, y, z]} of landmark index on all models.
+        """
+        with self._lock:
+            return {fileName: landmarks[int(index)][0]
+                    for fileName, landmarks in self._landmarks.items() if int(index) in landmarks}
+
+    @property
+    def stale(self):
+        """
+        True if landmarks were removed since landmarks.csv was last compacted.
+        """
+        return self._stale
+
+    def flush(self):
+        """
+        Write buffered rows to the file and apply the fsync policy.
+        While a compaction is running rows stay buffered and are written to the compacted file.
+        """
+        with self._lock:
+            if not self._buffer or self._file is None:
+                return
+            self._writer.writerows([self._formatRow(row) for row in self._buffer])
+            self._buffer = []
+            self._file.flush()
+            if self.fsyncPolicy != "never":
+                os.fsync(self._file.fileno())
+
+    def compact(self):
+        """
+        Rewrite landmarks.csv with one row per landmark. The file is replaced atomically,
+        so a crash during compaction leaves the previous file intact.
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            # the snapshot contains every buffered row, later rows are buffered until the new file is open
+            rows = [(fileName, index, landmark)
+                    for fileName, landmarks in self._landmarks.items()
+                    for index, landmark in landmarks.items()]
+            self._buffer = []
+            self._stale = False
+            self._file.close()
+            self._file = None
+        temporaryPath = self.csvPath + ".tmp"
+        with open(temporaryPath, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(self.HEADER)
+            writer.writerows([self._formatRow(row) for row in rows])
+            file.flush()
+            os.fsync(file.fileno())
+        with self._lock:
+            os.replace(temporaryPath, self.csvPath)
+            self._openForAppend()
+            self.flush()
+
+    def compactInBackground(self):
+        """
+        Run compact() on a worker thread. Does nothing if a compaction is already running,
+        the store stays stale in that case if more landmarks were removed meanwhile.
+        """
+        if self._compactThread is not None and self._compactThread.is_alive():
+            return
+        self._compactThread = threading.Thread(target=self.compact, name="PointSelectorCompact", daemon=True)
+        self._compactThread.start()
+
+    def close(self):
+        if self._compactThread is not None:
+            self._compactThread.join()
+            self._compactThread = None
+        if self._stale:
+            self.compact()
+        with self._lock:
+            if self._file is None:
+                return
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    @staticmethod
+    def parsePosition(text):
+        """
+        Parse the position column of a row, "[x, y, z]". Also reads nan and inf, which older files wrote
+        in Python notation instead of JSON.
+        """
+        return [float(value) for value in text.strip().strip("[]").split(",")]
+
+    @staticmethod
+    def _formatRow(row):
+        fileName, index, (position, vertexId, distance) = row
+        # JSON writes NaN as NaN, which readers of the column parse, and finite values like str()
+        return [fileName, index, json.dumps(position),
+                "" if vertexId is None else vertexId,
+                "" if distance is None else distance]
+
+    def _openForAppend(self):
+        self._file = open(self.csvPath, 'a', newline='')
+        self._writer = csv.writer(self._file)
+
+    def _readRows(self):
+        with open(self.csvPath, 'r', newline='') as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            for row in reader:
+                # files written before snapping was added only have the first three columns
+                fileName, index, position = row[:3]
+                vertexId, distance = (row[3:5] + ["", ""])[:2]
+                self._landmarks.setdefault(fileName, {})[int(index)] = (
+                    self.parsePosition(position),
+                    int(vertexId) if vertexId else None,
+                    float(distance) if distance else None)
@@ -0,0 +1,346 @@
+import logging
+import os
+import threading
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
+
+from .ModelPrefetcher import readModelFile
+from .ModelProxies import ContentHashes
+
+
+#
+# Per-vertex mesh features
+#
+
+def meshArrays(polyData):
+    """
+    Return the points (N, 3) and triangles (F, 3) of a model as NumPy arrays. Polygons are triangulated.
+    """
+    triangleFilter = vtk.vtkTriangleFilter()
+    triangleFilter.SetInputData(polyData)
+    triangleFilter.PassLinesOff()
+    triangleFilter.PassVertsOff()
+    triangleFilter.Update()
+    triangulated = triangleFilter.GetOutput()
+    points = vtk_to_numpy(triangulated.GetPoints().GetData()).astype(np.float64)
+    triangles = vtk_to_numpy(triangulated.GetPolys().GetConnectivityArray()).reshape(-1, 3).astype(np.int64)
+    return points, triangles
+
+
+def meshEdges(triangles):
+    """
+    Return the unique undirected edges (E, 2) of a triangle mesh.
+    """
+    edges = np.concatenate((triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]))
+    edges.sort(axis=1)
+    return np.unique(edges, axis=0)
+
+
+def smoothVertexValues(values, edges, iterations=2):
+    """
+    Average per-vertex values with their one-ring neighbours, iterations times.
+    """
+    count = len(values)
+    neighbours = np.bincount(edges.ravel(), minlength=count) + 1.0
+    for _ in range(iterations):
+        sums = values + np.bincount(edges[:, 0], values[edges[:, 1]], count) + np.bincount(edges[:, 1], values[edges[:, 0]], count)
+        values = sums / neighbours
+    return values
+
+
+def curvatureFeatures(points, triangles):
+    """
+    Estimate the principal curvatures of every vertex of a triangle mesh from the cotangent Laplacian (mean curvature)
+    and the angle deficit (Gaussian curvature), over the barycentric area of the vertex.
+    Returns (k1, k2, area) with k1 >= k2 per vertex and the total surface area.
+    Curvatures are positive on convex regions if the triangles are oriented outwards.
+    """
+    count = len(points)
+    corners = points[triangles]
+    faceCross = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    doubleAreas = np.linalg.norm(faceCross, axis=1)
+    safeDoubleAreas = np.where(doubleAreas > 0, doubleAreas, np.inf)
+
+    vertexAreas = np.zeros(count)
+    angleSums = np.zeros(count)
+    laplacian = np.zeros((count, 3))
+    for corner in range(3):
+        i = triangles[:, corner]
+        j = triangles[:, (corner + 1) % 3]
+        k = triangles[:, (corner + 2) % 3]
+        toJ = points[j] - points[i]
+        toK = points[k] - points[i]
+        dot = np.einsum('fd,fd->f', toJ, toK)
+        angleSums += np.bincount(i, np.arctan2(doubleAreas, dot), count)
+        vertexAreas += np.bincount(i, doubleAreas / 6.0, count)
+        # cotangent of the angle at i weights the opposite edge j-k
+        weights = 0.5 * dot / safeDoubleAreas
+        edge = points[k] - points[j]
+        for axis in range(3):
+            laplacian[:, axis] += np.bincount(j, weights * edge[:, axis], count)
+            laplacian[:, axis] -= np.bincount(k, weights * edge[:, axis], count)
+
+    normals = np.zeros((count, 3))
+    for corner in range(3):
+        for axis in range(3):
+            normals[:, axis] += np.bincount(triangles[:, corner], faceCross[:, axis], count)
+    normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-12)[:, None]
+
+    safeAreas = np.maximum(vertexAreas, 1e-12)
+    meanCurvature = -np.einsum('nd,nd->n', laplacian, normals) / (2.0 * safeAreas)
+    gaussianCurvature = (2.0 * np.pi - angleSums) / safeAreas
+    root = np.sqrt(np.maximum(meanCurvature ** 2 - gaussianCurvature, 0.0))
+    return meanCurvature + root, meanCurvature - root, doubleAreas.sum() / 2.0
+
+
+def shapeIndex(k1, k2):
+    """
+    Koenderink shape index in [-1, 1]: 1 for caps, 0.5 for ridges, 0 for saddles, -0.5 for ruts, -1 for cups.
+    """
+    return (2.0 / np.pi) * np.arctan2(k1 + k2, k1 - k2)
+
+
+def geodesicDistances(points, edges, sources, targets=None):
+    """
+    Return the (len(sources), N) shortest path distances along mesh edges from source vertices to all vertices,
+    or to the target vertices only, an approximation of geodesic distances. Uses scipy if available, otherwise
+    straight-line distances are returned. Unreachable vertices (other mesh components) are inf.
+    Sources are processed one at a time, so that only the returned distances are held in memory.
+    """
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = slice(None) if targets is None else np.asarray(targets, dtype=np.int64)
+    distances = np.empty((len(sources), len(points[targets])), dtype=np.float64)
+    try:
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import dijkstra
+    except ImportError:
+        logging.warning("scipy is not available, landmark suggestions use straight-line instead of geodesic distances")
+        targetPoints = points[targets]
+        for row, source in enumerate(sources):
+            distances[row] = np.linalg.norm(targetPoints - points[source], axis=1)
+        return distances
+    lengths = np.linalg.norm(points[edges[:, 0]] - points[edges[:, 1]], axis=1)
+    graph = csr_matrix((lengths, (edges[:, 0], edges[:, 1])), shape=(len(points), len(points)))
+    for row, source in enumerate(sources):
+        distances[row] = dijkstra(graph, directed=False, indices=source)[targets]
+    return distances
+
+
+#
+# MeshFeatures
+#
+
+class MeshFeatures:
+    """
+    Geometry and per-vertex features of one model used to suggest landmarks: points, edges, smoothed shape index,
+    smoothed curvedness multiplied by scale, and scale (square root of the surface area), which makes curvedness
+    and geodesic distances comparable between models of different size.
+    """
+
+    def __init__(self, points, edges, shapeIndex, curvedness, scale):
+        self.points = points
+        self.edges = edges
+        self.shapeIndex = shapeIndex
+        self.curvedness = curvedness
+        self.scale = scale
+
+    def closestVertices(self, positions):
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        return np.array([np.argmin(((self.points - position) ** 2).sum(axis=1)) for position in positions], dtype=np.int64)
+
+    def normalizedGeodesics(self, vertexIds, targetVertexIds=None):
+        return geodesicDistances(self.points, self.edges, vertexIds, targetVertexIds) / self.scale
+
+
+def computeMeshFeatures(polyData, smoothingIterations=2):
+    points, triangles = meshArrays(polyData)
+    edges = meshEdges(triangles)
+    k1, k2, area = curvatureFeatures(points, triangles)
+    scale = np.sqrt(area) if area > 0 else 1.0
+    curvedness = np.sqrt((k1 ** 2 + k2 ** 2) / 2.0) * scale
+    return MeshFeatures(points, edges,
+                        smoothVertexValues(shapeIndex(k1, k2), edges, smoothingIterations),
+                        smoothVertexValues(curvedness, edges, smoothingIterations), scale)
+
+
+#
+# LandmarkPrior
+#
+
+class LandmarkPrior:
+    """
+    Statistics of the landmarks of completed models: shape index and curvedness at every landmark index and
+    normalized geodesic distances between every pair of landmark indices. Only the latest maximumModels are kept.
+    """
+
+    def __init__(self, landmarkCount, maximumModels=20):
+        self.landmarkCount = landmarkCount
+        self._observations = OrderedDict()
+        self.maximumModels = maximumModels
+        self._statistics = None
+
+    def __len__(self):
+        return len(self._observations)
+
+    def __contains__(self, key):
+        return key in self._observations
+
+    def add(self, key, features, vertexIds):
+        """
+        Add the landmarks of a completed model. vertexIds has one vertex id per landmark index, -1 where missing.
+        """
+        vertexIds = np.asarray(vertexIds, dtype=np.int64)
+        present = vertexIds >= 0
+        shapeIndices = np.full(self.landmarkCount, np.nan)
+        curvedness = np.full(self.landmarkCount, np.nan)
+        geodesics = np.full((self.landmarkCount, self.landmarkCount), np.nan)
+        shapeIndices[present] = features.shapeIndex[vertexIds[present]]
+        curvedness[present] = features.curvedness[vertexIds[present]]
+        if present.any():
+            distances = features.normalizedGeodesics(vertexIds[present], vertexIds[present])
+            geodesics[np.ix_(present, present)] = np.where(np.isfinite(distances), distances, np.nan)
+        self._observations.pop(key, None)
+        self._observations[key] = (shapeIndices, curvedness, geodesics)
+        while len(self._observations) > self.maximumModels:
+            self._observations.popitem(last=False)
+        self._statistics = None
+
+    def statistics(self):
+        """
+        Return mean and standard deviation of shape index (K,), curvedness (K,) and geodesic distances (K, K).
+        """
+        if self._statistics is None:
+            shapeIndices, curvedness, geodesics = (np.array(values) for values in zip(*self._observations.values()))
+            # landmark indices never placed give empty slices
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                self._statistics = tuple((np.nanmean(values, axis=0), np.nanstd(values, axis=0))
+                                         for values in (shapeIndices, curvedness, geodesics))
+        return self._statistics
+
+    def suggest(self, features, placedVertexIds, minimumDeviation=(0.05, 0.05, 0.02)):
+        """
+        Return {landmarkIndex: vertexId} for the landmark indices missing from placedVertexIds ({landmarkIndex: vertexId}).
+        Every vertex is scored by the squared deviation of its features from the prior of the landmark index, and of its
+        geodesic distances to the placed landmarks from the prior distances between the landmark indices.
+        """
+        if not self._observations:
+            return {}
+        (shapeMean, shapeDeviation), (curvednessMean, curvednessDeviation), (geodesicMean, geodesicDeviation) = self.statistics()
+        placedIndices = [index for index in placedVertexIds if index < self.landmarkCount]
+        geodesics = features.normalizedGeodesics([placedVertexIds[index] for index in placedIndices]) if placedIndices else None
+        suggestions = {}
+        for index in range(self.landmarkCount):
+            if index in placedVertexIds or np.isnan(shapeMean[index]):
+                continue
+            score = ((features.shapeIndex - shapeMean[index]) / max(shapeDeviation[index], minimumDeviation[0])) ** 2
+            score += ((features.curvedness - curvednessMean[index]) / max(curvednessDeviation[index], minimumDeviation[1])) ** 2
+            for row, placedIndex in enumerate(placedIndices):
+                mean = geodesicMean[placedIndex, index]
+                if np.isnan(mean):
+                    continue
+                deviation = max(geodesicDeviation[placedIndex, index], minimumDeviation[2])
+                score += ((geodesics[row] - mean) / deviation) ** 2
+            score = np.where(np.isfinite(score), score, np.inf)
+            suggestions[index] = int(np.argmin(score))
+        return suggestions
+
+
+#
+# LandmarkSuggester
+#
+
+class LandmarkSuggester:
+    """
+    Suggests positions for the landmarks not placed yet on a model, learned from the completed models.
+    Mesh features are computed on a worker thread and cached in cacheDir as <content hash>_features.npz,
+    so each model is only analyzed once. All methods return futures of the worker thread.
+    """
+
+    CACHE_VERSION = 1
+
+    def __init__(self, cacheDir, landmarkCount, hashes=None, maximumPriorModels=20, readModel=readModelFile,
+                 maximumCachedModels=4):
+        self.cacheDir = cacheDir
+        self.hashes = hashes or ContentHashes()
+        self.readModel = readModel
+        self.prior = LandmarkPrior(landmarkCount, maximumPriorModels)
+        self.maximumCachedModels = maximumCachedModels
+        self._features = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="PointSelectorSuggestions")
+        os.makedirs(cacheDir, exist_ok=True)
+
+    def prepare(self, modelPath, polyData=None):
+        """
+        Compute or load the features of a model in the background, e.g. when it is shown.
+        """
+        return self._executor.submit(self.features, modelPath, polyData)
+
+    def addCompletedModel(self, modelPath, positions, polyData=None):
+        """
+        Add the landmarks of a completed model ({landmarkIndex: position}) to the prior in the background.
+        """
+        return self._executor.submit(self._addCompletedModel, modelPath, dict(positions), polyData)
+
+    def suggest(self, modelPath, positions, polyData=None):
+        """
+        Return a future of {landmarkIndex: position} for the landmarks of a model missing from positions
+        ({landmarkIndex: position} of the placed landmarks).
+        """
+        return self._executor.submit(self._suggest, modelPath, dict(positions), polyData)
+
+    def stop(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def features(self, modelPath, polyData=None):
+        contentHash = self.hashes.get(modelPath)
+        with self._lock:
+            features = self._features.get(contentHash)
+            if features is not None:
+                self._features.move_to_end(contentHash)
+                return features
+        if polyData is None:
+            polyData = self.readModel(modelPath)
+        cachePath = os.path.join(self.cacheDir, f"{contentHash}_features.npz")
+        features = None
+        if os.path.exists(cachePath):
+            try:
+                with np.load(cachePath) as cached:
+                    if int(cached["version"]) == self.CACHE_VERSION:
+                        points, triangles = meshArrays(polyData)
+                        features = MeshFeatures(points, meshEdges(triangles), cached["shapeIndex"].astype(np.float64),
+                                                cached["curvedness"].astype(np.float64), float(cached["scale"]))
+            except Exception as e:
+                logging.warning(f"Ignoring invalid feature cache {cachePath}: {e}")
+        if features is None or len(features.shapeIndex) != len(features.points):
+            features = computeMeshFeatures(polyData)
+            temporaryPath = f"{cachePath}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+            np.savez(temporaryPath, version=self.CACHE_VERSION, shapeIndex=features.shapeIndex.astype(np.float32),
+                     curvedness=features.curvedness.astype(np.float32), scale=features.scale)
+            os.replace(temporaryPath, cachePath)
+        with self._lock:
+            self._features[contentHash] = features
+            while len(self._features) > self.maximumCachedModels:
+                self._features.popitem(last=False)
+        return features
+
+    def _addCompletedModel(self, modelPath, positions, polyData):
+        features = self.features(modelPath, polyData)
+        vertexIds = np.full(self.prior.landmarkCount, -1, dtype=np.int64)
+        indices = [index for index in positions if index < self.prior.landmarkCount]
+        if indices:
+            vertexIds[indices] = features.closestVertices([positions[index] for index in indices])
+        self.prior.add(self.hashes.get(modelPath), features, vertexIds)
+
+    def _suggest(self, modelPath, positions, polyData):
+        features = self.features(modelPath, polyData)
+        indices = list(positions)
+        placedVertexIds = dict(zip(indices, features.closestVertices([positions[index] for index in indices]))) if indices else {}
+        suggestions = self.prior.suggest(features, placedVertexIds)
+        return {index: features.points[vertexId].tolist() for index, vertexId in suggestions.items()}
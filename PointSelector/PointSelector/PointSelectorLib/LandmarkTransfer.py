@@ -0,0 +1,106 @@
+import csv
+import os
+
+import numpy as np
+import vtk
+
+from .LandmarkStore import LandmarkStore
+from .ModelEnumerator import iterModelFiles
+from .ModelPrefetcher import readMarkupsFile
+from .SurfaceLocator import SurfaceLocator
+
+
+#
+# Landmark transfer between models (no MRML scene access, usable without the GUI)
+#
+
+TRANSFER_METHODS = ("closestPoint", "correspondence")
+
+
+def readTemplateLandmarks(path, templateFileName=None):
+    """
+    Read template landmarks from a .mrk.json file, or from the rows of templateFileName in a landmarks.csv file.
+    Returns (indices, positions) with positions as an (N,3) array in RAS.
+    """
+    if path.endswith(".csv"):
+        if templateFileName is None:
+            raise ValueError("templateFileName is required to read template landmarks from a csv file")
+        landmarks = {}
+        with open(path, 'r', newline='') as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            for row in reader:
+                fileName, index, position = row[:3]
+                if fileName == templateFileName:
+                    landmarks[int(index)] = LandmarkStore.parsePosition(position)
+        indices = sorted(landmarks)
+        positions = [landmarks[index] for index in indices]
+    else:
+        markups = readMarkupsFile(path)
+        if markups is None:
+            raise ValueError(f"No markups found in {path}")
+        positions = markups["positions"]
+        indices = list(range(len(positions)))
+    if not indices:
+        raise ValueError(f"No template landmarks found in {path}")
+    return indices, np.array(positions, dtype=float)
+
+
+def rigidAlignmentTransform(sourcePolyData, targetPolyData, maximumIterations=100, maximumLandmarks=1000):
+    """
+    Compute a rigid transform that aligns sourcePolyData to targetPolyData with iterative closest point.
+    """
+    icp = vtk.vtkIterativeClosestPointTransform()
+    icp.SetSource(sourcePolyData)
+    icp.SetTarget(targetPolyData)
+    icp.GetLandmarkTransform().SetModeToRigidBody()
+    icp.SetMaximumNumberOfIterations(maximumIterations)
+    icp.SetMaximumNumberOfLandmarks(maximumLandmarks)
+    icp.StartByMatchingCentroidsOn()
+    icp.Update()
+    return icp
+
+
+def transferLandmarks(templatePolyData, templatePositions, targetPolyData, method="closestPoint", align=True):
+    """
+    Project template landmarks onto a target model.
+
+    closestPoint: the template is rigidly aligned to the target (if align is True) and each moved landmark
+    is snapped to the closest point of the target surface.
+    correspondence: template and target have the same vertex ordering, each landmark is moved to the target
+    vertex that has the id of the template vertex closest to it.
+
+    Returns the (N,3) array of landmark positions on the target.
+    """
+    if method not in TRANSFER_METHODS:
+        raise ValueError(f"Invalid transfer method {method}, expected one of {TRANSFER_METHODS}")
+    templatePositions = np.asarray(templatePositions, dtype=float)
+    positions = np.zeros_like(templatePositions)
+
+    if method == "correspondence":
+        if templatePolyData.GetNumberOfPoints() != targetPolyData.GetNumberOfPoints():
+            raise ValueError("Correspondence transfer requires models with the same number of points")
+        pointLocator = vtk.vtkStaticPointLocator()
+        pointLocator.SetDataSet(templatePolyData)
+        pointLocator.BuildLocator()
+        targetPoints = targetPolyData.GetPoints()
+        for i, position in enumerate(templatePositions):
+            positions[i] = targetPoints.GetPoint(pointLocator.FindClosestPoint(position))
+        return positions
+
+    if align:
+        transform = rigidAlignmentTransform(templatePolyData, targetPolyData)
+        templatePositions = np.array([transform.TransformPoint(position) for position in templatePositions])
+    locator = SurfaceLocator(targetPolyData)
+    for i, position in enumerate(templatePositions):
+        positions[i] = locator.snap(position)[0]
+    return positions
+
+
+def listModelFiles(modelDir, modelFileExt="ply", patterns=None, recursive=False):
+    """
+    Return the model file names of a directory, in the order used for models_ids.csv.
+    :param patterns: glob patterns of the model files, "*.<modelFileExt>" by default, see iterModelFiles
+    :param recursive: include the models of subfolders, named by their path relative to modelDir
+    """
+    return [fileName for fileName, _ in iterModelFiles(modelDir, patterns or ("*." + modelFileExt,), recursive)]
@@ -0,0 +1,168 @@
+import json
+import numbers
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from .ModelPrefetcher import markupsFilePath
+
+
+#
+# Bulk validation and write back of .mrk.json files (no MRML scene access, usable without the GUI)
+#
+
+MARKUPS_SCHEMA = "https://raw.githubusercontent.com/slicer/slicer/master/Modules/Loadable/Markups/Resources/Schema/markups-schema-v1.0.3.json#"
+
+
+def validateMarkupsFile(markupsPath, expectedPointCount=None):
+    """
+    Check the .mrk.json file of a model against the parts of the markups schema the module relies on: a single
+    markups list with a type, an LPS or RAS coordinate system and control points with three numeric coordinates.
+    Returns a record with the file name, "status" ("ok", "missing", "invalid" or "count"), the list of errors,
+    the markups type and the numbers of control points and of control points with a position.
+    A point count different from expectedPointCount (e.g. nodeCounter) has status "count".
+    """
+    record = {
+        "fileName": os.path.basename(markupsPath),
+        "status": "ok",
+        "errors": [],
+        "type": None,
+        "numberOfControlPoints": 0,
+        "numberOfDefinedPoints": 0,
+    }
+    if not os.path.exists(markupsPath):
+        record["status"] = "missing"
+        record["errors"].append("missing .mrk.json file")
+        return record
+    errors = record["errors"]
+    try:
+        with open(markupsPath, "r") as file:
+            content = json.load(file)
+    except (OSError, ValueError) as e:
+        record["status"] = "invalid"
+        errors.append(f"not readable as JSON: {e}")
+        return record
+    markupsList = content.get("markups") if isinstance(content, dict) else None
+    if not isinstance(markupsList, list) or len(markupsList) != 1 or not isinstance(markupsList[0], dict):
+        record["status"] = "invalid"
+        errors.append("expected a single markups list")
+        return record
+    markups = markupsList[0]
+    record["type"] = markups.get("type")
+    if not isinstance(record["type"], str):
+        errors.append("markups type missing")
+    if markups.get("coordinateSystem", "LPS") not in ("LPS", "RAS"):
+        errors.append(f"unknown coordinate system {markups.get('coordinateSystem')!r}")
+    controlPoints = markups.get("controlPoints", [])
+    if not isinstance(controlPoints, list):
+        errors.append("controlPoints is not a list")
+        controlPoints = []
+    for i, controlPoint in enumerate(controlPoints):
+        if not isinstance(controlPoint, dict):
+            errors.append(f"control point {i} is not an object")
+            continue
+        positionStatus = controlPoint.get("positionStatus", "defined")
+        position = controlPoint.get("position")
+        # points still to be placed may have no position
+        if position is None and positionStatus != "defined":
+            continue
+        if (not isinstance(position, list) or len(position) != 3
+                or not all(isinstance(value, numbers.Real) and not isinstance(value, bool) for value in position)):
+            errors.append(f"control point {i} has no valid position")
+        elif positionStatus == "defined":
+            record["numberOfDefinedPoints"] += 1
+    record["numberOfControlPoints"] = len(controlPoints)
+    if errors:
+        record["status"] = "invalid"
+    elif expectedPointCount is not None and len(controlPoints) != expectedPointCount:
+        record["status"] = "count"
+        errors.append(f"{len(controlPoints)} control points, expected {expectedPointCount}")
+    return record
+
+
+def validateMarkupsFiles(modelDir, fileNames, expectedPointCount=None, workers=None):
+    """
+    Validate the .mrk.json files of the models fileNames of modelDir in parallel, see validateMarkupsFile.
+    The files are small, so reading them dominates and a thread pool is used.
+    Returns a report with the records in fileNames order (the model file name is in "modelFileName") and the model
+    file names of each problem: "missing", "invalid" and "count" (point count different from expectedPointCount).
+    """
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+    fileNames = list(fileNames)
+    paths = [markupsFilePath(os.path.join(modelDir, fileName)) for fileName in fileNames]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="PointSelectorMarkups") as executor:
+        records = list(executor.map(lambda path: validateMarkupsFile(path, expectedPointCount), paths))
+    for fileName, record in zip(fileNames, records):
+        record["modelFileName"] = fileName
+    report = {
+        "directory": os.path.abspath(modelDir),
+        "expectedPointCount": expectedPointCount,
+        "numberOfModels": len(records),
+        "models": records,
+    }
+    for status in ("missing", "invalid", "count"):
+        report[status] = [record["modelFileName"] for record in records if record["status"] == status]
+    return report
+
+
+def writeMarkupsPositions(markupsPath, positions, labelFormat="P{}", backup=True):
+    """
+    Write landmark positions (RAS, {control point index: [x, y, z]}) into a .mrk.json file, keeping everything
+    else in it. Control points missing from the file are added, labeled labelFormat with their 1-based number.
+    A file that does not exist is created with a single fiducial list.
+    The file is replaced through a temporary file and only if a position changed. Returns True if it was written.
+    If backup is True the file is first copied to <markupsPath>.bak, unless a backup exists already, so the .bak
+    file keeps the version from before the first write back.
+    """
+    if os.path.exists(markupsPath):
+        with open(markupsPath, "r") as file:
+            content = json.load(file)
+    else:
+        content = {"@schema": MARKUPS_SCHEMA, "markups": [{"type": "Fiducial", "coordinateSystem": "LPS", "controlPoints": []}]}
+    markups = content["markups"][0]
+    lps = markups.get("coordinateSystem", "LPS") == "LPS"
+    controlPoints = markups.setdefault("controlPoints", [])
+    modified = False
+    for index, (r, a, s) in sorted(positions.items()):
+        position = [-r, -a, s] if lps else [r, a, s]
+        while len(controlPoints) <= index:
+            number = len(controlPoints) + 1
+            controlPoints.append({"id": str(number), "label": labelFormat.format(number), "positionStatus": "undefined"})
+        controlPoint = controlPoints[index]
+        if controlPoint.get("position") != position or controlPoint.get("positionStatus", "defined") != "defined":
+            controlPoint["position"] = position
+            controlPoint["positionStatus"] = "defined"
+            modified = True
+    if not modified:
+        return False
+    if backup and os.path.exists(markupsPath) and not os.path.exists(markupsPath + ".bak"):
+        shutil.copy2(markupsPath, markupsPath + ".bak")
+    temporaryPath = markupsPath + ".tmp"
+    with open(temporaryPath, "w") as file:
+        json.dump(content, file, indent=4)
+    os.replace(temporaryPath, markupsPath)
+    return True
+
+
+def writeBackLandmarks(modelDir, landmarks, workers=None):
+    """
+    Write the landmarks of many models into their .mrk.json files in one parallel pass, see writeMarkupsPositions.
+    :param landmarks: {model file name: {control point index: [x, y, z]}} in RAS
+    Returns {"written": [...], "unchanged": [...], "failed": [(model file name, error)]}.
+    """
+    def write(item):
+        fileName, positions = item
+        try:
+            return fileName, writeMarkupsPositions(markupsFilePath(os.path.join(modelDir, fileName)), positions), None
+        except Exception as e:
+            return fileName, False, str(e)
+
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+    summary = {"written": [], "unchanged": [], "failed": []}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="PointSelectorMarkups") as executor:
+        for fileName, written, error in executor.map(write, landmarks.items()):
+            if error is not None:
+                summary["failed"].append((fileName, error))
+            else:
+                summary["written" if written else "unchanged"].append(fileName)
+    return summary
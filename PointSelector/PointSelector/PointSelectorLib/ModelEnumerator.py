@@ -0,0 +1,124 @@
+import fnmatch
+import logging
+import os
+import threading
+
+
+#
+# Streaming enumeration of model files
+#
+
+def iterModelFiles(modelDir, patterns=("*.ply",), recursive=False):
+    """
+    Yield (fileName, entry) of the model files of modelDir as the directory is read, without listing it first.
+    fileName is relative to modelDir with "/" separators (e.g. "case1/skull.ply" in recursive mode) and matches
+    one of the glob patterns; entry is the os.DirEntry of the file, whose stat() is cached on most platforms.
+    Hidden files and folders (names starting with a dot, such as the .pointselector caches) are skipped.
+    """
+    folders = [""]
+    while folders:
+        folder = folders.pop()
+        try:
+            entries = os.scandir(os.path.join(modelDir, folder) if folder else modelDir)
+        except OSError as e:
+            # a subfolder removed or not readable does not stop the enumeration of the others
+            if not folder:
+                raise
+            logging.warning(f"Skipping {folder}: {e}")
+            continue
+        subfolders = []
+        with entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                fileName = folder + entry.name
+                if recursive and entry.is_dir():
+                    subfolders.append(fileName + "/")
+                elif any(fnmatch.fnmatch(fileName, pattern) for pattern in patterns) and entry.is_file():
+                    yield fileName, entry
+        # depth first, subfolders in directory order
+        folders.extend(reversed(subfolders))
+
+
+#
+# ModelEnumerator
+#
+
+class ModelEnumerator:
+    """
+    Reads and updates the manifest (models_ids.csv) of a model directory on a background thread, see
+    ModelManifest.update, and appends the models to a ModelList batch by batch as they are found, so the first models
+    of a large directory can be shown while the rest is still being enumerated.
+    Use wait() before reading rows that may not be listed yet.
+    """
+
+    def __init__(self, manifestPath, modelDir, models, patterns=("*.ply",), recursive=False, knownHashes=None,
+                 batchSize=1000, onModels=None, onDone=None):
+        """
+        :param onModels: called on the enumeration thread with the manifest and each batch of (modelId, fileName)
+          once it is listed
+        :param onDone: called on the enumeration thread with the manifest and its (added, changed, removed) changes
+        """
+        self.manifestPath = manifestPath
+        # ModelManifest, once read by the enumeration thread
+        self.manifest = None
+        self.modelDir = modelDir
+        self.models = models
+        self.onModels = onModels
+        self.onDone = onDone
+        # (added, changed, removed) of the manifest update once done, see ModelManifest.update
+        self.changes = None
+        self.error = None
+        self._done = False
+        self._stopped = threading.Event()
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, args=(patterns, recursive, knownHashes, batchSize),
+                                        name="PointSelectorEnumerator", daemon=True)
+        self._thread.start()
+
+    @property
+    def done(self):
+        with self._condition:
+            return self._done
+
+    def wait(self, count=None, timeout=None):
+        """
+        Wait until models has at least count rows, or until the enumeration is done (by default or if there are
+        fewer models). Returns True unless the timeout expired. Errors of the enumeration are raised here.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._done or (count is not None and len(self.models) >= count), timeout)
+            if self.error is not None:
+                raise self.error
+            return self._done or (count is not None and len(self.models) >= count)
+
+    def stop(self):
+        """
+        Stop the enumeration. Models found so far stay in the list and in the manifest.
+        """
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self, patterns, recursive, knownHashes, batchSize):
+        from .ModelManifest import ModelManifest
+        try:
+            self.manifest = ModelManifest(self.manifestPath)
+            self.changes = self.manifest.update(self.modelDir, knownHashes=knownHashes, patterns=patterns,
+                                                recursive=recursive, onModels=self._addModels, batchSize=batchSize,
+                                                stop=self._stopped)
+            if self.onDone is not None:
+                self.onDone(self.manifest, self.changes)
+        except Exception as e:
+            logging.error(f"Enumerating the models of {self.modelDir} failed: {e}")
+            self.error = e
+        finally:
+            with self._condition:
+                self._done = True
+                self._condition.notify_all()
+
+    def _addModels(self, batch):
+        self.models.append([fileName for _, fileName in batch], [modelId for modelId, _ in batch])
+        if self.onModels is not None:
+            self.onModels(self.manifest, batch)
+        with self._condition:
+            self._condition.notify_all()
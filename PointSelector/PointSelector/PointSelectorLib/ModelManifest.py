@@ -0,0 +1,161 @@
+import csv
+import os
+
+from .ModelEnumerator import iterModelFiles
+from .ModelProxies import ContentHashes, fileContentHash
+
+
+#
+# ModelManifest
+#
+
+class ModelManifest:
+    """
+    models_ids.csv extended with the size, modification time and content hash of each model file.
+
+    update() only stats the directory and hashes files that are new or whose size or modification time changed,
+    so reopening an unchanged directory does not read any model. Model ids are kept across updates: new files get
+    the next id and are appended to the file as they are found, ids of deleted files are not reused.
+    Files written by older versions with only the FileNames column are read too, their models are hashed once.
+    """
+
+    HEADER = ['', 'FileNames', 'Size', 'MTimeNs', 'Hash']
+
+    def __init__(self, csvPath):
+        self.csvPath = csvPath
+        # {FileName: [size, mtimeNs, hash]} and {FileName: model id}, both in model id order
+        self._entries = {}
+        self._modelIds = {}
+        self._nextModelId = 0
+        # models_ids.csv has the stat and hash columns, so new rows can be appended to it
+        self._appendable = False
+        if os.path.exists(csvPath):
+            self._read()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def fileNames(self):
+        return list(self._entries)
+
+    def items(self):
+        """
+        Return (modelId, fileName, size, mtimeNs, hash) of every model in model id order.
+        """
+        return [(self._modelIds[fileName], fileName, *entry) for fileName, entry in self._entries.items()]
+
+    def modelId(self, fileName):
+        return self._modelIds[fileName]
+
+    def contentHash(self, fileName):
+        return self._entries[fileName][2]
+
+    def contentHashes(self, modelDir, fileNames=None, hashes=None):
+        """
+        Return ContentHashes holding the hashes of the manifest, so caches keyed by content do not hash the models again.
+        :param fileNames: only add the hashes of these models
+        :param hashes: ContentHashes to add the hashes to, a new one by default
+        """
+        hashes = hashes or ContentHashes()
+        for fileName in self._entries if fileNames is None else fileNames:
+            size, mtimeNs, contentHash = self._entries[fileName]
+            if contentHash is not None:
+                hashes.add(os.path.join(modelDir, fileName), size, mtimeNs, contentHash)
+        return hashes
+
+    def update(self, modelDir, modelFileExt="ply", knownHashes=None, patterns=None, recursive=False, onModels=None,
+               batchSize=1000, stop=None):
+        """
+        Bring the manifest in sync with the model files of modelDir and save it if anything changed.
+        The directory is read as a stream (see iterModelFiles) in batches growing from one file to batchSize files:
+        after each batch the new models are appended to models_ids.csv and onModels, if given, is called with the
+        (modelId, fileName) of the batch in directory order, so the first model can be used right away while a large
+        directory is still being read. The file is rewritten at the end only if models were modified or removed.
+        knownHashes can map file names to already computed (size, mtimeNs, hash) tuples, e.g. from a directory scan.
+        :param patterns: glob patterns of the model files, relative to modelDir, "*.<modelFileExt>" by default
+        :param recursive: include the models of subfolders, named by their path relative to modelDir
+        :param stop: threading.Event ending the update early; models not seen yet are then not considered removed
+        Returns (added, changed, removed) lists of file names.
+        """
+        knownHashes = knownHashes or {}
+        patterns = patterns or ("*." + modelFileExt,)
+        added, changed = [], []
+        present = set()
+        batch, newRows = [], []
+        batchLimit = 1
+        modified = False
+        for fileName, entry in iterModelFiles(modelDir, patterns, recursive):
+            if stop is not None and stop.is_set():
+                break
+            stat = entry.stat()
+            previous = self._entries.get(fileName)
+            if previous is None or previous[0] != stat.st_size or previous[1] != stat.st_mtime_ns:
+                known = knownHashes.get(fileName)
+                if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+                    contentHash = known[2]
+                else:
+                    contentHash = fileContentHash(entry.path)
+                self._entries[fileName] = [stat.st_size, stat.st_mtime_ns, contentHash]
+                if previous is None:
+                    added.append(fileName)
+                    self._modelIds[fileName] = self._nextModelId
+                    self._nextModelId += 1
+                    newRows.append(fileName)
+                else:
+                    modified = True
+                    if previous[2] is not None and previous[2] != contentHash:
+                        changed.append(fileName)
+            present.add(fileName)
+            batch.append((self._modelIds[fileName], fileName))
+            if len(batch) >= batchLimit:
+                self._appendRows(newRows)
+                if onModels is not None:
+                    onModels(batch)
+                batch, newRows = [], []
+                batchLimit = min(batchLimit * 2, batchSize)
+        self._appendRows(newRows)
+        if batch and onModels is not None:
+            onModels(batch)
+        removed = [] if stop is not None and stop.is_set() else [fileName for fileName in self._entries if fileName not in present]
+        for fileName in removed:
+            del self._entries[fileName]
+            del self._modelIds[fileName]
+        if modified or removed:
+            self.save()
+        return added, changed, removed
+
+    def save(self):
+        temporaryPath = self.csvPath + ".tmp"
+        with open(temporaryPath, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(self.HEADER)
+            for fileName, (size, mtimeNs, contentHash) in self._entries.items():
+                writer.writerow([self._modelIds[fileName], fileName, size, mtimeNs, contentHash])
+        os.replace(temporaryPath, self.csvPath)
+        self._appendable = True
+
+    def _appendRows(self, fileNames):
+        if not fileNames:
+            return
+        # a file of an older version is converted once, then new models are appended
+        if not self._appendable:
+            self.save()
+            return
+        rows = [[self._modelIds[fileName], fileName, *self._entries[fileName]] for fileName in fileNames]
+        with open(self.csvPath, 'a', newline='') as file:
+            csv.writer(file).writerows(rows)
+
+    def _read(self):
+        with open(self.csvPath, 'r', newline='') as file:
+            reader = csv.reader(file)
+            self._appendable = next(reader, None) == self.HEADER
+            for row in reader:
+                modelId = int(row[0]) if row[0].isdigit() else self._nextModelId
+                self._modelIds[row[1]] = modelId
+                self._nextModelId = max(self._nextModelId, modelId + 1)
+                if len(row) >= 5 and row[2]:
+                    self._entries[row[1]] = [int(row[2]), int(row[3]), row[4]]
+                else:
+                    # no stat information, the file is hashed at the next update
+                    self._entries[row[1]] = [None, None, None]
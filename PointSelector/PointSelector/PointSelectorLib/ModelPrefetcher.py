@@ -0,0 +1,328 @@
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+import vtk
+
+from .SurfaceLocator import SurfaceLocator
+
+
+#
+# Model and markups readers (no MRML scene access, safe to call from a worker thread)
+#
+
+def markupsFilePath(modelPath):
+    """
+    Return the path of the .mrk.json file that belongs to a model file.
+    """
+    return os.path.splitext(modelPath)[0] + ".mrk.json"
+
+
+def modelCoordinateSystem(reader, modelPath):
+    """
+    Return the coordinate system ("LPS" or "RAS") of a model file read by reader, following the rule of Slicer's
+    model storage node: "SPACE=RAS" or "SPACE=LPS" in the file header (the header line of .vtk and .stl files,
+    a comment of .ply and .obj files, the SPACE field data array of .vtp files), LPS if there is none.
+    """
+    header = ""
+    if isinstance(reader, vtk.vtkXMLPolyDataReader):
+        space = reader.GetOutput().GetFieldData().GetAbstractArray("SPACE")
+        header = f"SPACE={space.GetValue(0)}" if space is not None and space.GetNumberOfValues() else ""
+    elif isinstance(reader, vtk.vtkPLYReader):
+        comments = reader.GetComments()
+        header = " ".join(comments.GetValue(i) for i in range(comments.GetNumberOfValues()))
+    elif isinstance(reader, (vtk.vtkPolyDataReader, vtk.vtkSTLReader)):
+        header = reader.GetHeader() or ""
+    elif isinstance(reader, vtk.vtkOBJReader):
+        with open(modelPath, "r", errors="replace") as file:
+            for line in file:
+                if not line.startswith("#"):
+                    break
+                header += line
+    return "RAS" if "SPACE=RAS" in header.upper() else "LPS"
+
+
+def readModelFile(modelPath):
+    """
+    Read a model file into a new vtkPolyData in RAS coordinates, like the scene and readMarkupsFile.
+    Files are LPS unless their header says otherwise, see modelCoordinateSystem.
+    """
+    ext = os.path.splitext(modelPath)[1].lower()
+    if ext == ".ply":
+        reader = vtk.vtkPLYReader()
+    elif ext == ".vtp":
+        reader = vtk.vtkXMLPolyDataReader()
+    elif ext == ".stl":
+        reader = vtk.vtkSTLReader()
+    elif ext == ".obj":
+        reader = vtk.vtkOBJReader()
+    else:
+        reader = vtk.vtkPolyDataReader()
+    reader.SetFileName(modelPath)
+    reader.Update()
+    polyData = vtk.vtkPolyData()
+    if modelCoordinateSystem(reader, modelPath) == "LPS":
+        # negating two axes is a rotation, the orientation of the faces is kept
+        lpsToRas = vtk.vtkTransform()
+        lpsToRas.Scale(-1.0, -1.0, 1.0)
+        transformFilter = vtk.vtkTransformPolyDataFilter()
+        transformFilter.SetInputConnection(reader.GetOutputPort())
+        transformFilter.SetTransform(lpsToRas)
+        transformFilter.Update()
+        polyData.ShallowCopy(transformFilter.GetOutput())
+    else:
+        polyData.ShallowCopy(reader.GetOutput())
+    if polyData.GetNumberOfPoints() == 0:
+        raise ValueError(f"Model file {modelPath} could not be read or is empty")
+    return polyData
+
+
+def readMarkupsFile(markupsPath):
+    """
+    Parse a .mrk.json file into a dictionary holding the markups type, name, RAS positions and labels,
+    the state of the control points (descriptions, selected, pointLocked and visibilities lists), and the
+    properties of the list: locked, labelFormat, display (the "display" object of the file, or None) and measurements.
+    Returns None if the file does not exist or does not contain a single markups list.
+    """
+    if not os.path.exists(markupsPath):
+        return None
+    with open(markupsPath, "r") as file:
+        content = json.load(file)
+    markupsList = content.get("markups", [])
+    if len(markupsList) != 1:
+        return None
+    markups = markupsList[0]
+    # Positions are stored in LPS by default, the scene uses RAS
+    lps = markups.get("coordinateSystem", "LPS") == "LPS"
+    positions = []
+    labels = []
+    descriptions = []
+    selected = []
+    pointLocked = []
+    visibilities = []
+    for controlPoint in markups.get("controlPoints", []):
+        x, y, z = controlPoint.get("position", [0.0, 0.0, 0.0])
+        positions.append([-x, -y, z] if lps else [x, y, z])
+        labels.append(controlPoint.get("label", ""))
+        descriptions.append(controlPoint.get("description", ""))
+        selected.append(bool(controlPoint.get("selected", True)))
+        pointLocked.append(bool(controlPoint.get("locked", False)))
+        visibilities.append(bool(controlPoint.get("visibility", True)))
+    return {
+        "type": markups.get("type", "Fiducial"),
+        "name": os.path.basename(markupsPath)[:-len(".mrk.json")],
+        "positions": positions,
+        "labels": labels,
+        "descriptions": descriptions,
+        "selected": selected,
+        "pointLocked": pointLocked,
+        "visibilities": visibilities,
+        "locked": bool(markups.get("locked", False)),
+        "labelFormat": markups.get("labelFormat"),
+        "display": markups.get("display"),
+        "measurements": markups.get("measurements", []),
+    }
+
+
+#
+# PrefetchedModel
+#
+
+class PrefetchedModel:
+    """
+    A model file and its markups, read and parsed but not yet added to the scene,
+    with the SurfaceLocator used for snapping landmarks to the model if it was requested.
+    displayPolyData is the decimated proxy shown instead of the full resolution model in level of detail mode.
+    viewFrame is the principal axes frame of the model used to point the camera at it, see computeViewFrame.
+    """
+
+    def __init__(self, fileName, polyData, markups, locator=None, proxyPolyData=None, viewFrame=None):
+        self.fileName = fileName
+        self.polyData = polyData
+        self.markups = markups
+        self.locator = locator
+        self.viewFrame = viewFrame
+        self.displayPolyData = proxyPolyData if proxyPolyData is not None else polyData
+        # vtkPolyData reports its size in kibibytes
+        self.nbytes = polyData.GetActualMemorySize() * 1024
+        if locator is not None:
+            self.nbytes += locator.nbytes
+        if proxyPolyData is not None:
+            self.nbytes += proxyPolyData.GetActualMemorySize() * 1024
+
+
+#
+# ModelCache
+#
+
+class ModelCache:
+    """
+    Least recently used cache of PrefetchedModel objects bounded by their total memory size.
+    The most recently used entry is always kept, even if it alone exceeds the limit.
+    """
+
+    def __init__(self, maximumBytes):
+        self.maximumBytes = maximumBytes
+        self.totalBytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, fileName):
+        with self._lock:
+            return fileName in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, fileName):
+        with self._lock:
+            entry = self._entries.get(fileName)
+            if entry is not None:
+                self._entries.move_to_end(fileName)
+            return entry
+
+    def put(self, entry):
+        with self._lock:
+            previous = self._entries.pop(entry.fileName, None)
+            if previous is not None:
+                self.totalBytes -= previous.nbytes
+            self._entries[entry.fileName] = entry
+            self.totalBytes += entry.nbytes
+            while self.totalBytes > self.maximumBytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.totalBytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.totalBytes = 0
+
+
+#
+# ModelPrefetcher
+#
+
+class ModelPrefetcher:
+    """
+    Reads and parses model files and their markups on background threads into a ModelCache,
+    so that switching to a prefetched model only has to add the prepared data to the scene.
+    Several workers read queued files in parallel, e.g. all models of a review grid page.
+    Urgent files, e.g. the model the user is switching to, are read before the other queued files.
+    If buildLocators is True the SurfaceLocator of each model is built by the worker as well,
+    and if a ProxyCache is given the decimated proxy of each model is read or built too.
+    If a NormalizedModelCache is given models are read from their cached binary copies, converting them on first use.
+    If a ViewFrameCache is given the view frame of each model is read from it or computed and added to it.
+    """
+
+    def __init__(self, modelDir, maximumBytes=1024 * 1024 * 1024, buildLocators=False, proxyCache=None, workers=1,
+                 normalizedCache=None, viewFrames=None):
+        self.modelDir = modelDir
+        self.buildLocators = buildLocators
+        self.proxyCache = proxyCache
+        self.viewFrames = viewFrames
+        self.normalizedCache = normalizedCache
+        self.cache = ModelCache(maximumBytes)
+        # (priority, order, fileName): urgent files first, then in request order; stop() queues None with priority -1
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._pending = set()
+        self._loading = set()
+        self._errors = {}
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._threads = [threading.Thread(target=self._run, name=f"PointSelectorPrefetch{i}", daemon=True)
+                         for i in range(max(1, workers))]
+        for thread in self._threads:
+            thread.start()
+
+    def prefetch(self, fileNames, urgent=False):
+        """
+        Queue model files for background loading. Files already cached are skipped, files already queued
+        are only queued again if they become urgent.
+        """
+        with self._condition:
+            for fileName in fileNames:
+                if fileName in self.cache or (fileName in self._pending and not urgent):
+                    continue
+                self._pending.add(fileName)
+                self._queue.put((0 if urgent else 1, next(self._order), fileName))
+
+    def isReady(self, fileName):
+        """
+        True if get(fileName) would not wait for a worker, i.e. the file is not queued or being read.
+        """
+        with self._condition:
+            return fileName not in self._pending
+
+    def get(self, fileName):
+        """
+        Return the PrefetchedModel for a file. Waits for the worker if the file is being loaded
+        and reads it on the calling thread if it was never requested.
+        """
+        entry = self.cache.get(fileName)
+        if entry is not None:
+            return entry
+        with self._condition:
+            while fileName in self._pending:
+                self._condition.wait()
+            error = self._errors.pop(fileName, None)
+        if error is not None:
+            raise error
+        entry = self.cache.get(fileName)
+        if entry is None:
+            entry = self._load(fileName)
+            self.cache.put(entry)
+        return entry
+
+    def stop(self):
+        """
+        Stop the worker threads. Queued files that were not loaded yet are dropped.
+        """
+        self._stopped = True
+        for thread in self._threads:
+            self._queue.put((-1, next(self._order), None))
+        for thread in self._threads:
+            thread.join()
+        with self._condition:
+            self._pending.clear()
+            self._condition.notify_all()
+
+    def _load(self, fileName):
+        modelPath = os.path.join(self.modelDir, fileName)
+        if self.normalizedCache is not None:
+            polyData = self.normalizedCache.readModel(modelPath)
+        else:
+            polyData = readModelFile(modelPath)
+        markups = readMarkupsFile(markupsFilePath(modelPath))
+        locator = SurfaceLocator(polyData) if self.buildLocators else None
+        proxyPolyData = self.proxyCache.getProxy(modelPath, polyData) if self.proxyCache is not None else None
+        viewFrame = None
+        if self.viewFrames is not None:
+            viewFrame = self.viewFrames.getOrCompute(self.modelDir, fileName, polyData, markups["positions"] if markups else None)
+        return PrefetchedModel(fileName, polyData, markups, locator, proxyPolyData, viewFrame)
+
+    def _run(self):
+        while True:
+            _, _, fileName = self._queue.get()
+            if fileName is None or self._stopped:
+                return
+            with self._condition:
+                # files queued again as urgent are only read once
+                if fileName not in self._pending or fileName in self._loading:
+                    continue
+                self._loading.add(fileName)
+            try:
+                self.cache.put(self._load(fileName))
+            except Exception as e:
+                logging.warning(f"Prefetching {fileName} failed: {e}")
+                with self._condition:
+                    self._errors[fileName] = e
+            with self._condition:
+                self._pending.discard(fileName)
+                self._loading.discard(fileName)
+                self._condition.notify_all()
@@ -0,0 +1,172 @@
+import hashlib
+import logging
+import os
+import threading
+
+import vtk
+
+from .ModelPrefetcher import readModelFile
+
+
+#
+# Decimated level of detail proxies of large models, cached on disk
+#
+
+def fileContentHash(path, chunkSize=1024 * 1024):
+    """
+    Return a hex digest of the content of a file.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunkSize), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def writeRawPolyData(polyData, path):
+    """
+    Write a model as VTK XML PolyData with uncompressed raw appended arrays, which is the fastest format to read back.
+    The model is in RAS coordinates (see readModelFile) and is marked so with a SPACE field data array, as Slicer does.
+    The file is written under a temporary name and renamed, so another thread or process writing the same file
+    cannot leave it half written.
+    """
+    temporaryPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.vtp"
+    space = vtk.vtkStringArray()
+    space.SetName("SPACE")
+    space.InsertNextValue("RAS")
+    fieldData = vtk.vtkFieldData()
+    fieldData.ShallowCopy(polyData.GetFieldData())
+    fieldData.AddArray(space)
+    taggedPolyData = vtk.vtkPolyData()
+    taggedPolyData.ShallowCopy(polyData)
+    taggedPolyData.SetFieldData(fieldData)
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetFileName(temporaryPath)
+    writer.SetInputData(taggedPolyData)
+    writer.SetDataModeToAppended()
+    writer.EncodeAppendedDataOff()
+    writer.SetCompressorTypeToNone()
+    if not writer.Write():
+        raise IOError(f"Could not write {temporaryPath}")
+    os.replace(temporaryPath, path)
+    return path
+
+
+def decimatePolyData(polyData, ratio):
+    """
+    Return a decimated copy of a model keeping about ratio (0-1] of its triangles.
+    """
+    triangles = vtk.vtkTriangleFilter()
+    triangles.SetInputData(polyData)
+    decimation = vtk.vtkQuadricDecimation()
+    decimation.SetInputConnection(triangles.GetOutputPort())
+    decimation.SetTargetReduction(1.0 - ratio)
+    decimation.VolumePreservationOn()
+    decimation.Update()
+    proxy = vtk.vtkPolyData()
+    proxy.ShallowCopy(decimation.GetOutput())
+    return proxy
+
+
+#
+# ContentHashes
+#
+
+class ContentHashes:
+    """
+    Content hashes of files, valid as long as their size and modification time do not change.
+    Hashes already known, e.g. from models_ids.csv, can be added so the files are not read again.
+    """
+
+    def __init__(self):
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def add(self, path, size, mtimeNs, contentHash):
+        with self._lock:
+            self._hashes[(os.path.abspath(path), size, mtimeNs)] = contentHash
+
+    def get(self, path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            contentHash = self._hashes.get(key)
+        if contentHash is None:
+            contentHash = fileContentHash(path)
+            with self._lock:
+                self._hashes[key] = contentHash
+        return contentHash
+
+
+#
+# ProxyCache
+#
+
+class ProxyCache:
+    """
+    Decimated proxies of model files stored as .vtp files in cacheDir, keyed by the content hash
+    of the source file and the decimation ratio, so edited models get a new proxy automatically.
+    """
+
+    def __init__(self, cacheDir, ratio, hashes=None):
+        if not 0.0 < ratio <= 1.0:
+            raise ValueError(f"Invalid decimation ratio {ratio}, expected a value in (0, 1]")
+        self.cacheDir = cacheDir
+        self.ratio = ratio
+        self.hashes = hashes or ContentHashes()
+        os.makedirs(cacheDir, exist_ok=True)
+
+    def contentHash(self, modelPath):
+        return self.hashes.get(modelPath)
+
+    def proxyPath(self, modelPath):
+        return os.path.join(self.cacheDir, f"{self.contentHash(modelPath)}_{self.ratio:g}.vtp")
+
+    def hasProxy(self, modelPath):
+        return os.path.exists(self.proxyPath(modelPath))
+
+    def getProxy(self, modelPath, polyData=None):
+        """
+        Return the proxy of a model, reading it from the cache or building and caching it.
+        polyData is the already loaded full resolution model, if available.
+        """
+        proxyPath = self.proxyPath(modelPath)
+        if os.path.exists(proxyPath):
+            return readModelFile(proxyPath)
+        if polyData is None:
+            polyData = readModelFile(modelPath)
+        proxy = decimatePolyData(polyData, self.ratio)
+        # another thread or process may build the same proxy, the rename makes the last one win cleanly
+        writeRawPolyData(proxy, proxyPath)
+        return proxy
+
+
+#
+# ProxyBuilder
+#
+
+class ProxyBuilder:
+    """
+    Builds missing proxies of a list of model files on a background thread, in list order.
+    """
+
+    def __init__(self, proxyCache, modelPaths):
+        self.proxyCache = proxyCache
+        self.modelPaths = list(modelPaths)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="PointSelectorProxies", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._thread.join()
+
+    def _run(self):
+        for modelPath in self.modelPaths:
+            if self._stopped:
+                return
+            try:
+                if not self.proxyCache.hasProxy(modelPath):
+                    self.proxyCache.getProxy(modelPath)
+            except Exception as e:
+                logging.warning(f"Building proxy of {modelPath} failed: {e}")
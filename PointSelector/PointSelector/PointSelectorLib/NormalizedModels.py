@@ -0,0 +1,83 @@
+import logging
+import os
+import threading
+
+from .ModelPrefetcher import readModelFile
+from .ModelProxies import ContentHashes, writeRawPolyData
+
+
+#
+# Binary copies of model files, cached on disk
+#
+
+class NormalizedModelCache:
+    """
+    Copies of model files converted to .vtp files with raw binary arrays, stored in cacheDir and keyed by the
+    content hash of the source file. Reading them skips parsing the source format, which is slow for ASCII PLY.
+    Edited source files get a new hash and are converted again.
+    """
+
+    def __init__(self, cacheDir, hashes=None):
+        self.cacheDir = cacheDir
+        self.hashes = hashes or ContentHashes()
+        os.makedirs(cacheDir, exist_ok=True)
+
+    def cachedPath(self, modelPath, contentHash=None):
+        return os.path.join(self.cacheDir, f"{contentHash or self.hashes.get(modelPath)}.vtp")
+
+    def hasModel(self, modelPath):
+        return os.path.exists(self.cachedPath(modelPath))
+
+    def readModel(self, modelPath):
+        """
+        Read a model from its cached copy. A model that is not cached yet is read from the source file and cached.
+        """
+        cachedPath = self.cachedPath(modelPath)
+        if os.path.exists(cachedPath):
+            return readModelFile(cachedPath)
+        polyData = readModelFile(modelPath)
+        writeRawPolyData(polyData, cachedPath)
+        return polyData
+
+    def writeModel(self, modelPath, polyData, contentHash=None):
+        """
+        Cache an already read model. contentHash of the source file is computed if not given.
+        """
+        cachedPath = self.cachedPath(modelPath, contentHash)
+        if not os.path.exists(cachedPath):
+            writeRawPolyData(polyData, cachedPath)
+        return cachedPath
+
+
+class NormalizedModelBuilder:
+    """
+    Converts the model files of a list that have no cached copy yet on background threads, in list order.
+    VTK readers and writers release the GIL, so the workers convert models in parallel.
+    """
+
+    def __init__(self, normalizedCache, modelPaths, workers=2):
+        self.normalizedCache = normalizedCache
+        self._modelPaths = iter(list(modelPaths))
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._threads = [threading.Thread(target=self._run, name=f"PointSelectorNormalizedModels{worker}", daemon=True)
+                         for worker in range(max(workers, 1))]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stopped = True
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self):
+        while not self._stopped:
+            with self._lock:
+                modelPath = next(self._modelPaths, None)
+            if modelPath is None:
+                return
+            try:
+                if not self.normalizedCache.hasModel(modelPath):
+                    self.normalizedCache.readModel(modelPath)
+            except Exception as e:
+                logging.warning(f"Converting {modelPath} to a binary copy failed: {e}")
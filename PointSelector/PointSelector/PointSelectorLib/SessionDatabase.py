@@ -0,0 +1,315 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .LandmarkJournal import LandmarkJournal
+from .LandmarkStore import LandmarkStore
+
+
+#
+# SessionDatabase
+#
+
+class SessionDatabase:
+    """
+    SQLite alternative to LandmarkStore: the models, landmarks and edit history of a session in one database file,
+    with the same interface so LandmarkJournal and the logic can use either.
+
+    The database is in WAL mode, so other processes (export, QA, merge) read it while the session writes.
+    Edits are buffered and written in one transaction per flush; landmark and edit history rows of a flush are
+    committed together. The latest landmarks are also indexed in memory, so interaction never waits on the database.
+    Queries across models (incompleteModels, positionsOfLandmark) are indexed SQL queries.
+    landmarks.csv is a view derived from the database, written by compact() and when the database is closed.
+
+    fsyncPolicy has the same meaning as in LandmarkStore: "never" does not sync commits, "flush" syncs every flush,
+    "always" commits and syncs every edit.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS models ("
+        " fileName TEXT PRIMARY KEY, modelId INTEGER NOT NULL, size INTEGER, mtimeNs INTEGER, hash TEXT)",
+        "CREATE INDEX IF NOT EXISTS modelsModelId ON models (modelId)",
+        "CREATE TABLE IF NOT EXISTS landmarks ("
+        " fileName TEXT NOT NULL, landmarkIndex INTEGER NOT NULL, x REAL, y REAL, z REAL,"
+        " vertexId INTEGER, distance REAL, updatedAt REAL, PRIMARY KEY (fileName, landmarkIndex))",
+        "CREATE INDEX IF NOT EXISTS landmarksLandmarkIndex ON landmarks (landmarkIndex)",
+        "CREATE TABLE IF NOT EXISTS edits ("
+        " seq INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL, fileName TEXT, landmarkIndex INTEGER, entry TEXT NOT NULL)",
+    )
+    SYNCHRONOUS = {"never": "OFF", "flush": "FULL", "always": "FULL"}
+
+    def __init__(self, dbPath, fsyncPolicy="flush", maximumBufferedRows=100, truncate=True, csvPath=None):
+        """
+        :param csvPath: derived landmarks.csv. When the database has no landmarks yet and truncate is False,
+          the landmarks of an existing csvPath are imported.
+        """
+        if fsyncPolicy not in LandmarkStore.FSYNC_POLICIES:
+            raise ValueError(f"Invalid fsync policy {fsyncPolicy}, expected one of {LandmarkStore.FSYNC_POLICIES}")
+        self.dbPath = dbPath
+        self.csvPath = csvPath
+        self.fsyncPolicy = fsyncPolicy
+        self.maximumBufferedRows = maximumBufferedRows
+        # latest landmarks: {FileName: {Index_no: ([x, y, z], vertexId, distance)}}, as in LandmarkStore
+        self._landmarks = {}
+        self._timestamps = {}
+        # pending statements: ("set", fileName, index, landmark, time), ("remove", fileName, index) or ("edit", entry)
+        self._buffer = []
+        self._lock = threading.RLock()
+        self._compactThread = None
+        # flushes happen on the flush worker thread too, every access holds the lock
+        self._connection = sqlite3.connect(dbPath, timeout=60, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(f"PRAGMA synchronous={self.SYNCHRONOUS[fsyncPolicy]}")
+        with self._transaction() as connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+            if truncate:
+                connection.execute("DELETE FROM landmarks")
+                connection.execute("DELETE FROM edits")
+        if not truncate:
+            self._readRows()
+            if not self._landmarks and csvPath and os.path.exists(csvPath):
+                self._importCsv(csvPath)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(landmarks) for landmarks in self._landmarks.values())
+
+    def set(self, fileName, index, position, vertexId=None, distance=None):
+        landmark = ([float(p) for p in position],
+                    None if vertexId is None else int(vertexId),
+                    None if distance is None else float(distance))
+        index = int(index)
+        with self._lock:
+            now = time.time()
+            self._landmarks.setdefault(fileName, {})[index] = landmark
+            self._timestamps[(fileName, index)] = now
+            self._append(("set", fileName, index, landmark, now))
+
+    def remove(self, fileName, index):
+        index = int(index)
+        with self._lock:
+            landmarks = self._landmarks.get(fileName, {})
+            if landmarks.pop(index, None) is None:
+                return
+            self._timestamps.pop((fileName, index), None)
+            if not landmarks:
+                del self._landmarks[fileName]
+            self._append(("remove", fileName, index))
+
+    def get(self, fileName, index):
+        landmark = self.getLandmark(fileName, index)
+        return None if landmark is None else landmark[0]
+
+    def getLandmark(self, fileName, index):
+        with self._lock:
+            return self._landmarks.get(fileName, {}).get(int(index))
+
+    def landmarksForModel(self, fileName):
+        with self._lock:
+            return {index: landmark[0] for index, landmark in self._landmarks.get(fileName, {}).items()}
+
+    def items(self):
+        with self._lock:
+            return [(fileName, index, landmark, self._timestamps.get((fileName, index)))
+                    for fileName, landmarks in self._landmarks.items()
+                    for index, landmark in landmarks.items()]
+
+    def countForModel(self, fileName):
+        with self._lock:
+            return len(self._landmarks.get(fileName, {}))
+
+    @property
+    def stale(self):
+        # removed landmarks are deleted from the database at the next flush, there is nothing to compact
+        return False
+
+    def appendEdit(self, entry):
+        """
+        Add an entry (see LandmarkOperation.toDict) to the edit history, written with the landmarks of the next flush.
+        """
+        with self._lock:
+            self._append(("edit", entry))
+
+    def replaceEdits(self, entries):
+        """
+        Replace the edit history with entries, e.g. a checkpoint of the undo history (see LandmarkJournal.checkpoint).
+        """
+        with self._lock:
+            if self._connection is None:
+                return
+            self.flush()
+            with self._transaction() as connection:
+                connection.execute("DELETE FROM edits")
+                connection.executemany("INSERT INTO edits (op, fileName, landmarkIndex, entry) VALUES (?, ?, ?, ?)",
+                                       [(entry["op"], entry.get("file"), entry.get("index"), json.dumps(entry))
+                                        for entry in entries])
+
+    def edits(self):
+        """
+        Return the edit history entries in the order they were made.
+        """
+        with self._lock:
+            self.flush()
+            rows = self._connection.execute("SELECT entry FROM edits ORDER BY seq").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def setModels(self, models):
+        """
+        Replace the models table with (modelId, fileName, size, mtimeNs, hash) rows, see ModelManifest.items.
+        """
+        with self._lock, self._transaction() as connection:
+            connection.execute("DELETE FROM models")
+            connection.executemany("INSERT INTO models (modelId, fileName, size, mtimeNs, hash) VALUES (?, ?, ?, ?, ?)",
+                                   list(models))
+
+    def incompleteModels(self, fileNames, landmarkCount):
+        """
+        Return the models of fileNames, in the same order, that have less than landmarkCount landmarks.
+        """
+        with self._lock:
+            self.flush()
+            complete = {row[0] for row in self._connection.execute(
+                "SELECT fileName FROM landmarks GROUP BY fileName HAVING COUNT(*) >= ?", (landmarkCount,))}
+        return [fileName for fileName in fileNames if fileName not in complete]
+
+    def positionsOfLandmark(self, index):
+        """
+        Return {FileName: [x, y, z]} of landmark index on all models, in model id order.
+        """
+        with self._lock:
+            self.flush()
+            rows = self._connection.execute(
+                "SELECT l.fileName, l.x, l.y, l.z FROM landmarks l LEFT JOIN models m ON m.fileName = l.fileName "
+                "WHERE l.landmarkIndex = ? ORDER BY m.modelId, l.fileName", (int(index),)).fetchall()
+        return {fileName: [x, y, z] for fileName, x, y, z in rows}
+
+    def flush(self):
+        """
+        Write pending landmarks and edits in one transaction.
+        """
+        with self._lock:
+            if not self._buffer or self._connection is None:
+                return
+            with self._transaction() as connection:
+                for statement in self._buffer:
+                    if statement[0] == "set":
+                        _, fileName, index, (position, vertexId, distance), updatedAt = statement
+                        connection.execute(
+                            "INSERT OR REPLACE INTO landmarks (fileName, landmarkIndex, x, y, z, vertexId, distance, updatedAt) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (fileName, index, *position, vertexId, distance, updatedAt))
+                    elif statement[0] == "remove":
+                        connection.execute("DELETE FROM landmarks WHERE fileName = ? AND landmarkIndex = ?", statement[1:])
+                    else:
+                        entry = statement[1]
+                        connection.execute("INSERT INTO edits (op, fileName, landmarkIndex, entry) VALUES (?, ?, ?, ?)",
+                                           (entry["op"], entry.get("file"), entry.get("index"), json.dumps(entry)))
+            self._buffer = []
+
+    def compact(self):
+        """
+        Write the derived landmarks.csv (csvPath) and move the write-ahead log into the database file.
+        """
+        with self._lock:
+            if self._connection is None:
+                return
+            self.flush()
+            self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            rows = self._connection.execute(
+                "SELECT l.fileName, l.landmarkIndex, l.x, l.y, l.z, l.vertexId, l.distance FROM landmarks l "
+                "LEFT JOIN models m ON m.fileName = l.fileName ORDER BY m.modelId, l.fileName, l.landmarkIndex").fetchall()
+        if not self.csvPath:
+            return
+        # written next to the csv and renamed into place, readers never see a partial file
+        store = LandmarkStore(self.csvPath + ".db.tmp", fsyncPolicy="never", maximumBufferedRows=10000)
+        for fileName, index, x, y, z, vertexId, distance in rows:
+            store.set(fileName, index, (x, y, z), vertexId, distance)
+        store.close()
+        os.replace(self.csvPath + ".db.tmp", self.csvPath)
+
+    def compactInBackground(self):
+        if self._compactThread is not None and self._compactThread.is_alive():
+            return
+        self._compactThread = threading.Thread(target=self.compact, name="PointSelectorCompact", daemon=True)
+        self._compactThread.start()
+
+    def close(self):
+        if self._compactThread is not None:
+            self._compactThread.join()
+            self._compactThread = None
+        if self._connection is None:
+            return
+        if self.csvPath:
+            self.compact()
+        with self._lock:
+            self.flush()
+            self._connection.close()
+            self._connection = None
+
+    def _append(self, statement):
+        self._buffer.append(statement)
+        if self.fsyncPolicy == "always" or len(self._buffer) >= self.maximumBufferedRows:
+            self.flush()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._connection
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+
+    def _readRows(self):
+        rows = self._connection.execute(
+            "SELECT fileName, landmarkIndex, x, y, z, vertexId, distance FROM landmarks").fetchall()
+        for fileName, index, x, y, z, vertexId, distance in rows:
+            self._landmarks.setdefault(fileName, {})[index] = ([x, y, z], vertexId, distance)
+
+    def _importCsv(self, csvPath):
+        store = LandmarkStore(csvPath, truncate=False)
+        try:
+            for fileName, index, landmark, _ in store.items():
+                self.set(fileName, index, *landmark)
+        finally:
+            store.close()
+        self.flush()
+
+
+#
+# SessionJournal
+#
+
+class SessionJournal(LandmarkJournal):
+    """
+    LandmarkJournal that keeps its operation log in the edits table of a SessionDatabase instead of a file.
+    """
+
+    def __init__(self, database, truncate=True, maximumHistory=1000):
+        self.logPath = None
+        self.store = database
+        self.maximumHistory = maximumHistory
+        self._undoStack = []
+        self._redoStack = []
+        self._file = None
+        if not truncate and self.replay() > len(self._undoStack) + 2 * len(self._redoStack):
+            self.checkpoint()
+
+    def flush(self):
+        self.store.flush()
+
+    def close(self):
+        self.checkpoint()
+
+    def _entries(self):
+        return self.store.edits()
+
+    def _rewrite(self, entries):
+        self.store.replaceEdits(entries)
+
+    def _write(self, entry):
+        self.store.appendEdit(entry)
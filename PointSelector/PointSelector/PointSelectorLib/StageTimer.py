@@ -0,0 +1,140 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+#
+# StageTimer
+#
+
+class StageTimer:
+    """
+    Wall clock timers for named stages of the annotation loop.
+
+    Each measurement is kept in a rolling window per stage for percentile statistics and, if a trace file is set,
+    appended to it as one JSON line. The trace file is rotated to <trace>.1 when it exceeds maximumTraceBytes.
+    When disabled, stage() costs a single attribute check.
+    """
+
+    def __init__(self, enabled=True, windowSize=1000, maximumTraceBytes=10 * 1024 * 1024):
+        self.enabled = enabled
+        self.windowSize = windowSize
+        self.maximumTraceBytes = maximumTraceBytes
+        self._durations = {}
+        self._lock = threading.Lock()
+        self._traceFile = None
+        self._tracePath = None
+        self._sessionStart = time.time()
+        self._completedModels = 0
+
+    def setTracePath(self, tracePath):
+        """
+        Write measurements to a JSONL file, None stops tracing.
+        """
+        with self._lock:
+            if self._traceFile is not None:
+                self._traceFile.close()
+                self._traceFile = None
+            self._tracePath = tracePath
+            if tracePath:
+                os.makedirs(os.path.dirname(tracePath), exist_ok=True)
+                self._traceFile = open(tracePath, "a")
+
+    def reset(self):
+        """
+        Clear statistics and restart the throughput clock, e.g. when a new session starts.
+        """
+        with self._lock:
+            self._durations = {}
+            self._sessionStart = time.time()
+            self._completedModels = 0
+
+    @contextlib.contextmanager
+    def _measure(self, name):
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - startTime)
+
+    def stage(self, name):
+        """
+        Context manager measuring the enclosed block as stage name.
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._measure(name)
+
+    def add(self, name, seconds):
+        """
+        Record a measurement of seconds for stage name.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            durations = self._durations.get(name)
+            if durations is None:
+                durations = self._durations[name] = deque(maxlen=self.windowSize)
+            durations.append(seconds)
+            if self._traceFile is not None:
+                self._traceFile.write(json.dumps({"t": time.time(), "stage": name, "ms": seconds * 1000.0}) + "\n")
+                if self._traceFile.tell() > self.maximumTraceBytes:
+                    self._rotate()
+
+    def modelCompleted(self):
+        """
+        Count one finished model for the throughput estimate.
+        """
+        with self._lock:
+            self._completedModels += 1
+
+    def stats(self):
+        """
+        Return {stage: {"count", "p50_ms", "p95_ms", "max_ms"}} over the rolling window of each stage.
+        """
+        with self._lock:
+            durations = {name: sorted(values) for name, values in self._durations.items()}
+        stats = {}
+        for name, values in durations.items():
+            count = len(values)
+            stats[name] = {
+                "count": count,
+                "p50_ms": values[min(count - 1, count // 2)] * 1000.0,
+                "p95_ms": values[min(count - 1, int(count * 0.95))] * 1000.0,
+                "max_ms": values[-1] * 1000.0,
+            }
+        return stats
+
+    def modelsPerHour(self):
+        hours = (time.time() - self._sessionStart) / 3600.0
+        return self._completedModels / hours if hours > 0 else 0.0
+
+    def flush(self):
+        with self._lock:
+            if self._traceFile is not None:
+                self._traceFile.flush()
+
+    def close(self):
+        self.setTracePath(None)
+
+    def _rotate(self):
+        self._traceFile.close()
+        os.replace(self._tracePath, self._tracePath + ".1")
+        self._traceFile = open(self._tracePath, "a")
+
+
+def timedMethod(name):
+    """
+    Decorator measuring a method as stage name with the StageTimer in the timer attribute of its instance.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.timer.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
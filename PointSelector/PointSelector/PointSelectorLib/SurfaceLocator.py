@@ -0,0 +1,49 @@
+import math
+
+import vtk
+
+
+#
+# SurfaceLocator
+#
+
+class SurfaceLocator:
+    """
+    Static cell and point locators of a model, built once so that snapping a position to the surface
+    only costs a tree lookup.
+    """
+
+    SNAP_MODES = ("surface", "vertex")
+
+    def __init__(self, polyData):
+        self.polyData = polyData
+        self.cellLocator = vtk.vtkStaticCellLocator()
+        self.cellLocator.SetDataSet(polyData)
+        self.cellLocator.BuildLocator()
+        self.pointLocator = vtk.vtkStaticPointLocator()
+        self.pointLocator.SetDataSet(polyData)
+        self.pointLocator.BuildLocator()
+        # rough estimate of the locator arrays (cell and point ids plus bucket offsets)
+        self.nbytes = 16 * (polyData.GetNumberOfCells() + polyData.GetNumberOfPoints())
+
+    def snap(self, position, mode="surface"):
+        """
+        Return (snappedPosition, vertexId, distance) for a position.
+        mode "surface" snaps to the closest point on any cell, vertexId is then the closest vertex to that point.
+        mode "vertex" snaps to the closest vertex.
+        distance is between the given position and the snapped position.
+        """
+        if mode not in self.SNAP_MODES:
+            raise ValueError(f"Invalid snap mode {mode}, expected one of {self.SNAP_MODES}")
+        position = [float(p) for p in position]
+        if mode == "vertex":
+            vertexId = self.pointLocator.FindClosestPoint(position)
+            closestPoint = list(self.polyData.GetPoint(vertexId))
+        else:
+            closestPoint = [0.0, 0.0, 0.0]
+            cellId = vtk.reference(0)
+            subId = vtk.reference(0)
+            distance2 = vtk.reference(0.0)
+            self.cellLocator.FindClosestPoint(position, closestPoint, cellId, subId, distance2)
+            vertexId = self.pointLocator.FindClosestPoint(closestPoint)
+        return closestPoint, vertexId, math.dist(position, closestPoint)
@@ -0,0 +1,197 @@
+import json
+import math
+import os
+import threading
+
+import numpy as np
+from vtk.util.numpy_support import vtk_to_numpy
+
+from .ModelProxies import ContentHashes
+
+
+#
+# View frames of models (no MRML scene access, usable without the GUI)
+#
+
+def computeViewFrame(polyData, landmarkPositions=None):
+    """
+    Return the principal axes frame of a model as a JSON serializable dictionary:
+    center (mean of the points), axes (rows, from the largest to the smallest principal axis), extents (half lengths
+    of the oriented bounding box along the axes, around the center) and, if landmarkPositions are given, the
+    landmark region: landmarkCenter, landmarkRadius, and landmarkLocal and landmarkRelativeRadius (the center in the
+    frame divided by extents and the radius divided by the model radius, comparable between models of different size
+    and pose).
+    Axis signs are chosen so the points are skewed towards the positive side, which makes the frames of similar
+    shapes point the same way.
+    """
+    points = vtk_to_numpy(polyData.GetPoints().GetData()).astype(np.float64)
+    center = points.mean(axis=0)
+    centered = points - center
+    _, vectors = np.linalg.eigh(centered.T @ centered)
+    axes = vectors[:, ::-1].T
+    local = centered @ axes.T
+    signs = np.where((local ** 3).sum(axis=0) < 0, -1.0, 1.0)
+    # keep a right handed frame, the smallest axis is the least reliable one
+    signs[2] = signs[0] * signs[1] * np.linalg.det(axes)
+    axes *= signs[:, None]
+    local *= signs
+    extents = np.maximum(np.abs(local).max(axis=0), 1e-6)
+    frame = {
+        "center": center.tolist(),
+        "axes": axes.tolist(),
+        "extents": extents.tolist(),
+        "landmarkCenter": None,
+        "landmarkRadius": None,
+        "landmarkLocal": None,
+        "landmarkRelativeRadius": None,
+    }
+    if landmarkPositions is not None and len(landmarkPositions):
+        frame.update(landmarkRegion(frame, landmarkPositions))
+    return frame
+
+
+def landmarkRegion(frame, landmarkPositions):
+    """
+    Return the landmark region entries of a frame (see computeViewFrame) for landmark positions on its model.
+    """
+    positions = np.asarray(landmarkPositions, dtype=np.float64).reshape(-1, 3)
+    landmarkCenter = positions.mean(axis=0)
+    landmarkRadius = float(np.linalg.norm(positions - landmarkCenter, axis=1).max())
+    local = np.asarray(frame["axes"]) @ (landmarkCenter - np.asarray(frame["center"])) / np.asarray(frame["extents"])
+    return {"landmarkCenter": landmarkCenter.tolist(), "landmarkRadius": landmarkRadius, "landmarkLocal": local.tolist(),
+            "landmarkRelativeRadius": landmarkRadius / float(np.linalg.norm(frame["extents"]))}
+
+
+def landmarkPrior(frames):
+    """
+    Return the median landmarkLocal and landmarkRelativeRadius of the frames that have a landmark region,
+    or None if there are none.
+    """
+    known = [frame for frame in frames if frame.get("landmarkLocal") is not None]
+    if not known:
+        return None
+    return (np.median([frame["landmarkLocal"] for frame in known], axis=0).tolist(),
+            float(np.median([frame["landmarkRelativeRadius"] for frame in known])))
+
+
+def expectedLandmarkRegion(frame, prior):
+    """
+    Return (center, radius) of the region of a model where its landmarks are expected, from the landmark regions
+    of other models (see landmarkPrior) mapped into its frame, or None without a prior.
+    """
+    if prior is None:
+        return None
+    local, relativeRadius = prior
+    extents = np.asarray(frame["extents"])
+    center = np.asarray(frame["center"]) + np.asarray(frame["axes"]).T @ (np.asarray(local) * extents)
+    return center.tolist(), relativeRadius * float(np.linalg.norm(extents))
+
+
+def cameraParameters(frame, region=None, viewAngle=30.0, margin=1.2, minimumRadiusFraction=0.25):
+    """
+    Return (position, focalPoint, viewUp) of a camera showing a model, looking along the smallest principal axis
+    of its frame with the largest axis horizontal, from the side of the landmarks.
+    :param region: (center, radius) to zoom on, e.g. the landmarks of the model or expectedLandmarkRegion;
+      the whole model by default. The radius is at least minimumRadiusFraction of the model radius.
+    :param viewAngle: vertical view angle of the camera in degrees
+    :param margin: space kept around the region, as a factor of its radius
+    """
+    axes = np.asarray(frame["axes"])
+    modelCenter = np.asarray(frame["center"])
+    modelRadius = float(np.linalg.norm(frame["extents"]))
+    if region is None:
+        focalPoint, radius = modelCenter, modelRadius
+    else:
+        focalPoint = np.asarray(region[0], dtype=np.float64)
+        radius = max(float(region[1]), minimumRadiusFraction * modelRadius)
+    side = -1.0 if np.dot(focalPoint - modelCenter, axes[2]) < 0 else 1.0
+    distance = margin * radius / math.sin(math.radians(viewAngle) / 2.0)
+    position = focalPoint + side * distance * axes[2]
+    return position.tolist(), focalPoint.tolist(), axes[1].tolist()
+
+
+#
+# ViewFrameCache
+#
+
+class ViewFrameCache:
+    """
+    View frames (see computeViewFrame) of the models of a directory in a JSON file next to models_ids.csv,
+    keyed by file name and valid as long as the content hash of the model does not change.
+    Files of another CACHE_VERSION are ignored, their frames are computed again.
+    """
+
+    # 2: frames are in RAS coordinates, version 1 used the coordinates of the model files
+    CACHE_VERSION = 2
+
+    def __init__(self, path, hashes=None):
+        self.path = path
+        self.hashes = hashes or ContentHashes()
+        # {FileName: {"hash": content hash, "frame": frame}}
+        self._entries = {}
+        self._modified = False
+        # landmarkPrior of the cached frames, computed again after frames with landmarks are added
+        self._prior = None
+        self._priorValid = False
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                content = json.load(file)
+            if content.get("version") == self.CACHE_VERSION:
+                self._entries = content["models"]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, modelDir, fileName):
+        """
+        Return the cached frame of a model, or None if there is none for its current content.
+        """
+        with self._lock:
+            entry = self._entries.get(fileName)
+        if entry is None or entry["hash"] != self.hashes.get(os.path.join(modelDir, fileName)):
+            return None
+        return entry["frame"]
+
+    def put(self, modelDir, fileName, frame, contentHash=None):
+        contentHash = contentHash or self.hashes.get(os.path.join(modelDir, fileName))
+        with self._lock:
+            self._entries[fileName] = {"hash": contentHash, "frame": frame}
+            self._modified = True
+            if frame.get("landmarkLocal") is not None:
+                self._priorValid = False
+
+    def getOrCompute(self, modelDir, fileName, polyData, landmarkPositions=None):
+        """
+        Return the cached frame of a model, computing and caching it if needed.
+        """
+        frame = self.get(modelDir, fileName)
+        if frame is None:
+            frame = computeViewFrame(polyData, landmarkPositions)
+            self.put(modelDir, fileName, frame)
+        return frame
+
+    def expectedLandmarkRegion(self, frame):
+        """
+        Return expectedLandmarkRegion of a frame from the landmark regions of all cached frames.
+        """
+        with self._lock:
+            if not self._priorValid:
+                self._prior = landmarkPrior([entry["frame"] for entry in self._entries.values()])
+                self._priorValid = True
+            prior = self._prior
+        return expectedLandmarkRegion(frame, prior)
+
+    def save(self):
+        """
+        Write the cache if frames were added, through a temporary file renamed into place.
+        """
+        with self._lock:
+            if not self._modified:
+                return
+            temporaryPath = self.path + ".tmp"
+            with open(temporaryPath, "w") as file:
+                json.dump({"version": self.CACHE_VERSION, "models": self._entries}, file)
+            os.replace(temporaryPath, self.path)
+            self._modified = False
@@ -0,0 +1,203 @@
+import contextlib
+import glob
+import logging
+import os
+import re
+import socket
+import sqlite3
+import time
+
+from .LandmarkStore import LandmarkStore
+
+
+#
+# Sharing the models of a cohort between annotators
+#
+
+def annotatorFileName(annotator):
+    """
+    Return annotator reduced to characters that are safe in file names.
+    """
+    name = re.sub(r"[^A-Za-z0-9_-]+", "_", annotator or "").strip("_")
+    if not name:
+        raise ValueError(f"Invalid annotator name {annotator!r}")
+    return name
+
+
+def landmarkShardPath(modelDir, annotator):
+    """
+    Return the path of the landmarks file of one annotator: landmarks.<annotator>.csv in the model directory.
+    """
+    return os.path.join(modelDir, f"landmarks.{annotatorFileName(annotator)}.csv")
+
+
+def landmarkShardPaths(modelDir):
+    """
+    Return {annotator: path} of all landmark shards of a model directory.
+    """
+    shards = {}
+    for path in sorted(glob.glob(os.path.join(glob.escape(modelDir), "landmarks.*.csv"))):
+        annotator = os.path.basename(path)[len("landmarks."):-len(".csv")]
+        if annotator and "." not in annotator:
+            shards[annotator] = path
+    return shards
+
+
+#
+# WorkQueue
+#
+
+class WorkQueue:
+    """
+    Models of a cohort shared between annotators through a SQLite database in the model directory.
+    An annotator claims a few models at a time with a lease; models are only handed to one annotator until
+    they are completed, released, or their lease expires (e.g. when a session crashed), then they are claimed again.
+    Claims and completions are transactions, so any number of sessions on the same machine can share the queue.
+    SQLite locking is not reliable on network file systems: keep the database on a local disk.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS models (
+            fileName TEXT PRIMARY KEY,
+            position INTEGER NOT NULL,
+            annotator TEXT,
+            host TEXT,
+            pid INTEGER,
+            leaseExpires REAL,
+            done INTEGER NOT NULL DEFAULT 0,
+            completedBy TEXT,
+            completedAt REAL
+        )
+    """
+
+    def __init__(self, dbPath, annotator, leaseSeconds=3600):
+        self.dbPath = dbPath
+        self.annotator = annotator
+        self.leaseSeconds = leaseSeconds
+        with self._transaction() as connection:
+            connection.execute(self.SCHEMA)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # one connection per transaction, so the queue can be used from any thread
+        connection = sqlite3.connect(self.dbPath, timeout=60, isolation_level=None)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+    def addModels(self, fileNames):
+        """
+        Add model files in model id order. Files already in the queue keep their state.
+        """
+        with self._transaction() as connection:
+            start = connection.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM models").fetchone()[0]
+            connection.executemany("INSERT OR IGNORE INTO models (fileName, position) VALUES (?, ?)",
+                                   [(fileName, start + i) for i, fileName in enumerate(fileNames)])
+
+    def claim(self, count=1):
+        """
+        Lease up to count models that are not done and not leased by another annotator, in model id order.
+        Models this annotator already holds (e.g. from a crashed session) come first. Returns their file names.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            rows = connection.execute(
+                "SELECT fileName FROM models WHERE done = 0 AND (annotator IS NULL OR annotator = ? OR leaseExpires < ?) "
+                "ORDER BY (annotator IS NOT NULL AND annotator = ?) DESC, position LIMIT ?",
+                (self.annotator, now, self.annotator, count)).fetchall()
+            fileNames = [row[0] for row in rows]
+            connection.executemany(
+                "UPDATE models SET annotator = ?, host = ?, pid = ?, leaseExpires = ? WHERE fileName = ?",
+                [(self.annotator, socket.gethostname(), os.getpid(), now + self.leaseSeconds, fileName) for fileName in fileNames])
+        return fileNames
+
+    def renew(self):
+        """
+        Extend the leases of all models claimed by this annotator and not done yet.
+        """
+        with self._transaction() as connection:
+            connection.execute("UPDATE models SET leaseExpires = ? WHERE annotator = ? AND done = 0",
+                               (time.time() + self.leaseSeconds, self.annotator))
+
+    def complete(self, fileName):
+        with self._transaction() as connection:
+            connection.execute("UPDATE models SET done = 1, completedBy = ?, completedAt = ?, leaseExpires = NULL "
+                               "WHERE fileName = ?", (self.annotator, time.time(), fileName))
+
+    def release(self, fileNames=None):
+        """
+        Give back claimed models that are not done, all models of this annotator by default.
+        """
+        with self._transaction() as connection:
+            if fileNames is None:
+                connection.execute("UPDATE models SET annotator = NULL, leaseExpires = NULL WHERE annotator = ? AND done = 0",
+                                   (self.annotator,))
+            else:
+                connection.executemany("UPDATE models SET annotator = NULL, leaseExpires = NULL "
+                                       "WHERE fileName = ? AND annotator = ? AND done = 0",
+                                       [(fileName, self.annotator) for fileName in fileNames])
+
+    def owners(self):
+        """
+        Return {fileName: annotator} of the completed models.
+        """
+        with self._transaction() as connection:
+            return dict(connection.execute("SELECT fileName, completedBy FROM models WHERE done = 1").fetchall())
+
+    def status(self):
+        """
+        Return the number of models that are done, claimed and waiting.
+        """
+        with self._transaction() as connection:
+            done, claimed, total = connection.execute(
+                "SELECT SUM(done), SUM(done = 0 AND annotator IS NOT NULL AND leaseExpires >= ?), COUNT(*) FROM models",
+                (time.time(),)).fetchone()
+        done, claimed, total = done or 0, claimed or 0, total or 0
+        return {"done": done, "claimed": claimed, "waiting": total - done - claimed}
+
+
+def mergeLandmarkShards(shardPaths, outputPath, owners=None):
+    """
+    Merge the landmark shards of several annotators ({annotator: path}) into one landmarks file in the landmarks.csv format.
+    All landmarks of a model are taken from a single shard: the annotator who completed the model according to owners
+    ({fileName: annotator}, see WorkQueue.owners), otherwise the first annotator (in name order) with the most landmarks.
+    Returns {"models": number of merged models, "landmarks": number of landmarks, "conflicts": [fileName, ...]}
+    where conflicts lists the models annotated in more than one shard.
+    """
+    owners = owners or {}
+    models = {}
+    for annotator, path in sorted(shardPaths.items()):
+        store = LandmarkStore(path, truncate=False)
+        try:
+            for fileName, index, landmark, _ in store.items():
+                models.setdefault(fileName, {}).setdefault(annotator, {})[index] = landmark
+        finally:
+            store.close()
+
+    conflicts = []
+    output = LandmarkStore(outputPath, fsyncPolicy="flush", maximumBufferedRows=10000)
+    landmarkCount = 0
+    try:
+        for fileName in sorted(models):
+            shards = models[fileName]
+            if len(shards) > 1:
+                conflicts.append(fileName)
+            owner = owners.get(fileName)
+            owner = annotatorFileName(owner) if owner else None
+            if owner not in shards:
+                owner = max(sorted(shards), key=lambda annotator: len(shards[annotator]))
+            for index, (position, vertexId, distance) in sorted(shards[owner].items()):
+                output.set(fileName, index, position, vertexId, distance)
+                landmarkCount += 1
+    finally:
+        output.close()
+    if conflicts:
+        logging.warning(f"{len(conflicts)} models were annotated by several annotators, e.g. {conflicts[0]}")
+    return {"models": len(models), "landmarks": landmarkCount, "conflicts": conflicts}
@@ -0,0 +1,58 @@
+import importlib
+import sys
+import types
+
+# Names are imported from their module on first use (PEP 562), so importing the package when Slicer discovers
+# the module does not load numpy, vtk or the session code.
+_EXPORTS = {
+    "AnnotationSession": ("AnnotationSession", "ModelList"),
+    "Benchmark": ("BENCHMARK_FORMAT_VERSION", "benchmarkResults", "compareBenchmarkResults", "importTimes", "peakMemoryBytes",
+                  "readBenchmarkResults", "writeBenchmarkResults", "writeSyntheticCohort"),
+    "DirectoryScanner": ("scanDirectory", "scanModelFile"),
+    "LandmarkExport": ("EXPORT_FORMATS", "landmarkColumns", "writeLandmarkColumns"),
+    "LandmarkJournal": ("LandmarkJournal", "LandmarkOperation"),
+    "LandmarkQA": ("generalizedProcrustes", "landmarkArray", "landmarkOutliers", "reviewOrder"),
+    "LandmarkStore": ("LandmarkStore",),
+    "LandmarkSuggestions": ("LandmarkPrior", "LandmarkSuggester", "MeshFeatures", "computeMeshFeatures", "curvatureFeatures",
+                            "geodesicDistances", "shapeIndex"),
+    "LandmarkTransfer": ("TRANSFER_METHODS", "listModelFiles", "readTemplateLandmarks", "rigidAlignmentTransform", "transferLandmarks"),
+    "MarkupsFiles": ("MARKUPS_SCHEMA", "validateMarkupsFile", "validateMarkupsFiles", "writeBackLandmarks", "writeMarkupsPositions"),
+    "ModelEnumerator": ("ModelEnumerator", "iterModelFiles"),
+    "ModelManifest": ("ModelManifest",),
+    "ModelPrefetcher": ("ModelCache", "ModelPrefetcher", "PrefetchedModel", "markupsFilePath", "readMarkupsFile", "readModelFile"),
+    "ModelProxies": ("ContentHashes", "ProxyBuilder", "ProxyCache", "decimatePolyData", "fileContentHash", "writeRawPolyData"),
+    "NormalizedModels": ("NormalizedModelBuilder", "NormalizedModelCache"),
+    "SessionDatabase": ("SessionDatabase", "SessionJournal"),
+    "StageTimer": ("StageTimer", "timedMethod"),
+    "SurfaceLocator": ("SurfaceLocator",),
+    "ViewFrames": ("ViewFrameCache", "cameraParameters", "computeViewFrame", "expectedLandmarkRegion", "landmarkPrior",
+                   "landmarkRegion"),
+    "WorkQueue": ("WorkQueue", "annotatorFileName", "landmarkShardPath", "landmarkShardPaths", "mergeLandmarkShards"),
+}
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = sorted(_MODULES)
+
+
+def __getattr__(name):
+    module = _MODULES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_MODULES))
+
+
+class _LazyPackage(types.ModuleType):
+    def __setattr__(self, name, value):
+        # importing a submodule binds it to the package; most classes are named like their module and must win
+        if name in _MODULES and isinstance(value, types.ModuleType):
+            return
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _LazyPackage